@@ -22,18 +22,22 @@ def main():
     # See allnoconfig.py
     kconf.warn = False
 
+    values = {}
+
     for sym in kconf.unique_defined_syms:
         if sym.orig_type == kconfiglib.BOOL:
             # 'bool' choice symbols get their default value, as determined by
             # e.g. 'default's on the choice
             if not sym.choice:
                 # All other bool symbols get set to 'y', like for allyesconfig
-                sym.set_value(2)
+                values[sym] = 2
         elif sym.orig_type == kconfiglib.TRISTATE:
-            sym.set_value(1)
+            values[sym] = 1
 
     for choice in kconf.unique_choices:
-        choice.set_value(2 if choice.orig_type == kconfiglib.BOOL else 1)
+        values[choice] = 2 if choice.orig_type == kconfiglib.BOOL else 1
+
+    kconf.set_values(values)
 
     kconf.warn = True
 
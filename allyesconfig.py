@@ -27,23 +27,23 @@ def main():
     #
     # Assigning 0/1/2 to non-bool/tristate symbols has no effect (int/hex
     # symbols still take a string, because they preserve formatting).
-    for sym in kconf.unique_defined_syms:
-        # Set choice symbols to 'm'. This value will be ignored for choices in
-        # 'y' mode (the "normal" mode), which will instead just get their
-        # default selection, but will set all symbols in m-mode choices to 'm',
-        # which is as high as they can go.
-        #
-        # Here's a convoluted example of how you might get an m-mode choice
-        # even during allyesconfig:
-        #
-        #   choice
-        #           tristate "weird choice"
-        #           depends on m
-        sym.set_value(1 if sym.choice else 2)
+    #
+    # Choice symbols are set to 'm'. This value will be ignored for choices in
+    # 'y' mode (the "normal" mode), which will instead just get their default
+    # selection, but will set all symbols in m-mode choices to 'm', which is as
+    # high as they can go.
+    #
+    # Here's a convoluted example of how you might get an m-mode choice even
+    # during allyesconfig:
+    #
+    #   choice
+    #           tristate "weird choice"
+    #           depends on m
+    kconf.set_values((sym, 1 if sym.choice else 2)
+                     for sym in kconf.unique_defined_syms)
 
     # Set all choices to the highest possible mode
-    for choice in kconf.unique_choices:
-        choice.set_value(2)
+    kconf.set_values((choice, 2) for choice in kconf.unique_choices)
 
     kconf.warn = True
 
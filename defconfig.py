@@ -13,6 +13,7 @@ The default output filename is '.config'. A different filename can be passed in
 the KCONFIG_CONFIG environment variable.
 """
 import argparse
+import sys
 
 import kconfiglib
 
@@ -27,6 +28,12 @@ def main():
         default="Kconfig",
         help="Top-level Kconfig file (default: Kconfig)")
 
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print timings and counters from Kconfiglib to stderr at the "
+             "end (see kconfiglib.Stats)")
+
     parser.add_argument(
         "config",
         metavar="CONFIGURATION",
@@ -34,10 +41,14 @@ def main():
 
     args = parser.parse_args()
 
-    kconf = kconfiglib.Kconfig(args.kconfig, suppress_traceback=True)
+    kconf = kconfiglib.Kconfig(args.kconfig, suppress_traceback=True,
+                               stats=args.stats)
     print(kconf.load_config(args.config))
     print(kconf.write_config())
 
+    if args.stats:
+        sys.stderr.write(str(kconf.stats))
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,55 @@
+# Prints how much memory a parsed Kconfig tree uses, in total and per defined
+# symbol, with the default settings and with the memory-saving 'lazy_help' and
+# 'compact' parameters to Kconfig.__init__().
+#
+# Memory is measured with the tracemalloc module (Python 3.4+), which counts
+# the bytes allocated by Python while parsing that are still in use after
+# parsing.
+#
+# Usage:
+#
+#   $ make [ARCH=<arch>] scriptconfig SCRIPT=Kconfiglib/examples/memory_usage.py
+#
+# Example output for a generated Kconfig tree with 20000 symbols and short
+# help texts:
+#
+#   Settings                    Total (KiB)   Bytes/symbol
+#   default                           32098           1643
+#   lazy_help                         32145           1645
+#   compact                           20718           1060
+#   lazy_help, compact                20751           1062
+
+import gc
+import sys
+import tracemalloc
+
+from kconfiglib import Kconfig
+
+
+def measure(**kwargs):
+    # Returns (<bytes in use>, <number of defined symbols>) after parsing the
+    # Kconfig files with the Kconfig.__init__() arguments in 'kwargs'
+
+    gc.collect()
+    tracemalloc.start()
+    kconf = Kconfig(sys.argv[1] if len(sys.argv) > 1 else "Kconfig",
+                    warn=False, **kwargs)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return size, len(kconf.unique_defined_syms)
+
+
+print("{:<24}{:>15}{:>15}".format("Settings", "Total (KiB)", "Bytes/symbol"))
+
+for lazy_help, compact in (False, False), (True, False), (False, True), \
+                          (True, True):
+
+    size, n_syms = measure(lazy_help=lazy_help, compact=compact)
+
+    settings = ", ".join(name for name, enabled in (("lazy_help", lazy_help),
+                                                    ("compact", compact))
+                         if enabled) or "default"
+
+    print("{:<24}{:>15}{:>15}".format(settings, size//1024, size//n_syms))
@@ -7,12 +7,29 @@
 Generates a header file with #defines from the configuration, matching the
 format of include/generated/autoconf.h in the Linux kernel.
 
-Optionally, also writes the configuration output as a .config file. See
---config-out.
+Optionally, also writes the configuration output as a .config file, and in
+other formats (JSON, CMake, etc.). See --config-out and --format. All outputs
+are generated in a single pass over the configuration.
 
 The --sync-deps, --file-list, and --env-list options generate information that
 can be used to avoid needless rebuilds/reconfigurations.
 
+With --batch, outputs are generated for many configuration files (e.g.
+defconfig files for different boards) with a single parse of the Kconfig
+files. The jobs run in parallel on systems with fork(). The manifest is a JSON
+list of objects like the following, where all keys except "config" are
+optional:
+
+  {
+    "config": "configs/board_defconfig",
+    "header_path": "out/board/config.h",
+    "config_out": "out/board/.config",
+    "formats": {"json": "out/board/config.json"}
+  }
+
+"config" is the configuration file to load, and the other keys correspond to
+the command-line options. Only the listed outputs are generated.
+
 Before writing a header or configuration file, Kconfiglib compares the old
 contents of the file against the new contents. If there's no change, the write
 is skipped. This avoids updating file metadata like the modification time, and
@@ -21,6 +38,10 @@ might save work depending on your build setup.
 By default, the configuration is generated from '.config'. A different
 configuration file can be passed in the KCONFIG_CONFIG environment variable.
 
+If the KCONFIG_SERVER environment variable points to a running Kconfig server
+(see kconfigserver.py), the server is used instead of parsing the Kconfig
+files.
+
 A custom header string can be inserted at the beginning of generated
 configuration and header files by setting the KCONFIG_CONFIG_HEADER and
 KCONFIG_AUTOHEADER_HEADER environment variables, respectively (this also works
@@ -33,10 +54,12 @@ handy way to define multi-line variables in makefiles, for use with custom
 headers. Remember to export the variable to the environment.
 """
 import argparse
+import json
 import os
 import sys
 
 import kconfiglib
+import kconfigserver
 
 
 DEFAULT_SYNC_DEPS_PATH = "deps/"
@@ -68,6 +91,18 @@ deps/auto.conf instead. --config-out is meant for cases where incremental build
 information isn't needed.
 """)
 
+    parser.add_argument(
+        "--format",
+        metavar="FORMAT=OUTPUT_FILE",
+        action="append",
+        default=[],
+        help="""
+Also write the configuration in the format FORMAT to OUTPUT_FILE. Can be given
+multiple times. FORMAT is one of {}. 'autoconf' is the format of
+include/config/auto.conf in the Linux kernel, and 'rust' the format of
+include/generated/rustc_cfg.
+""".format(", ".join(sorted(kconfiglib.OUTPUT_FORMATS))))
+
     parser.add_argument(
         "--sync-deps",
         metavar="OUTPUT_DIR",
@@ -99,6 +134,31 @@ included, and not variables referenced with the older $VAR syntax (which is
 only supported for backwards compatibility).
 """)
 
+    parser.add_argument(
+        "--batch",
+        metavar="MANIFEST",
+        help="""
+Generate outputs for each configuration file listed in the JSON file
+MANIFEST, with a single parse of the Kconfig files. See the description
+above. Can't be combined with --header-path, --config-out, --format, or
+--sync-deps.
+""")
+
+    parser.add_argument(
+        "--jobs", "-j",
+        metavar="N",
+        type=int,
+        help="""
+Number of worker processes to use with --batch (default: the number of
+CPUs).
+""")
+
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print timings and counters from Kconfiglib to stderr at the "
+             "end (see kconfiglib.Stats)")
+
     parser.add_argument(
         "kconfig",
         metavar="KCONFIG",
@@ -108,28 +168,77 @@ only supported for backwards compatibility).
 
     args = parser.parse_args()
 
-
-    kconf = kconfiglib.Kconfig(args.kconfig, suppress_traceback=True)
+    outputs = []
+    for output in args.format:
+        fmt, sep, path = output.partition("=")
+        if not (sep and path):
+            parser.error("expected FORMAT=OUTPUT_FILE for --format, got '{}'"
+                         .format(output))
+        if fmt not in kconfiglib.OUTPUT_FORMATS:
+            parser.error("unknown output format '{}' (expected one of {})"
+                         .format(fmt,
+                                 ", ".join(sorted(kconfiglib.OUTPUT_FORMATS))))
+        outputs.append((fmt, path))
+
+    if args.batch is not None:
+        if outputs or args.header_path is not None or \
+           args.config_out is not None or args.sync_deps is not None:
+            parser.error("--batch can't be combined with --header-path, "
+                         "--config-out, --format, or --sync-deps")
+
+        kconf = kconfiglib.Kconfig(args.kconfig, suppress_traceback=True,
+                                   stats=args.stats, lazy_help=True)
+        failed = _run_batch(kconf, args.batch, args.jobs)
+        _write_lists(kconf, args)
+        _print_stats(kconf, args)
+        if failed:
+            sys.exit(1)
+        return
+
+    # Use a running Kconfig server if there is one. See kconfigserver.py. The
+    # client supports the Kconfig methods used below. Statistics are only
+    # available when parsing locally.
+    kconf = None if args.stats else kconfigserver.connect(args.kconfig)
+    if not kconf:
+        kconf = kconfiglib.Kconfig(args.kconfig, suppress_traceback=True,
+                                   stats=args.stats, lazy_help=True)
     kconf.load_config()
 
     if args.header_path is None:
-        if "KCONFIG_AUTOHEADER" in os.environ:
-            kconf.write_autoconf()
-        else:
-            # Kconfiglib defaults to include/generated/autoconf.h to be
-            # compatible with the C tools. 'config.h' is used here instead for
-            # backwards compatibility. It's probably a saner default for tools
-            # as well.
-            kconf.write_autoconf("config.h")
+        # Kconfiglib defaults to include/generated/autoconf.h to be compatible
+        # with the C tools. 'config.h' is used here instead for backwards
+        # compatibility. It's probably a saner default for tools as well.
+        header_path = os.getenv("KCONFIG_AUTOHEADER", "config.h")
     else:
-        kconf.write_autoconf(args.header_path)
+        header_path = args.header_path
+
+    outputs.insert(0, ("header", header_path))
 
     if args.config_out is not None:
-        kconf.write_config(args.config_out, save_old=False)
+        outputs.insert(1, ("config", args.config_out))
+
+    # Generate all outputs in a single pass. Messages are not printed, for
+    # backwards compatibility.
+    kconf.write_outputs(outputs)
 
     if args.sync_deps is not None:
         kconf.sync_deps(args.sync_deps)
 
+    _write_lists(kconf, args)
+    _print_stats(kconf, args)
+
+
+def _print_stats(kconf, args):
+    # Prints statistics for --stats. Jobs run in worker processes with
+    # --batch are not included.
+
+    if args.stats:
+        sys.stderr.write(str(kconf.stats))
+
+
+def _write_lists(kconf, args):
+    # Writes the --file-list and --env-list files
+
     if args.file_list is not None:
         with _open_write(args.file_list) as f:
             for path in kconf.kconfig_filenames:
@@ -141,6 +250,50 @@ only supported for backwards compatibility).
                 f.write("{}={}\n".format(env_var, os.environ[env_var]))
 
 
+def _run_batch(kconf, manifest_path, processes):
+    # Runs the jobs from the --batch manifest. Prints warnings and errors, and
+    # returns True if any job failed.
+
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (EnvironmentError, ValueError) as e:
+        sys.exit("{}: failed to read batch manifest: {}"
+                 .format(manifest_path, e))
+
+    jobs = []
+    for entry in manifest:
+        if "config" not in entry:
+            sys.exit("{}: manifest entry without a \"config\" key: {}"
+                     .format(manifest_path, entry))
+
+        outputs = []
+        if "header_path" in entry:
+            outputs.append(("header", entry["header_path"]))
+        if "config_out" in entry:
+            outputs.append(("config", entry["config_out"]))
+        for fmt, path in sorted(entry.get("formats", {}).items()):
+            if fmt not in kconfiglib.OUTPUT_FORMATS:
+                sys.exit("{}: unknown output format '{}' for {}"
+                         .format(manifest_path, fmt, entry["config"]))
+            outputs.append((fmt, path))
+
+        jobs.append((entry["config"], outputs))
+
+    failed = False
+    for (config, _), (_, warnings, error) in \
+        zip(jobs, kconf.write_outputs_batch(jobs, processes)):
+
+        for warning in warnings:
+            sys.stderr.write("{}: {}\n".format(config, warning))
+
+        if error is not None:
+            sys.stderr.write("{}: error: {}\n".format(config, error))
+            failed = True
+
+    return failed
+
+
 def _open_write(path):
     # Python 2/3 compatibility. io.open() is available on both, but makes
     # write() expect 'unicode' strings on Python 2.
@@ -254,6 +254,9 @@ def _needs_save():
         # Assignments to undefined symbols in the .config
         return True
 
+    # Faster than calculating the values one by one below
+    _kconf.evaluate_all()
+
     for sym in _kconf.unique_defined_syms:
         if sym.user_value is None:
             if sym.config_string:
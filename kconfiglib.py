@@ -503,6 +503,19 @@ expected by the function (excluding the implicit 'name' argument). If
 <max.args> is None, there is no upper limit to the number of arguments. Passing
 an invalid number of arguments will generate a KconfigError exception.
 
+An optional fourth element in the tuple says whether the function is pure,
+meaning that its result only depends on its arguments and that calling it has
+no side effects. Results of pure functions are memoized, so that they're only
+called once for a given set of arguments. Functions are assumed to be impure
+by default.
+
+Results of recursively expanded variables (and functions defined with them)
+are memoized in the same way, as long as the expansion only calls pure
+functions and the variables it references keep their values. The built-in
+$(shell,...) function is treated as pure, meaning each command is only run
+once per parse, while $(filename), $(lineno), $(info), $(warning-if), and
+$(error-if) are impure.
+
 Functions can access the current parsing location as kconf.filename/linenr.
 Accessing other fields of the Kconfig object is not safe. See the warning
 below.
@@ -537,6 +550,36 @@ lead to a crash.
 Preferably, user-defined functions should be stateless.
 
 
+Caching $(shell,...) results
+----------------------------
+
+Kconfig files that probe the toolchain (e.g. with $(shell,$(CC) ...) in
+cc-option-style macros) can spend most of their parsing time running
+commands. If the KCONFIG_SHELL_CACHE environment variable is set, it gives the
+path to a file where the results of $(shell,...) commands are saved, and
+reused in later runs.
+
+Results are looked up by the command string, together with the current
+directory, $PATH, the values of any environment variables the command
+references as $VAR or ${VAR}, and the value of KCONFIG_SHELL_CACHE_SALT.
+Results are never considered stale otherwise. Put anything else that can
+change the output of commands in KCONFIG_SHELL_CACHE_SALT, e.g. the path and
+modification time of the compiler, or a checksum of its --version output.
+
+KCONFIG_SHELL_CACHE_SIZE gives the maximum number of results to keep (default:
+1000). The least recently used results are dropped first.
+
+If KCONFIG_SHELL_PREFETCH is set to a number N above zero, the commands run
+during the previous parse are started up front, in N threads, and their
+results are used if the same commands come up during parsing. This speeds up
+parsing when the cached results can't be used (e.g. after the salt changes).
+Only use it if the commands have no side effects, as commands that no longer
+come up during parsing will still have been run.
+
+Shell caching is only supported on Python 3, and the environment variables
+are ignored on Python 2.
+
+
 Feedback
 ========
 
@@ -550,7 +593,10 @@ import re
 import sys
 
 # Get rid of some attribute lookups. These are obvious in context.
+from functools import partial
 from glob import iglob
+from heapq import heappop, heappush
+from itertools import chain
 from os.path import dirname, exists, expandvars, islink, join, realpath
 
 
@@ -809,12 +855,41 @@ class Kconfig(object):
     filename/linenr:
       The current parsing location, for use in Python preprocessor functions.
       See the module docstring.
+
+    stats:
+      A Stats instance with timings and counters, or None if statistics are
+      disabled (the default). See the 'stats' parameter to Kconfig.__init__().
     """
     __slots__ = (
+        "_change_log",
+        "_compact",
+        "_compiled_exprs",
         "_encoding",
+        "_eval_index",
+        "_eval_order",
+        "_expr_table",
+        "_expansion_deps",
+        "_expansion_memo",
+        "_file_parents",
         "_functions",
+        "_generation",
+        "_help_file",
+        "_init_args",
+        "_lazy_help",
+        "_n_impure_calls",
+        "_pending_invalidation",
+        "_prelex_done",
+        "_prelex_pool",
+        "_prelexed",
+        "_pure_functions",
+        "_raw_nodes",
+        "_raw_types",
         "_set_match",
+        "_shell_cache",
         "_srctree_prefix",
+        "_structural_files",
+        "_touched",
+        "_tracked_vals",
         "_unset_match",
         "_warn_assign_no_prompt",
         "choices",
@@ -834,6 +909,7 @@ class Kconfig(object):
         "n",
         "named_choices",
         "srctree",
+        "stats",
         "syms",
         "top_node",
         "unique_choices",
@@ -850,6 +926,7 @@ class Kconfig(object):
         # Parsing-related
         "_parsing_kconfigs",
         "_readline",
+        "_source_globs",
         "filename",
         "linenr",
         "_include_path",
@@ -858,6 +935,9 @@ class Kconfig(object):
         "_tokens",
         "_tokens_i",
         "_reuse_tokens",
+        "_help_texts",
+        "_imply_terms",
+        "_select_terms",
     )
 
     #
@@ -865,7 +945,9 @@ class Kconfig(object):
     #
 
     def __init__(self, filename="Kconfig", warn=True, warn_to_stderr=True,
-                 encoding="utf-8", suppress_traceback=False):
+                 encoding="utf-8", suppress_traceback=False, cache_dir=None,
+                 stats=False, lex_processes=None, reloadable=False,
+                 lazy_help=False, compact=False):
         """
         Creates a new Kconfig object by parsing Kconfig files.
         Note that Kconfig files are not the same as .config files (which store
@@ -942,9 +1024,86 @@ class Kconfig(object):
 
           Other exceptions besides EnvironmentError and KconfigError are still
           propagated when suppress_traceback is True.
+
+        cache_dir (default: None):
+          Directory for caching the parsed configuration between runs. If
+          None, the KCONFIG_CACHE_DIR environment variable is used if set. If
+          neither is set, no caching is done.
+
+          When caching is enabled, the fully parsed and finalized configuration
+          is saved to a file in 'cache_dir' after parsing. Later runs reuse it
+          instead of parsing the Kconfig files, provided that none of the files
+          in 'kconfig_filenames' have changed (as determined by their size and
+          modification time), that the environment variables in 'env_vars'
+          (and any 'option env' variables) have the same values, and that the
+          Kconfiglib version and parsing-related settings are the same.
+          Warnings generated during parsing are replayed from the cache.
+
+          Gotchas: Changes to the output of $(shell,...) and user-defined
+          preprocessor functions are not detected, and output from $(info,...)
+          is not replayed. Clear 'cache_dir' if e.g. the output of a toolchain
+          probe might have changed.
+
+          The cache directory is created if it does not exist. Errors related
+          to reading and writing the cache are silently ignored, falling back
+          on parsing the Kconfig files. Caching is only supported on Python 3,
+          and 'cache_dir' is ignored on Python 2.
+
+        stats (default: False):
+          If True, the time spent in various phases (parsing, loading and
+          writing configuration files, etc.) and some counters (lines parsed,
+          $(shell) commands run, values calculated, etc.) are recorded in
+          Kconfig.stats, for finding out where time goes. See the Stats class.
+          This adds a small overhead.
+
+        lex_processes (default: None):
+          If larger than 1, Kconfig files are read and tokenized ahead of the
+          parser in a pool of that many worker processes, starting with the
+          top-level Kconfig file and following 'source' statements. The
+          parser picks up the tokens for the files the workers have finished
+          with, and tokenizes any remaining lines itself.
+
+          Only lines without '$' and '\\' are tokenized in the workers, as
+          macro expansion depends on earlier preprocessor assignments. The
+          result is the same as without 'lex_processes'.
+
+          If None, the KCONFIG_LEX_PROCESSES environment variable is used if
+          set. Requires fork(), and is ignored on systems without it. This
+          only pays off for large Kconfig trees on machines with many cores.
+
+        reloadable (default: False):
+          If True, some extra information is kept after parsing, so that
+          reload() can reparse just the Kconfig files that changed. This uses
+          some extra memory. 'cache_dir' is ignored when 'reloadable' is True.
+
+        lazy_help (default: False):
+          If True, help texts are not read in during parsing. Only their
+          locations are recorded, and MenuNode.help reads the help text from
+          the Kconfig file when it's first accessed. This saves some time and
+          memory for tools that never look at help texts, like genconfig.
+
+          The Kconfig files must not be modified while the Kconfig instance is
+          in use (except if followed by reload()), as the wrong help text might
+          be read in otherwise. Help texts that haven't been read in are lost
+          for the changed files if reload() fails.
+
+        compact (default: False):
+          If True, the parsed configuration is stored more compactly after
+          parsing, which saves memory for very large Kconfig trees:
+
+            - Empty Symbol/Choice/MenuNode.defaults, selects, implies, ranges,
+              and Symbol.nodes lists are replaced by a single shared empty
+              tuple
+
+            - Some internal sets are replaced by tuples
+
+          The public attributes work the same otherwise, but must not be
+          modified in-place (e.g. with append()). See the
+          examples/memory_usage.py script for measuring the savings.
         """
         try:
-            self._init(filename, warn, warn_to_stderr, encoding)
+            self._init(filename, warn, warn_to_stderr, encoding, cache_dir,
+                       stats, lex_processes, reloadable, lazy_help, compact)
         except (EnvironmentError, KconfigError) as e:
             if suppress_traceback:
                 cmd = sys.argv[0]  # Empty string if missing
@@ -956,11 +1115,37 @@ class Kconfig(object):
                 sys.exit(cmd + str(e).strip())
             raise
 
-    def _init(self, filename, warn, warn_to_stderr, encoding):
+    def _init(self, filename, warn, warn_to_stderr, encoding, cache_dir,
+              stats, lex_processes, reloadable, lazy_help, compact):
         # See __init__()
 
+        # Used by reload() to reparse everything
+        self._init_args = (filename, encoding, cache_dir, stats,
+                           lex_processes, reloadable, lazy_help, compact)
+
+        self._compact = compact
+
+        self._lazy_help = lazy_help
+        # (<filename>, <lines>) for the Kconfig file help texts were last read
+        # in from by _load_help(), or None
+        self._help_file = None
+        # Maps help texts to themselves during parsing, for sharing a single
+        # string between identical help texts
+        self._help_texts = {}
+        # Used to share identical expressions during finalization. See
+        # _share_expr().
+        self._expr_table = None
+
+        self.stats = stats = Stats() if stats else None
+        if stats:
+            t = stats._clock()
+
         self._encoding = encoding
 
+        # Set up by _start_prelexing(), if Kconfig files are tokenized in
+        # worker processes
+        self._prelex_pool = self._prelex_done = self._prelexed = None
+
         self.srctree = os.getenv("srctree", "")
         # A prefix we can reliably strip from glob() results to get a filename
         # relative to $srctree. relpath() can cause issues for symlinks,
@@ -974,6 +1159,11 @@ class Kconfig(object):
         self.warn_assign_redun = True
         self._warn_assign_no_prompt = True
 
+        # Set of symbols and choices whose user values changed while
+        # invalidation is deferred, or None if invalidation is not deferred.
+        # See _defer_invalidation().
+        self._pending_invalidation = None
+
         self.warnings = []
 
         self.config_prefix = os.getenv("CONFIG_", "CONFIG_")
@@ -1016,6 +1206,24 @@ class Kconfig(object):
         # Maps preprocessor variables names to Variable instances
         self.variables = {}
 
+        # Compiled expressions, shared between symbols and choices. See
+        # _compile_expr().
+        self._compiled_exprs = {}
+
+        # Order in which evaluate_all() evaluates symbols and choices.
+        # Calculated on the first call.
+        self._eval_order = None
+        # Maps symbols and choices to their index in _eval_order. See
+        # _update_changed().
+        self._eval_index = None
+
+        # Change tracking state. See track_changes().
+        self._touched = self._tracked_vals = self._change_log = None
+
+        # Incremented by reload(), which creates new lists of symbols and
+        # choices. Used to reject stale snapshots in restore().
+        self._generation = 0
+
         # Predefined preprocessor functions, with min/max number of arguments
         self._functions = {
             "info":       (_info_fn,       1, 1),
@@ -1035,6 +1243,63 @@ class Kconfig(object):
         except ImportError:
             pass
 
+        # Functions whose results only depend on their arguments, which can be
+        # memoized. $(shell,...) commands are assumed to give the same output
+        # throughout parsing. User-defined functions can declare themselves
+        # pure with a fourth tuple element. See the module docstring.
+        self._pure_functions = set(["shell"])
+        for name, fn_info in self._functions.items():
+            if len(fn_info) > 3:
+                if fn_info[3]:
+                    self._pure_functions.add(name)
+                else:
+                    self._pure_functions.discard(name)
+
+        # Memoized preprocessor expansions, the dependency list for the
+        # current one, and the number of calls to impure functions. See
+        # _fn_val().
+        self._expansion_memo = {}
+        self._expansion_deps = None
+        self._n_impure_calls = 0
+
+        # Cache for $(shell,...) results, or None if disabled
+        if os.getenv("KCONFIG_SHELL_CACHE") and not _IS_PY2:
+            self._shell_cache = _ShellCache(
+                os.environ["KCONFIG_SHELL_CACHE"],
+                os.getenv("KCONFIG_SHELL_CACHE_SALT", ""),
+                int(os.getenv("KCONFIG_SHELL_CACHE_SIZE", "1000")),
+                int(os.getenv("KCONFIG_SHELL_PREFETCH", "0")))
+        else:
+            self._shell_cache = None
+
+        # Set up for reload() further down, if 'reloadable' is True
+        self._file_parents = self._structural_files = self._raw_nodes = \
+            self._raw_types = None
+
+        if cache_dir is None:
+            cache_dir = os.getenv("KCONFIG_CACHE_DIR")
+
+        if cache_dir and not _IS_PY2 and not reloadable:
+            cache_filename = join(cache_dir, self._cache_name(filename))
+            if stats:
+                t = stats._lap("init", t)
+
+            loaded = self._load_cache(cache_filename)
+
+            if stats:
+                t = stats._lap("parse_cache_load", t)
+                stats.counts["parse_cache_hits" if loaded else
+                             "parse_cache_misses"] += 1
+
+            if loaded:
+                return
+
+            # Records the 'source' globs, so that the cache can be invalidated
+            # if the set of files they match changes
+            self._source_globs = []
+        else:
+            cache_filename = self._source_globs = None
+
         # This determines whether previously unseen symbols are registered.
         # They shouldn't be if we parse expressions after parsing, as part of
         # Kconfig.eval_string().
@@ -1070,11 +1335,27 @@ class Kconfig(object):
         self.filename = filename
         self.linenr = 0
 
+        if reloadable:
+            # Maps each Kconfig file to the menu node it was sourced into and
+            # its include path, and records the files that have statements
+            # that can affect other files. See reload().
+            self._file_parents = {filename: (self.top_node, ())}
+            self._structural_files = set()
+
         # Used to avoid retokenizing lines when we discover that they're not
         # part of the construct currently being parsed. This is kinda like an
         # unget operation.
         self._reuse_tokens = False
 
+        if stats:
+            t = stats._lap("init", t)
+
+        if lex_processes is None:
+            lex_processes = int(os.getenv("KCONFIG_LEX_PROCESSES", "0"))
+
+        if lex_processes > 1 and hasattr(os, "fork"):
+            self._start_prelexing(join(self.srctree, filename), lex_processes)
+
         # Open the top-level Kconfig file. Store the readline() method directly
         # as a small optimization.
         self._readline = self._open(join(self.srctree, filename), "r").readline
@@ -1087,19 +1368,72 @@ class Kconfig(object):
             self.top_node.next = None
         except UnicodeDecodeError as e:
             _decoding_error(e, self.filename)
+        finally:
+            if self._shell_cache:
+                self._shell_cache.close()
+            if self._prelexed is not None:
+                self._stop_prelexing()
+
+        if self._shell_cache:
+            self._shell_cache.save()
 
         # Close the top-level Kconfig file. __self__ fetches the 'file' object
         # for the method.
         self._readline.__self__.close()
 
         self._parsing_kconfigs = False
+        self._help_texts = None
+
+        if stats:
+            t = stats._lap("parse", t)
+            # Lines in the top-level Kconfig file. Sourced files are counted
+            # in _leave_file().
+            stats.counts["lines"] += self.linenr
+            stats.counts["files"] = len(self.kconfig_filenames)
+
+        if reloadable:
+            self._save_raw()
 
-        # Do various menu tree post-processing
+        t = self._finalize(t if stats else None)
+
+        if cache_filename:
+            self._save_cache(cache_filename)
+
+            if stats:
+                stats._lap("parse_cache_save", t)
+
+    def _finalize(self, t):
+        # Does the post-parsing steps: Finalizes the menu tree, does sanity
+        # checks, and builds and checks the dependency graph. Used by _init()
+        # and reload(). 't' is the time for Stats._lap(), or None if
+        # statistics are disabled, and the updated time is returned.
+
+        stats = self.stats
+
+        # Do various menu tree post-processing. The terms of the (weak) reverse
+        # dependencies are collected in _select/_imply_terms, which map
+        # symbols to lists of terms, and ORed together afterwards. See
+        # _add_props_to_sym().
+        self._select_terms = {}
+        self._imply_terms = {}
+        self._expr_table = {}
         self._finalize_node(self.top_node, self.y)
+        # Drop the table of expressions to save memory
+        self._expr_table = None
+
+        make_or_all = self._make_or_all  # Micro-optimization
+        for target, terms in self._select_terms.items():
+            target.rev_dep = make_or_all(terms)
+        for target, terms in self._imply_terms.items():
+            target.weak_rev_dep = make_or_all(terms)
+        self._select_terms = self._imply_terms = None
 
         self.unique_defined_syms = _ordered_unique(self.defined_syms)
         self.unique_choices = _ordered_unique(self.choices)
 
+        if stats:
+            t = stats._lap("finalize", t)
+
         # Do sanity checks. Some of these depend on everything being finalized.
         self._check_sym_sanity()
         self._check_choice_sanity()
@@ -1111,17 +1445,77 @@ class Kconfig(object):
 
             self._check_undef_syms()
 
+        if stats:
+            t = stats._lap("check_sanity", t)
+
         # Build Symbol._dependents for all symbols and choices
         self._build_dep()
 
+        if stats:
+            t = stats._lap("build_dep", t)
+
         # Check for dependency loops
-        check_dep_loop_sym = _check_dep_loop_sym  # Micro-optimization
+        check_dep_loop = _check_dep_loop  # Micro-optimization
         for sym in self.unique_defined_syms:
-            check_dep_loop_sym(sym, False)
+            check_dep_loop(sym)
 
-        # Add extra dependencies from choices to choice symbols that get
-        # awkward during dependency loop detection
+        # Add extra dependencies from choices to choice symbols and from
+        # MODULES to tristate items that get awkward during dependency loop
+        # detection
         self._add_choice_deps()
+        self._add_modules_deps()
+
+        if stats:
+            t = stats._lap("check_dep_loop", t)
+
+        if self._compact:
+            self._compact_tree()
+
+            if stats:
+                t = stats._lap("compact", t)
+
+        return t
+
+    def _compact_tree(self):
+        # Makes the finalized configuration use less memory, for the 'compact'
+        # parameter to __init__(). Empty property lists are replaced by the
+        # empty tuple (a singleton), and the _dependents sets, which are only
+        # iterated over after finalization, by tuples.
+        #
+        # Filenames and include paths need no extra work here. All menu nodes
+        # from a Kconfig file already share a single filename string and
+        # include path tuple (see _enter_file()).
+        #
+        # _refinalize() puts fresh lists back before redoing _finalize().
+
+        for node in chain((self.top_node,), self.node_iter()):
+            if not node.defaults:
+                node.defaults = ()
+            if not node.selects:
+                node.selects = ()
+            if not node.implies:
+                node.implies = ()
+            if not node.ranges:
+                node.ranges = ()
+
+        for sc in chain(self.syms.values(), self.const_syms.values(),
+                        self.choices):
+            if not sc.defaults:
+                sc.defaults = ()
+            sc._dependents = tuple(sc._dependents)
+
+        for sym in self.const_syms.values():
+            # Undefined symbols are left alone, as reload() might add menu
+            # nodes to them
+            sym.nodes = ()
+
+        for sym in chain(self.syms.values(), self.const_syms.values()):
+            if not sym.selects:
+                sym.selects = ()
+            if not sym.implies:
+                sym.implies = ()
+            if not sym.ranges:
+                sym.ranges = ()
 
     @property
     def mainmenu_text(self):
@@ -1146,6 +1540,84 @@ class Kconfig(object):
 
         return None
 
+    def reload(self, changed_files):
+        """
+        Updates the configuration after some of the Kconfig files have been
+        modified, without reparsing the files that didn't change. This makes
+        it cheap for long-running tools (e.g. menuconfig interfaces and
+        servers) to pick up changes to the Kconfig files. User values are kept
+        for symbols and choices that still exist.
+
+        changed_files:
+          Iterable of the Kconfig files that have changed, as they appear in
+          Kconfig.kconfig_filenames.
+
+        The menu nodes from the changed files are reparsed and put in place of
+        the old ones. The properties, dependencies, and dependency loop checks
+        for all symbols and choices are then redone from the menu tree, as in
+        __init__(). This is much faster than parsing.
+
+        All Kconfig files are reparsed instead (also keeping user values) if
+        any of the following is true:
+
+          - The Kconfig instance wasn't created with reloadable=True
+
+          - A changed file has or had 'source', 'mainmenu', or
+            'option defconfig_list' statements, preprocessor variable
+            assignments, or macros. These can affect other files.
+
+          - A changed file is sourced more than once, is no longer there, or
+            had no menu nodes
+
+          - A symbol or choice defined in a changed file is or was also defined
+            in some other file
+
+        Warnings from the sanity checks done after parsing are generated
+        again. User values that are no longer valid, e.g. because a symbol
+        changed type, are dropped without warnings.
+
+        Raises the same exceptions as __init__(), e.g. for syntax errors. The
+        configuration is left as it was in that case, except that help texts
+        from the changed files that haven't been read in yet with 'lazy_help'
+        are lost (MenuNode.help is None for them), as the old versions of the
+        files are gone.
+
+        Returns a string with a message saying what was reparsed, for logging.
+        """
+        # Help texts are reread from the new versions of the files
+        self._help_file = None
+
+        changed = _ordered_unique(changed_files)
+        if not changed:
+            return "No Kconfig files changed"
+
+        # _reload_all() moves over the state of a new Kconfig instance,
+        # generation included
+        generation = self._generation
+
+        try:
+            reason = self._reload_changed(changed)
+            if reason is None:
+                msg = "Reparsed " + ", ".join(changed)
+            else:
+                self._reload_all()
+                msg = "Reparsed all Kconfig files ({})".format(reason)
+        except Exception:
+            # The old menu nodes are back, but lazily loaded help texts would
+            # be read from the new versions of the files
+            if self._lazy_help:
+                changed_set = set(changed)
+                for node in self.node_iter():
+                    if getattr(node, "_help", None).__class__ is tuple and \
+                       node.filename in changed_set:
+                        node._help = None
+            raise
+
+        # Snapshots from before the reload can't be restored
+        self._generation = generation + 1
+
+        return msg
+
     def load_config(self, filename=None, replace=True, verbose=None):
         """
         Loads symbol values from a file in the .config format. Equivalent to
@@ -1233,6 +1705,12 @@ class Kconfig(object):
         # is normal and expected within a .config file.
         self._warn_assign_no_prompt = False
 
+        if self.stats:
+            t = self.stats._clock()
+
+        # Invalidate dependent symbols once, after all values have been loaded
+        deferred = self._defer_invalidation()
+
         # This stub only exists to make sure _warn_assign_no_prompt gets
         # reenabled
         try:
@@ -1241,6 +1719,11 @@ class Kconfig(object):
             _decoding_error(e, filename)
         finally:
             self._warn_assign_no_prompt = True
+            if deferred:
+                self._flush_invalidation()
+
+            if self.stats:
+                self.stats._lap("load_config", t)
 
         return ("Loaded" if replace else "Merged") + msg
 
@@ -1461,44 +1944,7 @@ class Kconfig(object):
         # write_autoconf() helper. Returns the contents to write as a string,
         # with 'header' or KCONFIG_AUTOHEADER_HEADER at the beginning.
 
-        if header is None:
-            header = self.header_header
-
-        chunks = [header]  # "".join()ed later
-        add = chunks.append
-
-        for sym in self.unique_defined_syms:
-            # _write_to_conf is determined when the value is calculated. This
-            # is a hidden function call due to property magic.
-            #
-            # Note: In client code, you can check if sym.config_string is empty
-            # instead, to avoid accessing the internal _write_to_conf variable
-            # (though it's likely to keep working).
-            val = sym.str_value
-            if not sym._write_to_conf:
-                continue
-
-            if sym.orig_type in _BOOL_TRISTATE:
-                if val == "y":
-                    add("#define {}{} 1\n"
-                        .format(self.config_prefix, sym.name))
-                elif val == "m":
-                    add("#define {}{}_MODULE 1\n"
-                        .format(self.config_prefix, sym.name))
-
-            elif sym.orig_type is STRING:
-                add('#define {}{} "{}"\n'
-                    .format(self.config_prefix, sym.name, escape(val)))
-
-            else:  # sym.orig_type in _INT_HEX:
-                if sym.orig_type is HEX and \
-                   not val.startswith(("0x", "0X")):
-                    val = "0x" + val
-
-                add("#define {}{} {}\n"
-                    .format(self.config_prefix, sym.name, val))
-
-        return "".join(chunks)
+        return self._outputs_contents((HeaderWriter(header),))[0]
 
     def write_config(self, filename=None, header=None, save_old=True,
                      verbose=None):
@@ -1583,9 +2029,127 @@ class Kconfig(object):
     def _config_contents(self, header):
         # write_config() helper. Returns the contents to write as a string,
         # with 'header' or KCONFIG_CONFIG_HEADER at the beginning.
+
+        return self._outputs_contents((ConfigWriter(header),))[0]
+
+    def write_outputs(self, outputs):
+        """
+        Writes the configuration to several files, in different formats, with
+        a single pass over the configuration. This is faster than calling e.g.
+        write_config() and write_autoconf() separately.
+
+        Like for write_autoconf(), files whose contents wouldn't change are
+        left untouched. No <filename>.old backups are saved.
+
+        outputs:
+          An iterable of (writer, filename) tuples. 'writer' is either the
+          name of an output format in OUTPUT_FORMATS (e.g. "header" or
+          "json"), or an OutputWriter instance. See the OutputWriter class for
+          how to implement new formats.
+
+        Returns a list with a message for each file, saying whether it got
+        saved or had no changes. Raises KconfigError for unknown format names.
+        """
+        writers = []
+        filenames = []
+        for writer, filename in outputs:
+            if not isinstance(writer, OutputWriter):
+                if writer not in OUTPUT_FORMATS:
+                    raise KconfigError("unknown output format '{}'"
+                                       .format(writer))
+                writer = OUTPUT_FORMATS[writer]()
+
+            writers.append(writer)
+            filenames.append(filename)
+
+        msgs = []
+        for filename, content in zip(filenames,
+                                     self._outputs_contents(writers)):
+            if self._write_if_changed(filename, content):
+                msgs.append("Configuration saved to '{}'".format(filename))
+            else:
+                msgs.append("No change to configuration in '{}'"
+                            .format(filename))
+
+        return msgs
+
+    def write_outputs_batch(self, jobs, processes=None):
+        """
+        Generates output files for many configurations with a single parse of
+        the Kconfig files. This is useful e.g. for generating headers for
+        many defconfig files in CI.
+
+        On systems with fork(), the jobs are run in parallel in a pool of
+        worker processes, forked after parsing, so that they share the parsed
+        Kconfig tree. Otherwise, they're run one after another.
+
+        Symbol values in this Kconfig instance are unchanged afterwards.
+
+        jobs:
+          An iterable of (config_filename, outputs) tuples. 'config_filename'
+          is a configuration file to load with load_config() (e.g. a
+          defconfig file), and 'outputs' is like for write_outputs(). When
+          running in parallel, OutputWriter instances in 'outputs' must be
+          picklable.
+
+        processes (default: None):
+          Number of worker processes. If None, the number of CPUs is used.
+          If 1, the jobs are run in this process.
+
+        Returns a list of (messages, warnings, error) tuples, one per job, in
+        the same order as 'jobs'. 'messages' is a list with the message from
+        load_config() followed by the messages from write_outputs().
+        'warnings' is a list of the warnings generated by the job (these are
+        not printed, regardless of Kconfig.warn_to_stderr). 'error' is None if
+        the job succeeded, and an error message otherwise (e.g. for a missing
+        configuration file).
+        """
+        jobs = list(jobs)
+
+        # Only import as needed, to save some startup time
+        import multiprocessing
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        if processes < 2 or len(jobs) < 2 or not hasattr(os, "fork"):
+            with self.snapshot():
+                return [_write_outputs_job(self, job) for job in jobs]
+
+        import gc
+
+        # Compile expressions and calculate the evaluation order before
+        # forking, so that the workers share them instead of each one
+        # redoing the work
+        self.evaluate_all()
+
+        # Python 3.4+ supports other ways of starting workers. Sharing the
+        # parsed tree requires fork().
+        if hasattr(multiprocessing, "get_context"):
+            multiprocessing = multiprocessing.get_context("fork")
+
+        # gc.freeze() (Python 3.7+) keeps the garbage collector in the workers
+        # from touching the objects from parsing, which would force their
+        # memory to be copied
+        if hasattr(gc, "freeze"):
+            gc.freeze()
+
+        pool = multiprocessing.Pool(processes, _init_batch_worker, (self,))
+        try:
+            return pool.map(_run_batch_job, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+            if hasattr(gc, "unfreeze"):
+                gc.unfreeze()
+
+    def _outputs_contents(self, writers):
+        # Generates output with the OutputWriters in 'writers' in a single
+        # tree walk. Returns a list with the output of each writer, as strings.
         #
         # More memory friendly would be to 'yield' the strings and
-        # "".join(_config_contents()), but it was a bit slower on my system.
+        # "".join() them, but it was a bit slower on my system.
 
         # node_iter() was used here before commit 3aea9f7 ("Add '# end of
         # <menu>' after menus in .config"). Those comments get tricky to
@@ -1594,14 +2158,17 @@ class Kconfig(object):
         for sym in self.unique_defined_syms:
             sym._visited = False
 
-        if header is None:
-            header = self.config_header
+        self.evaluate_all()
 
-        chunks = [header]  # "".join()ed later
-        add = chunks.append
+        if self.stats:
+            t = self.stats._clock()
 
-        # Did we just print an '# end of ...' comment?
-        after_end_comment = False
+        # List of (writer, chunks) tuples. The chunks are "".join()ed later.
+        outputs = [(writer, [writer.start(self)]) for writer in writers]
+
+        # Bound methods, for speed
+        sym_fns = [(writer.symbol, chunks.append)
+                   for writer, chunks in outputs]
 
         node = self.top_node
         while 1:
@@ -1614,21 +2181,21 @@ class Kconfig(object):
                 while node.parent:
                     node = node.parent
 
-                    # Add a comment when leaving visible menus
+                    # Leaving a visible menu
                     if node.item is MENU and expr_value(node.dep) and \
                        expr_value(node.visibility) and \
                        node is not self.top_node:
-                        add("# end of {}\n".format(node.prompt[0]))
-                        after_end_comment = True
+                        for writer, chunks in outputs:
+                            chunks.append(writer.menu_end(node))
 
                     if node.next:
                         node = node.next
                         break
                 else:
                     # No more nodes
-                    return "".join(chunks)
+                    break
 
-            # Generate configuration output for the node
+            # Generate output for the node
 
             item = node.item
 
@@ -1637,23 +2204,31 @@ class Kconfig(object):
                     continue
                 item._visited = True
 
-                conf_string = item.config_string
-                if not conf_string:
+                # _write_to_conf is determined when the value is calculated.
+                # This is a hidden function call due to property magic.
+                item.str_value
+                if not item._write_to_conf:
                     continue
 
-                if after_end_comment:
-                    # Add a blank line before the first symbol printed after an
-                    # '# end of ...' comment
-                    after_end_comment = False
-                    add("\n")
-                add(conf_string)
+                for symbol_fn, add in sym_fns:
+                    add(symbol_fn(item))
 
             elif expr_value(node.dep) and \
                  ((item is MENU and expr_value(node.visibility)) or
                   item is COMMENT):
 
-                add("\n#\n# {}\n#\n".format(node.prompt[0]))
-                after_end_comment = False
+                for writer, chunks in outputs:
+                    chunks.append(writer.menu(node))
+
+        for writer, chunks in outputs:
+            chunks.append(writer.end())
+
+        res = ["".join(chunks) for _, chunks in outputs]
+
+        if self.stats:
+            self.stats._lap("write", t)
+
+        return res
 
     def write_min_config(self, filename, header=None):
         """
@@ -1699,6 +2274,8 @@ class Kconfig(object):
         if header is None:
             header = self.config_header
 
+        self.evaluate_all()
+
         chunks = [header]  # "".join()ed later
         add = chunks.append
 
@@ -1797,6 +2374,8 @@ class Kconfig(object):
         # Load old values from auto.conf, if any
         self._load_old_vals(path)
 
+        self.evaluate_all()
+
         for sym in self.unique_defined_syms:
             # _write_to_conf is determined when the value is calculated. This
             # is a hidden function call due to property magic.
@@ -1987,12 +2566,257 @@ class Kconfig(object):
 
         return expr_value(self._expect_expr_and_eol())
 
+    def set_values(self, values):
+        """
+        Sets the user values of many symbols and choices at once. Equivalent
+        to calling Symbol/Choice.set_value() on each item, but faster when
+        values have been calculated: Items that depend on the assigned symbols
+        and choices are invalidated once, after all values have been assigned,
+        instead of after each assignment.
+
+        Values are assigned in order, so a later assignment to the same symbol
+        or choice wins.
+
+        values:
+          A dict that maps Symbol and Choice instances to values, or an
+          iterable of (Symbol/Choice, value) pairs. Symbols can also be given
+          by name, in which case they are looked up in Kconfig.syms. See
+          Symbol.set_value() for the format of the values.
+
+        Returns a list with the items whose value was invalid for their type,
+        in order. The list is empty if all values were valid. Like for
+        Symbol.set_value(), warnings are printed for invalid values by default.
+        """
+        if hasattr(values, "items"):
+            values = values.items()
+
+        invalid = []
+
+        deferred = self._defer_invalidation()
+        try:
+            for item, value in values:
+                if item.__class__ is str:
+                    item = self.syms[item]
+
+                if not item.set_value(value):
+                    invalid.append(item)
+        finally:
+            if deferred:
+                self._flush_invalidation()
+
+        return invalid
+
+    def evaluate_all(self):
+        """
+        Calculates the values of all symbols and choices.
+
+        Values are normally calculated lazily when they're first accessed,
+        which recursively calculates the values of the symbols and choices
+        they depend on. When most values will be needed anyway (e.g. when
+        writing a configuration file), this function is faster, and avoids
+        deep recursion for long dependency chains. It goes through symbols and
+        choices in dependency order, so that values are always calculated
+        from values that are already available.
+
+        The write_*() functions and sync_deps() call this function
+        automatically.
+        """
+        if self.stats:
+            t = self.stats._clock()
+
+        if self._eval_order is None:
+            self._eval_order = self._calc_eval_order()
+
+        # Accessing 'str_value' also calculates 'tri_value' and 'visibility'
+        # for symbols. For choices, 'selection' calculates 'tri_value' and
+        # 'visibility'.
+        for item in self._eval_order:
+            if item.__class__ is Symbol:
+                item.str_value
+            else:
+                item.selection
+
+        if self.stats:
+            self.stats._lap("evaluate_all", t)
+
+    def batch_evaluator(self):
+        """
+        Returns a BatchEvaluator, for evaluating the bool and tristate symbols
+        of many configurations at once. See the BatchEvaluator class.
+        """
+        return BatchEvaluator(self)
+
+    def snapshot(self, cached=False):
+        """
+        Returns a Snapshot of the current configuration, which can be passed
+        to restore() later to roll back any changes made in between. This is
+        cheaper than saving the configuration to a file and loading it back.
+
+        The snapshot holds the user values of all symbols and choices
+        (including Choice.user_selection), and Kconfig.missing_syms. Snapshots
+        taken before a reload() can't be restored.
+
+        The returned Snapshot can also be used as a context manager, which
+        restores the snapshot when the 'with' block exits (even if it exits
+        via an exception). This is handy for trying out changes:
+
+          with kconf.snapshot():
+              kconf.syms["FOO"].set_value(2)
+              print(kconf.syms["BAR"].str_value)
+
+          # Back to the old FOO and BAR values here
+
+        cached (default: False):
+          If True, values that have been calculated are stored in the snapshot
+          as well. restore() then doesn't need to invalidate anything, and
+          values don't have to be recalculated after restoring. This makes the
+          snapshot bigger and a bit slower to take. Using Kconfig.evaluate_all()
+          before taking the snapshot makes sure that all values are included.
+        """
+        return Snapshot(self, cached)
+
+    def restore(self, snapshot):
+        """
+        Restores the configuration to the state it had when the Snapshot
+        'snapshot' was taken. See Kconfig.snapshot().
+
+        For snapshots taken without 'cached', only the symbols and choices
+        whose user values differ from the snapshot (along with the items that
+        depend on them) are invalidated.
+
+        Raises KconfigError if 'snapshot' was taken from a different Kconfig
+        instance, or before a reload().
+        """
+        if snapshot.kconfig is not self:
+            raise KconfigError("snapshot from a different Kconfig instance")
+
+        if snapshot._generation != self._generation:
+            raise KconfigError("snapshot taken before the Kconfig files were "
+                               "reloaded")
+
+        self.missing_syms = list(snapshot._missing_syms)
+
+        sym_was_set, choice_was_set = snapshot._was_set
+        for sym, was_set in zip(self.unique_defined_syms, sym_was_set):
+            sym._was_set = was_set
+        for choice, was_set in zip(self.unique_choices, choice_was_set):
+            choice._was_set = was_set
+
+        if snapshot._cached_vals is not None:
+            # The cached values are consistent with the user values, so no
+            # invalidation is needed
+            sym_vals, choice_vals = snapshot._cached_vals
+
+            for sym, user_value, vals in zip(self.unique_defined_syms,
+                                             snapshot._user_vals, sym_vals):
+                sym.user_value = user_value
+                sym._cached_str_val, sym._cached_tri_val, sym._cached_vis, \
+                    sym._cached_assignable, sym._write_to_conf = vals
+
+            for choice, user_vals, vals in zip(self.unique_choices,
+                                               snapshot._choice_user_vals,
+                                               choice_vals):
+                choice.user_value, choice.user_selection = user_vals
+                choice._cached_vis, choice._cached_assignable, \
+                    choice._cached_selection = vals
+
+            if self._touched is not None:
+                # No invalidation for change tracking to pick up
+                self._touched.update(self.unique_defined_syms)
+                self._touched.update(self.unique_choices)
+
+            return
+
+        deferred = self._defer_invalidation()
+        try:
+            for sym, user_value in zip(self.unique_defined_syms,
+                                       snapshot._user_vals):
+                if sym.user_value != user_value:
+                    sym.user_value = user_value
+                    self._invalidate_assigned(sym)
+
+            for choice, user_vals in zip(self.unique_choices,
+                                         snapshot._choice_user_vals):
+                user_value, user_selection = user_vals
+                if choice.user_value != user_value or \
+                   choice.user_selection is not user_selection:
+                    choice.user_value = user_value
+                    choice.user_selection = user_selection
+                    self._invalidate_assigned(choice)
+        finally:
+            if deferred:
+                self._flush_invalidation()
+
+    def track_changes(self):
+        """
+        Starts keeping track of which symbols and choices change value, so
+        that tools (e.g. menuconfig interfaces) can find out what to update
+        after a change. See changes_since(). Returns the current change epoch
+        (see change_epoch).
+
+        Evaluates all symbols and choices, like evaluate_all(). Calling
+        track_changes() again while changes are being tracked just returns the
+        current change epoch.
+
+        Changes are found by comparing values for the symbols and choices that
+        get invalidated when user values change, so keeping track of changes
+        is cheap, even for large configurations.
+        """
+        if self._touched is None:
+            self.evaluate_all()
+            self._touched = set()
+            self._change_log = []
+            self._tracked_vals = {
+                item: _tracked_value(item)
+                for item in chain(self.unique_defined_syms,
+                                  self.unique_choices)}
+
+        return self.change_epoch
+
+    @property
+    def change_epoch(self):
+        """
+        Number that gets incremented whenever some symbol or choice changes
+        value while changes are being tracked. Pass it to changes_since()
+        later to get the items that changed in between.
+
+        Raises KconfigError if track_changes() hasn't been called.
+        """
+        self._update_changes()
+        return len(self._change_log)
+
+    def changes_since(self, epoch):
+        """
+        Returns a set with the symbols and choices whose str_value, tri_value,
+        visibility, or assignable (or selection, for choices) changed after
+        the change epoch 'epoch' (see change_epoch).
+
+        An item that changes and then changes back is included as well.
+        Example that redraws just the symbols that changed:
+
+          epoch = kconf.track_changes()
+          ...
+          kconf.syms["FOO"].set_value(2)
+          ...
+          for item in kconf.changes_since(epoch):
+              redraw(item)
+          epoch = kconf.change_epoch
+
+        A full reparse in reload() reports all symbols and choices as changed,
+        as they're then new instances.
+
+        Raises KconfigError if track_changes() hasn't been called.
+        """
+        self._update_changes()
+        return set().union(*self._change_log[epoch:])
+
     def unset_values(self):
         """
         Removes any user values from all symbols, as if Kconfig.load_config()
         or Symbol.set_value() had never been called.
         """
         self._warn_assign_no_prompt = False
+        deferred = self._defer_invalidation()
         try:
             # set_value() already rejects undefined symbols, and they don't
             # need to be invalidated (because their value never changes), so we
@@ -2004,6 +2828,8 @@ class Kconfig(object):
                 choice.unset_value()
         finally:
             self._warn_assign_no_prompt = True
+            if deferred:
+                self._flush_invalidation()
 
     def enable_warnings(self):
         """
@@ -2170,6 +2996,9 @@ class Kconfig(object):
         # before entering the file
         self._filestack.append((self._include_path, self._readline))
 
+        if self._prelex_done:
+            self._add_prelexed()
+
         # _include_path is a tuple, so this rebinds the variable instead of
         # doing in-place modification
         self._include_path += ((self.filename, self.linenr),)
@@ -2202,12 +3031,83 @@ class Kconfig(object):
         # Returns from a Kconfig file to the file that sourced it. See
         # _enter_file().
 
+        if self.stats:
+            self.stats.counts["lines"] += self.linenr
+
         # Restore location from parent Kconfig file
         self.filename, self.linenr = self._include_path[-1]
         # Restore include path and 'file' object
         self._readline.__self__.close()  # __self__ fetches the 'file' object
         self._include_path, self._readline = self._filestack.pop()
 
+    def _start_prelexing(self, filename, processes):
+        # Starts tokenizing the Kconfig files in a pool of 'processes' worker
+        # processes, beginning with the top-level Kconfig file 'filename'. Each
+        # finished file is searched for 'source' statements with constant
+        # patterns, and the files they match are tokenized next. Files sourced
+        # via macros are only found by the parser, and get tokenized there.
+        #
+        # The results are maps from lines to (<tokens>, <refs>) tuples,
+        # collected by _add_prelexed(). Symbols can't be passed between
+        # processes, so <tokens> has the names of symbols instead, and <refs>
+        # lists their indices. Since lines without '$' and '\\' tokenize the
+        # same way wherever they appear, the maps from all files can be merged
+        # into one (self._prelexed) and looked up by line in _tokenize().
+
+        # Only import as needed, to save some startup time
+        import multiprocessing
+
+        # Python 3.4+ supports other ways of starting workers. Sharing the
+        # Kconfiglib module with the workers without pickling requires fork().
+        if hasattr(multiprocessing, "get_context"):
+            multiprocessing = multiprocessing.get_context("fork")
+
+        pool = multiprocessing.Pool(processes)
+        done = []
+        submitted = set()
+
+        def submit(filename):
+            # Called from the thread in the pool that handles results as well
+
+            if filename not in submitted:
+                submitted.add(filename)
+                try:
+                    pool.apply_async(
+                        _prelex_file,
+                        (filename, self._srctree_prefix, self._encoding),
+                        callback=finished)
+                except (AssertionError, ValueError):
+                    # The pool has been stopped, because parsing finished.
+                    # Python 2 uses an assertion for this.
+                    pass
+
+        def finished(result):
+            lexed, filenames = result
+            done.append(lexed)
+            for filename in filenames:
+                submit(filename)
+
+        self._prelex_pool = pool
+        self._prelex_done = done
+        self._prelexed = {}
+
+        submit(filename)
+
+    def _add_prelexed(self):
+        # Adds the tokens from files tokenized by the worker processes since
+        # the last call. See _start_prelexing().
+
+        while self._prelex_done:
+            self._prelexed.update(self._prelex_done.pop())
+
+    def _stop_prelexing(self):
+        # Stops the worker processes started by _start_prelexing(), discarding
+        # any unfinished work
+
+        self._prelex_pool.terminate()
+        self._prelex_pool.join()
+        self._prelex_pool = self._prelex_done = self._prelexed = None
+
     def _next_line(self):
         # Fetches and tokenizes the next line from the current Kconfig file.
         # Returns False at EOF and True otherwise.
@@ -2290,6 +3190,199 @@ class Kconfig(object):
             # notice it later
             return False
 
+    def _cache_name(self, filename):
+        # Returns the filename of the parse cache file within the cache
+        # directory. It is derived from everything besides the Kconfig files
+        # themselves that affects parsing. The Kconfig files and environment
+        # variables are checked separately, in _cache_deps_ok().
+
+        import hashlib  # Only import as needed, to save some startup time
+
+        return "kconfiglib-{}.pickle".format(hashlib.sha1(repr((
+            VERSION,
+            sys.version_info[:2],
+            os.getcwd(),
+            self.srctree,
+            filename,
+            self._encoding,
+            self._lazy_help,
+            self._compact,
+            self.warn,
+            os.getenv("KCONFIG_WARN_UNDEF"),
+            os.getenv("KCONFIG_STRICT"),
+            os.getenv("KCONFIG_FUNCTIONS"),
+        )).encode("utf-8")).hexdigest())
+
+    def _cache_deps(self):
+        # Returns the data that is checked by _cache_deps_ok() before a cached
+        # configuration is used: The size and modification time of each
+        # Kconfig file, the values of all environment variables referenced in
+        # the Kconfig files, and the files matched by each 'source' glob
+
+        files = []
+        for filename in _ordered_unique(self.kconfig_filenames):
+            path = join(self.srctree, filename)
+            st = os.stat(path)
+            files.append((path, st.st_size, st.st_mtime))
+
+        env_vars = set(self.env_vars)
+        for sym in self.unique_defined_syms:
+            if sym.env_var is not None:
+                env_vars.add(sym.env_var)
+
+        return (files,
+                [(name, os.getenv(name)) for name in sorted(env_vars)],
+                self._source_globs)
+
+    def _cache_deps_ok(self, deps):
+        # Returns True if the data returned by _cache_deps() still matches the
+        # files and the environment
+
+        files, env_vars, source_globs = deps
+
+        for path, size, mtime in files:
+            try:
+                st = os.stat(path)
+            except EnvironmentError:
+                return False
+            if st.st_size != size or st.st_mtime != mtime:
+                return False
+
+        for name, val in env_vars:
+            if os.getenv(name) != val:
+                return False
+
+        for pattern, filenames in source_globs:
+            if sorted(iglob(pattern)) != filenames:
+                return False
+
+        return True
+
+    def _save_cache(self, filename):
+        # Saves the parsed configuration to the cache file 'filename'. See
+        # the 'cache_dir' parameter to __init__() and _load_cache().
+        #
+        # The object graph is very deeply linked (MenuNode.next chains,
+        # Symbol._dependents, etc.), which would make a plain pickle.dump()
+        # blow the recursion limit. To avoid that, Symbol/Choice/MenuNode/
+        # Variable instances are pickled as empty shells when first
+        # encountered, and their attributes are filled in via separate
+        # _CachedState entries, dumped in batches until no new objects are
+        # found. This keeps the recursion depth down to the depth of
+        # individual expressions.
+
+        # Only import as needed, to save some startup time
+        import copyreg
+        import pickle
+        import tempfile
+
+        objs = []
+
+        def reduce_obj(obj):
+            objs.append(obj)
+            return (copyreg.__newobj__, (obj.__class__,))
+
+        dispatch_table = {cls: reduce_obj for cls in _CACHED_CLASSES}
+        dispatch_table[_CachedState] = _CachedState.reduce
+
+        cache_dir = dirname(filename)
+        tmp_filename = None
+        try:
+            if not exists(cache_dir):
+                os.makedirs(cache_dir)
+
+            # Write to a temporary file and rename it, so that a concurrent
+            # run never sees a partially written cache file
+            fd, tmp_filename = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, "wb") as f:
+                pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+                pickler.dispatch_table = dispatch_table
+
+                pickler.dump(self._cache_deps())
+                pickler.dump(({name: getattr(self, name)
+                               for name in _CACHED_KCONFIG_ATTRS},
+                              self.warnings))
+
+                i = 0
+                while i < len(objs):
+                    new_objs = objs[i:]
+                    i = len(objs)
+                    pickler.dump([_CachedState(obj) for obj in new_objs])
+                pickler.dump(None)
+
+            os.replace(tmp_filename, filename)
+
+        except Exception:
+            # Ignore errors. The cache is just an optimization, and not worth
+            # erroring out over e.g. if the cache directory isn't writable.
+            if tmp_filename is not None:
+                try:
+                    os.remove(tmp_filename)
+                except EnvironmentError:
+                    pass
+
+    def _load_cache(self, filename):
+        # Loads a configuration saved by _save_cache() from the cache file
+        # 'filename'. Returns True if the configuration was loaded, and False
+        # if the cache file is missing, stale, or unusable.
+
+        # Only import as needed, to save some startup time
+        import gc
+        import pickle
+
+        # Unpickling creates lots of objects, which makes the garbage collector
+        # kick in over and over for no benefit. Disabling it roughly halves
+        # the loading time.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(filename, "rb") as f:
+                unpickler = pickle.Unpickler(f)
+
+                if not self._cache_deps_ok(unpickler.load()):
+                    return False
+
+                attrs, warnings = unpickler.load()
+
+                objs = []
+                while True:
+                    # The _CachedState entries unpickle directly to the objects
+                    # they hold, with attributes restored
+                    entries = unpickler.load()
+                    if entries is None:
+                        break
+                    objs += entries
+
+        except Exception:
+            # A missing, corrupt, or incompatible (e.g. pickled by a different
+            # Python version) cache file. Parse the Kconfig files instead.
+            return False
+
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        for name, val in attrs.items():
+            setattr(self, name, val)
+        self._parsing_kconfigs = False
+
+        # Kconfig references are not pickled, since they should point to this
+        # instance. Neither are compiled expressions, which get recompiled on
+        # demand.
+        for obj in objs:
+            obj.kconfig = self
+            if obj.__class__ is Symbol or obj.__class__ is Choice:
+                obj._compiled = None
+
+        # Replay warnings from parsing. _warn() would add a second "warning:"
+        # prefix.
+        for msg in warnings:
+            self.warnings.append(msg)
+            if self.warn_to_stderr:
+                sys.stderr.write(msg + "\n")
+
+        return True
+
     #
     # Tokenization
     #
@@ -2343,9 +3436,38 @@ class Kconfig(object):
         # It might be possible to rewrite this to 'yield' tokens instead,
         # working across multiple lines. Lookback and compatibility with old
         # janky versions of the C tools complicate things though.
-
-        self._line = s  # Used for error reporting
-
+        #
+        # Tokenizing a whole file ahead of time isn't possible in general,
+        # since a preprocessor assignment changes how the lines after it
+        # expand, and since help texts can only be told apart from other
+        # lines by parsing. Some alternatives that were tried for lines
+        # without macros, none of which was faster on CPython:
+        #
+        #   - Splitting the rest of the line with a single findall() call
+        #
+        #   - Reusing the token lists of identical lines (e.g. "\thelp")
+        #
+        #   - Reading files into memory and matching help texts with a regex
+        #     instead of with readline(), which is already buffered
+
+        self._line = s  # Used for error reporting
+
+        if self._prelexed:
+            # Tokens from a worker process, with symbol names in place of
+            # symbols. See _start_prelexing().
+            lexed = self._prelexed.get(s)
+            if lexed:
+                if self.stats:
+                    self.stats.counts["prelexed_lines"] += 1
+
+                tokens, refs = lexed
+                if refs:
+                    tokens = list(tokens)
+                    for i, const in refs:
+                        tokens[i] = self._lookup_const_sym(tokens[i]) \
+                            if const else self._lookup_sym(tokens[i])
+                return tokens
+
         # Initial token on the line
         match = _command_match(s)
         if not match:
@@ -2601,6 +3723,9 @@ class Kconfig(object):
         # if it doesn't already exist. Also takes care of bare macros on lines
         # (which are allowed, and can be useful for their side effects).
 
+        if self._structural_files is not None:
+            self._structural_files.add(self.filename)
+
         # Expand any macros in the left-hand side of the assignment (the
         # variable name)
         s = s.lstrip()
@@ -2747,6 +3872,10 @@ class Kconfig(object):
         # Returns the expanded 's' (including the part before the macro) and
         # the index of the first character after the expanded macro in 's'.
 
+        if self._structural_files is not None and self._parsing_kconfigs:
+            # Macros can refer to variables assigned in other files
+            self._structural_files.add(self.filename)
+
         res = s[:i]
         i += 2  # Skip over "$("
 
@@ -2805,12 +3934,35 @@ class Kconfig(object):
         # Returns the result of calling the function args[0] with the arguments
         # args[1..len(args)-1]. Plain variables are treated as functions
         # without arguments.
+        #
+        # Results for recursive variables and pure functions are memoized in
+        # _expansion_memo, keyed by 'args'. This avoids redoing work (including
+        # running $(shell,...) commands) when e.g. a cc-option-style function
+        # is called many times with the same arguments.
+        #
+        # A memoized result stays valid as long as the variables it was
+        # derived from keep their values, which is checked through the
+        # dependencies recorded with it. See _memo_valid(). Results that
+        # involve calls to impure functions (e.g. $(lineno) and $(info)) are
+        # never memoized. _n_impure_calls is incremented for each impure call,
+        # which makes them easy to detect.
 
         fn = args[0]
 
+        # Dependency list for the enclosing memoized expansion, if any
+        deps = self._expansion_deps
+
         if fn in self.variables:
             var = self.variables[fn]
 
+            if deps is not None:
+                deps.append((fn, var.value))
+
+            if var.is_recursive:
+                res = self._memo_lookup(args, deps)
+                if res is not None:
+                    return res
+
             if len(args) == 1:
                 # Plain variable
                 if var._n_expansions:
@@ -2822,15 +3974,41 @@ class Kconfig(object):
                 self._parse_error("Preprocessor function {} seems stuck "
                                   "in infinite recursion".format(var.name))
 
+            if not var.is_recursive:
+                # Simple (:=) variable. Its value is already expanded (except
+                # for $(1), etc.), so there's nothing to memoize.
+                var._n_expansions += 1
+                try:
+                    return self._expand_whole(var.value, args)
+                finally:
+                    var._n_expansions -= 1
+
+            n_impure_calls = self._n_impure_calls
+            self._expansion_deps = var_deps = [(fn, var.value)]
             var._n_expansions += 1
-            res = self._expand_whole(self.variables[fn].value, args)
-            var._n_expansions -= 1
+            try:
+                res = self._expand_whole(var.value, args)
+            finally:
+                var._n_expansions -= 1
+                self._expansion_deps = deps
+
+            if deps is not None:
+                deps += var_deps
+
+            if self._n_impure_calls == n_impure_calls:
+                self._expansion_memo[tuple(args)] = (res, tuple(var_deps))
+
             return res
 
+        if deps is not None:
+            # The result would change if a variable with the same name was
+            # defined
+            deps.append((fn, None))
+
         if fn in self._functions:
             # Built-in or user-defined function
 
-            py_fn, min_arg, max_arg = self._functions[fn]
+            py_fn, min_arg, max_arg = self._functions[fn][:3]
 
             if len(args) - 1 < min_arg or \
                (max_arg is not None and len(args) - 1 > max_arg):
@@ -2847,15 +4025,58 @@ class Kconfig(object):
                                    .format(self.filename, self.linenr, fn,
                                            expected_args, len(args) - 1))
 
-            return py_fn(self, *args)
+            if fn not in self._pure_functions:
+                self._n_impure_calls += 1
+                return py_fn(self, *args)
+
+            res = self._memo_lookup(args, None)
+            if res is None:
+                res = py_fn(self, *args)
+                self._expansion_memo[tuple(args)] = (res, ((fn, None),))
+            return res
 
-        # Environment variables are tried last
+        # Environment variables are tried last. They can't change during
+        # parsing.
         if fn in os.environ:
             self.env_vars.add(fn)
             return os.environ[fn]
 
         return ""
 
+    def _memo_lookup(self, args, deps):
+        # Returns the memoized result for the call 'args', or None if there is
+        # no valid memoized result. Adds the dependencies of the result to
+        # 'deps' (if not None). See _fn_val().
+
+        entry = self._expansion_memo.get(tuple(args))
+        if entry is None:
+            return None
+
+        res, res_deps = entry
+        if not self._memo_valid(res_deps):
+            return None
+
+        if deps is not None:
+            deps += res_deps
+
+        if self.stats:
+            self.stats.counts["expansion_memo_hits"] += 1
+
+        return res
+
+    def _memo_valid(self, deps):
+        # Returns True if none of the variables in 'deps', a list of
+        # (<name>, <value>) tuples, have changed. <value> is the value the
+        # variable had, or None if it wasn't defined. Values are compared by
+        # identity, since each assignment creates a new string.
+
+        variables = self.variables
+        for name, val in deps:
+            var = variables.get(name)
+            if (var.value if var else None) is not val:
+                return False
+        return True
+
     #
     # Parsing
     #
@@ -2872,7 +4093,7 @@ class Kconfig(object):
         if e1 is self.n or e2 is self.n:
             return self.n
 
-        return (AND, e1, e2)
+        return self._share_expr((AND, e1, e2))
 
     def _make_or(self, e1, e2):
         # Constructs an OR (||) expression. Performs trivial simplification.
@@ -2886,7 +4107,60 @@ class Kconfig(object):
         if e1 is self.y or e2 is self.y:
             return self.y
 
-        return (OR, e1, e2)
+        return self._share_expr((OR, e1, e2))
+
+    def _make_or_all(self, exprs):
+        # ORs together the expressions in the list 'exprs', with the same
+        # simplifications as _make_or(), and in the same order.
+        #
+        # The result is a balanced tree of OR expressions rather than a chain.
+        # This keeps expressions with many terms (e.g. the reverse
+        # dependencies of symbols that are selected from many locations)
+        # shallow, so that recursive code that works on expressions doesn't
+        # run into the recursion limit. split_expr() returns the terms in
+        # order either way, and compiled expressions (see _compile_expr())
+        # evaluate them in a flat loop.
+
+        res = []
+        for expr in exprs:
+            if expr is self.y:
+                return self.y
+            if expr is not self.n:
+                res.append(expr)
+
+        if not res:
+            return self.n
+
+        # Pair up neighboring terms until a single expression remains
+        while len(res) > 1:
+            pairs = [(OR, res[i], res[i + 1])
+                     for i in range(0, len(res) - 1, 2)]
+            if len(res) % 2:
+                pairs.append(res[-1])
+            res = pairs
+
+        return res[0]
+
+    def _share_expr(self, expr):
+        # Returns an expression identical to the AND or OR expression 'expr'
+        # from _make_and() or _make_or(), which is reused if it has been seen
+        # before during finalization. Propagating the dependencies of menus and
+        # 'if' blocks to the properties of the items in them (see
+        # _propagate_deps()) creates the same expressions over and over, and
+        # this saves memory. Compiled expressions are also shared between
+        # identical expressions, as they are looked up by id() (see
+        # _compile_expr()).
+        #
+        # Expressions from the parser are not shared, as looking them up costs
+        # more during parsing than it saves. The lookup key uses the identity
+        # of the operands, which keeps it cheap for large expressions.
+
+        table = self._expr_table
+        if table is None:
+            # Not finalizing
+            return expr
+
+        return table.setdefault((expr[0], id(expr[1]), id(expr[2])), expr)
 
     def _parse_block(self, end_token, parent, prev):
         # Parses a block, which is the contents of either a file or an if,
@@ -2930,7 +4204,7 @@ class Kconfig(object):
                 node.kconfig = self
                 node.item = sym
                 node.is_menuconfig = (t0 is _T_MENUCONFIG)
-                node.prompt = node.help = node.list = None
+                node.prompt = node._help = node.list = None
                 node.parent = parent
                 node.filename = self.filename
                 node.linenr = self.linenr
@@ -2959,6 +4233,9 @@ class Kconfig(object):
             elif t0 in _SOURCE_TOKENS:
                 pattern = self._expect_str_and_eol()
 
+                if self._structural_files is not None:
+                    self._structural_files.add(self.filename)
+
                 if t0 in _REL_SOURCE_TOKENS:
                     # Relative source
                     pattern = join(dirname(self.filename), pattern)
@@ -2973,6 +4250,10 @@ class Kconfig(object):
                 #   ordering in e.g. .config files
                 filenames = sorted(iglob(join(self._srctree_prefix, pattern)))
 
+                if self._source_globs is not None:
+                    self._source_globs.append(
+                        (join(self._srctree_prefix, pattern), filenames))
+
                 if not filenames and t0 in _OBL_SOURCE_TOKENS:
                     raise KconfigError(
                         "{}:{}: '{}' not found (in '{}'). Check that "
@@ -2986,6 +4267,9 @@ class Kconfig(object):
 
                 for filename in filenames:
                     self._enter_file(filename)
+                    if self._file_parents is not None:
+                        self._file_parents[self.filename] = \
+                            (parent, self._include_path)
                     prev = self._parse_block(None, parent, prev)
                     self._leave_file()
 
@@ -3003,6 +4287,9 @@ class Kconfig(object):
                 node = MenuNode()
                 node.item = node.prompt = None
                 node.parent = parent
+                # Lets reload() find the 'if' nodes from a file. They're
+                # removed during finalization, so this is never visible.
+                node.filename = self.filename
                 node.dep = self._expect_expr_and_eol()
 
                 self._parse_block(_T_ENDIF, node, node)
@@ -3068,7 +4355,7 @@ class Kconfig(object):
                 node.kconfig = choice.kconfig = self
                 node.item = choice
                 node.is_menuconfig = True
-                node.prompt = node.help = None
+                node.prompt = node._help = None
                 node.parent = parent
                 node.filename = self.filename
                 node.linenr = self.linenr
@@ -3085,6 +4372,9 @@ class Kconfig(object):
             elif t0 is _T_MAINMENU:
                 self.top_node.prompt = (self._expect_str_and_eol(), self.y)
 
+                if self._structural_files is not None:
+                    self._structural_files.add(self.filename)
+
             else:
                 # A valid endchoice/endif/endmenu is caught by the 'end_token'
                 # check above
@@ -3227,6 +4517,9 @@ class Kconfig(object):
                                    self.filename, self.linenr)
 
                 elif self._check_token(_T_DEFCONFIG_LIST):
+                    if self._structural_files is not None:
+                        self._structural_files.add(self.filename)
+
                     if not self.defconfig_list:
                         self.defconfig_list = node.item
                     else:
@@ -3310,7 +4603,7 @@ class Kconfig(object):
         node.prompt = (prompt, self._parse_cond())
 
     def _parse_help(self, node):
-        if node.help is not None:
+        if node._help is not None:
             self._warn(node.item.name_and_loc + " defined with more than "
                        "one help text -- only the last one will be used")
 
@@ -3340,6 +4633,10 @@ class Kconfig(object):
             self._empty_help(node, line)
             return
 
+        if self._lazy_help:
+            self._skip_help(node, line, indent)
+            return
+
         # The help text goes on till the first non-blank line with less indent
         # than the first line
 
@@ -3362,17 +4659,79 @@ class Kconfig(object):
                 add_line(expline[indent:])
 
         self.linenr += len_(lines)
-        node.help = "".join(lines).rstrip()
+
+        help = "".join(lines).rstrip()
+        if self._help_texts is not None:
+            # Share a single string between identical help texts. Generated
+            # Kconfig files often repeat the same help text many times.
+            help = self._help_texts.setdefault(help, help)
+        node._help = help
+
+        if line:
+            self._line_after_help(line)
+
+    def _skip_help(self, node, line, indent):
+        # _parse_help() helper for 'lazy_help'. Skips past the help text
+        # starting at 'line' (its first non-blank line, with indentation
+        # 'indent') and records its location in the node. MenuNode.help reads
+        # it in via _load_help() when first accessed.
+
+        first_linenr = self.linenr
+        n_lines = 1
+
+        # Lines that start with the same whitespace as the first line are
+        # indented enough, which saves expanding tabs for most lines
+        prefix = line[:len(line) - len(line.lstrip())]
+
+        readline = self._readline  # Micro-optimization
+        while 1:
+            line = readline()
+            if line.startswith(prefix) or line.isspace():
+                n_lines += 1
+            elif not line:
+                # End of file
+                break
+            else:
+                expline = line.expandtabs()
+                if len(expline) - len(expline.lstrip()) < indent:
+                    break
+                n_lines += 1
+
+        # Like in _parse_help(), the first line is counted twice, which makes
+        # up for the line after the help text not being counted
+        self.linenr += n_lines
+        node._help = (first_linenr, n_lines)
+
         if line:
             self._line_after_help(line)
 
     def _empty_help(self, node, line):
         self._warn(node.item.name_and_loc +
                    " has 'help' but empty help text")
-        node.help = ""
+        node._help = ""
         if line:
             self._line_after_help(line)
 
+    def _load_help(self, filename, linenr, n_lines):
+        # Reads in a help text recorded by _skip_help(). 'linenr' is the line
+        # number of its first line in 'filename', and 'n_lines' the number of
+        # lines in it. The help text is processed like in _parse_help().
+        #
+        # The lines of the last file read are kept around, as help texts tend
+        # to be accessed in menu order (e.g. when searching through them).
+
+        if self._help_file is None or self._help_file[0] != filename:
+            with self._open(join(self._srctree_prefix, filename), "r") as f:
+                self._help_file = (filename, f.readlines())
+
+        lines = self._help_file[1][linenr - 1:linenr - 1 + n_lines]
+
+        expline = lines[0].expandtabs()
+        indent = len(expline) - len(expline.lstrip())
+
+        return "".join(["\n" if line.isspace() else line.expandtabs()[indent:]
+                        for line in lines]).rstrip()
+
     def _parse_expr(self, transform_m):
         # Parses an expression from the tokens in Kconfig._tokens using a
         # simple top-down approach. See the module docstring for the expression
@@ -3538,6 +4897,278 @@ class Kconfig(object):
             for sym in choice.syms:
                 sym._dependents.add(choice)
 
+    def _add_modules_deps(self):
+        # The types of all tristate symbols and choices depend on MODULES, as
+        # they turn into bool when MODULES is n. Expressions that use 'm'
+        # already depend on MODULES, as 'm' gets rewritten to 'm && MODULES'
+        # during parsing.
+        #
+        # This lets MODULES be invalidated like any other symbol, which only
+        # invalidates the items that are sensitive to it instead of everything.
+        #
+        # These are added after dependency loop detection as well, as the
+        # MODULES symbol can depend on tristate symbols without there being a
+        # real loop (types don't depend on each other).
+
+        modules = self.modules
+        dependents = modules._dependents
+
+        for item in chain(self.unique_defined_syms, self.unique_choices):
+            if item.orig_type is TRISTATE and item is not modules:
+                dependents.add(item)
+
+    def _defer_invalidation(self):
+        # Makes Symbol/Choice.set_value() and unset_value() record the items
+        # whose user values change instead of invalidating them (and the items
+        # that depend on them) right away. _flush_invalidation() does the
+        # invalidation later.
+        #
+        # Returns True if invalidation wasn't already deferred, meaning the
+        # caller should call _flush_invalidation() when done. This makes
+        # nesting work.
+        #
+        # Values must not be calculated while invalidation is deferred, as
+        # they could be stale.
+
+        if self._pending_invalidation is None:
+            self._pending_invalidation = set()
+            return True
+        return False
+
+    def _flush_invalidation(self):
+        # Invalidates the items recorded while invalidation was deferred, and
+        # stops deferring invalidation. See _defer_invalidation().
+
+        pending = self._pending_invalidation
+        self._pending_invalidation = None
+
+        # Items that depend on several of the pending items only get updated
+        # once
+        self._update_changed(pending)
+
+    def _invalidate_assigned(self, item):
+        # Called when the user value of the symbol or choice 'item' changes.
+        # Invalidates 'item' and all items that depend on it, or records it
+        # for later invalidation if invalidation is deferred.
+
+        if self.stats:
+            self.stats.counts["assignments"] += 1
+
+        if self._pending_invalidation is None:
+            self._update_changed((item,))
+        else:
+            self._pending_invalidation.add(item)
+
+    def _update_changed(self, items):
+        # Invalidates the symbols and choices in 'items', whose user values
+        # changed, and updates the items that depend on them.
+        #
+        # Rather than invalidating all items that might depend on the changed
+        # items, like _invalidate_items() does, cached values are
+        # recalculated right away, in dependency order (see
+        # _calc_eval_order()). Invalidation only continues to the items that
+        # depend on an item whose value actually changed. Changing a symbol
+        # that lots of other symbols depend on usually changes few values,
+        # so this saves recalculating lots of values afterwards.
+        #
+        # Items without cached values are skipped, for the same reason as in
+        # _invalidate_items(). Only the values that were cached get
+        # recalculated, as nothing can depend on the others.
+        #
+        # Choices and choice symbols depend on each other, so there's no
+        # dependency order between them. They're invalidated together with
+        # all items that depend on them instead, with _invalidate_items().
+
+        index = self._eval_index
+
+        # Number of items invalidated, for Kconfig.stats
+        n = 0
+
+        heap = []
+        queued = set()
+
+        def add(item):
+            # Queues 'item' for updating, if it has cached values
+            if item._cached_vis is not None and item not in queued:
+                queued.add(item)
+                heappush(heap, (index[item], item))
+
+        for item in items:
+            if item._cached_vis is not None:
+                if index is None:
+                    index = self._calc_eval_index()
+                add(item)
+
+        while heap:
+            item = heappop(heap)[1]
+            queued.remove(item)
+
+            if item._cached_vis is None:
+                # Already invalidated by _invalidate_items()
+                continue
+
+            if item.__class__ is Choice or item.choice:
+                n += self._invalidate_items((item,))
+                continue
+
+            old_tri = item._cached_tri_val
+            old_str = item._cached_str_val
+            old_vis = item._cached_vis
+
+            item._invalidate()
+            n += 1
+
+            # Warning: These are hidden function calls (property magic)
+            if item.visibility != old_vis or \
+               old_tri is not None and item.tri_value != old_tri or \
+               old_str is not None and item.str_value != old_str:
+
+                if len(heap) + len(item._dependents) > _MAX_UPDATE_QUEUE:
+                    # The change spreads widely. Recalculating values in
+                    # dependency order gets more expensive than invalidating
+                    # the remaining items and recalculating values on demand,
+                    # so fall back on that.
+                    n += self._invalidate_items(
+                        chain([other for _, other in heap], item._dependents))
+                    break
+
+                for dep in item._dependents:
+                    add(dep)
+
+        if self.stats:
+            counts = self.stats.counts
+            counts["invalidations"] += n
+            if n > counts["largest_invalidation"]:
+                counts["largest_invalidation"] = n
+
+    def _invalidate_items(self, items):
+        # Invalidates the symbols and choices in 'items' and all items that
+        # (possibly) depend on them. Returns the number of invalidated items.
+        #
+        # _cached_vis doubles as a flag that tells us whether an item has
+        # cached values, because it's calculated as a side effect of
+        # calculating all other (non-constant) cached values.
+        #
+        # If item._cached_vis is None, it means there can't be cached values
+        # on other items that depend on 'item', because if there were, some
+        # value on 'item' would have been calculated and item._cached_vis set
+        # as a side effect. It's therefore safe to stop the invalidation at
+        # items with _cached_vis None. That also makes each item get
+        # invalidated just once, as it's invalidated when added to the
+        # worklist.
+        #
+        # This approach massively speeds up scripts that set a lot of values,
+        # vs simply invalidating all possibly dependent symbols (even when you
+        # already have a list of all the dependent symbols, because some
+        # symbols get huge dependency trees).
+        #
+        # This gracefully handles dependency loops too, which is nice for
+        # choices, where the choice depends on the choice symbols and vice
+        # versa.
+        #
+        # An explicit worklist is used instead of recursion, so that long
+        # dependency chains can't hit the recursion limit.
+
+        worklist = []
+        for item in items:
+            if item._cached_vis is not None:
+                item._invalidate()
+                worklist.append(item)
+
+        n = len(worklist)
+
+        while worklist:
+            for dep in worklist.pop()._dependents:
+                if dep._cached_vis is not None:
+                    dep._invalidate()
+                    worklist.append(dep)
+                    n += 1
+
+        return n
+
+    def _calc_eval_index(self):
+        # Returns the _eval_index dictionary, calculating it first if needed
+
+        if self._eval_order is None:
+            self._eval_order = self._calc_eval_order()
+
+        self._eval_index = {item: i for i, item in enumerate(self._eval_order)}
+        return self._eval_index
+
+    def _update_changes(self):
+        # Recalculates the values of the items that have been invalidated
+        # since the last call, for change_epoch and changes_since(), and
+        # records the items whose values changed as a new change epoch
+
+        touched = self._touched
+        if touched is None:
+            raise KconfigError("changes aren't being tracked (see "
+                               "Kconfig.track_changes())")
+
+        if not touched:
+            return
+
+        self._touched = set()
+
+        index = self._eval_index
+        if index is None:
+            index = self._calc_eval_index()
+
+        tracked_vals = self._tracked_vals
+        changed = set()
+
+        # Evaluate in dependency order to avoid deep recursion (see
+        # evaluate_all()). Symbols that became undefined in reload() are
+        # skipped.
+        for item in sorted([item for item in touched if item in index],
+                           key=index.__getitem__):
+            val = _tracked_value(item)
+            if tracked_vals.get(item) != val:
+                tracked_vals[item] = val
+                changed.add(item)
+
+        if changed:
+            self._change_log.append(changed)
+
+    def _calc_eval_order(self):
+        # Returns a list with all defined symbols and all choices, ordered so
+        # that each item comes before the items that depend on it (via the
+        # _dependents sets). Used by evaluate_all().
+        #
+        # This is a reverse postorder from an iterative depth-first search.
+        # Choices and their symbols depend on each other. Loops like that end
+        # up in some order, and get handled by regular recursive evaluation
+        # when it's time to evaluate them.
+        #
+        # MODULES goes first, as many items depend on it. Putting it first
+        # keeps the search stacks short.
+
+        order = []
+        visited = set()
+
+        for root in chain((self.modules,), self.unique_defined_syms,
+                          self.unique_choices):
+            if root in visited:
+                continue
+            visited.add(root)
+
+            # Stack of (item, iterator over remaining dependents) tuples
+            stack = [(root, iter(root._dependents))]
+            while stack:
+                item, dependents = stack[-1]
+                for dep in dependents:
+                    if dep not in visited:
+                        visited.add(dep)
+                        stack.append((dep, iter(dep._dependents)))
+                        break
+                else:
+                    # All dependents done
+                    stack.pop()
+                    order.append(item)
+
+        order.reverse()
+        return order
+
     def _invalidate_all(self):
         # Undefined symbols never change value and don't need to be
         # invalidated, so we can just iterate over defined symbols.
@@ -3548,6 +5179,10 @@ class Kconfig(object):
         for choice in self.unique_choices:
             choice._invalidate()
 
+        if self.stats:
+            self.stats.counts["invalidations"] += \
+                len(self.unique_defined_syms) + len(self.unique_choices)
+
     #
     # Post-parsing menu tree processing, including dependency propagation and
     # implicit submenu creation
@@ -3577,6 +5212,25 @@ class Kconfig(object):
         # visible_if:
         #   Dependencies from 'visible if' on parent menus. These are added to
         #   the prompts of symbols and choices.
+        #
+        # The work for each menu node is done by _finalize_node_steps(), which
+        # yields the child nodes that need to be finalized before it can
+        # continue. Running the steps from an explicit stack instead of
+        # recursing keeps deep menu trees (e.g. long chains of implicit menus)
+        # from hitting the recursion limit.
+
+        stack = [self._finalize_node_steps(node, visible_if)]
+        while stack:
+            child = next(stack[-1], None)
+            if child:
+                stack.append(self._finalize_node_steps(*child))
+            else:
+                stack.pop()
+
+    def _finalize_node_steps(self, node, visible_if):
+        # _finalize_node() helper. Generator that finalizes 'node', yielding a
+        # (<child node>, <visible_if>) tuple for each child node that should
+        # be finalized (completely) before continuing.
 
         if node.item.__class__ is Symbol:
             # Copy defaults, ranges, selects, and implies to the Symbol
@@ -3588,7 +5242,7 @@ class Kconfig(object):
             while cur.next and _auto_menu_dep(node, cur.next):
                 # This makes implicit submenu creation work recursively, with
                 # implicit menus inside implicit menus
-                self._finalize_node(cur.next, visible_if)
+                yield (cur.next, visible_if)
                 cur = cur.next
                 cur.parent = node
 
@@ -3607,14 +5261,14 @@ class Kconfig(object):
 
             # Propagate the menu node's dependencies to each child menu node.
             #
-            # This needs to go before the recursive _finalize_node() call so
-            # that implicit submenu creation can look ahead at dependencies.
+            # This needs to go before the children are finalized so that
+            # implicit submenu creation can look ahead at dependencies.
             self._propagate_deps(node, visible_if)
 
             # Finalize the children
             cur = node.list
             while cur:
-                self._finalize_node(cur, visible_if)
+                yield (cur, visible_if)
                 cur = cur.next
 
         if node.list:
@@ -3706,19 +5360,400 @@ class Kconfig(object):
         sym.selects += node.selects
         sym.implies += node.implies
 
-        # Modify the reverse dependencies of the selected symbol
+        # Add terms to the reverse dependencies of the selected symbol. These
+        # are ORed together in _finalize().
         for target, cond in node.selects:
-            target.rev_dep = self._make_or(
-                target.rev_dep,
+            self._select_terms.setdefault(target, []).append(
                 self._make_and(sym, cond))
 
-        # Modify the weak reverse dependencies of the implied
-        # symbol
+        # Add terms to the weak reverse dependencies of the implied symbol
         for target, cond in node.implies:
-            target.weak_rev_dep = self._make_or(
-                target.weak_rev_dep,
+            self._imply_terms.setdefault(target, []).append(
                 self._make_and(sym, cond))
 
+    #
+    # Reloading
+    #
+
+    def _reload_changed(self, filenames):
+        # Reparses the Kconfig files in 'filenames' and puts their menu nodes
+        # in place of the old ones, for reload(). Returns None if successful,
+        # and otherwise a string saying why all files need to be reparsed
+        # instead, leaving the configuration as it was.
+
+        if self._raw_nodes is None:
+            return "not created with reloadable=True"
+
+        for filename in filenames:
+            if self.kconfig_filenames.count(filename) != 1:
+                return "'{}' is not sourced exactly once".format(filename)
+
+            if filename in self._structural_files:
+                return "'{}' has statements that can affect other files" \
+                       .format(filename)
+
+            if not exists(join(self._srctree_prefix, filename)):
+                return "'{}' is gone".format(filename)
+
+        def run_items(node, end):
+            # Returns the symbols and choices defined in the menu nodes from
+            # 'node' up to 'end' (see _raw_preorder())
+            return _ordered_unique([
+                node.item for node in _raw_preorder(node, end)
+                if node.item.__class__ in _SYMBOL_CHOICE])
+
+        def shared(items, filename):
+            # True if any of the symbols/choices in 'items' is defined outside
+            # 'filename'
+            for item in items:
+                for node in item.nodes:
+                    if node.filename != filename:
+                        return True
+            return False
+
+        def reset(item):
+            # Resets the state that parsing sets on the symbol or choice
+            # 'item'. Named choices are unregistered, so that reparsing creates
+            # new Choice instances for them, like for unnamed choices.
+            item.nodes = []
+            item.orig_type = UNKNOWN
+            if item.__class__ is Symbol:
+                item.env_var = None
+                item.is_allnoconfig_y = False
+            else:
+                item.is_optional = False
+                if self.named_choices.get(item.name) is item:
+                    del self.named_choices[item.name]
+
+        def rollback():
+            # Puts things back the way they were before reparsing
+
+            for item in new_items:
+                reset(item)
+
+            for item, nodes, state1, state2 in saved:
+                item.nodes = nodes
+                if item.__class__ is Symbol:
+                    item.env_var = state1
+                    item.is_allnoconfig_y = state2
+                else:
+                    item.is_optional = state1
+                    if item.name is not None:
+                        self.named_choices[item.name] = item
+
+            self._raw_nodes, self._raw_types = old_raw
+            self._restore_raw()
+            self._save_raw()
+            self._refinalize()
+
+        old_raw = (self._raw_nodes, self._raw_types)
+
+        # Finalization is redone from scratch below. This also makes the menu
+        # nodes from each file easy to find, as a run of siblings under the
+        # node the file was sourced into.
+        self._restore_raw()
+
+        old_items = []
+        for filename in filenames:
+            parent = self._file_parents[filename][0]
+            _, first, end = _find_file_run(parent, filename)
+
+            if not first:
+                self._refinalize()
+                return "'{}' had no menu nodes".format(filename)
+
+            items = run_items(first, end)
+            if shared(items, filename):
+                self._refinalize()
+                return "'{}' shares symbols or choices with other files" \
+                       .format(filename)
+
+            old_items.append(items)
+
+        # Maps the old choices to their first symbols, for matching them up
+        # with the new choices below
+        first_syms = {}
+
+        saved = []
+        for items in old_items:
+            for item in items:
+                if item.__class__ is Symbol:
+                    saved.append((item, item.nodes, item.env_var,
+                                  item.is_allnoconfig_y))
+                else:
+                    saved.append((item, item.nodes, item.is_optional, None))
+                    if item.syms:
+                        first_syms[item] = item.syms[0]
+                reset(item)
+
+        if self.stats:
+            t = self.stats._clock()
+
+        # The first new menu node for each file, and the symbols and choices
+        # defined in the new menu nodes
+        new_firsts = []
+        new_items = []
+        try:
+            location = (self.filename, self.linenr)
+            self._parsing_kconfigs = True
+            try:
+                for filename in filenames:
+                    parent, include_path = self._file_parents[filename]
+                    new_firsts.append(
+                        self._parse_file(filename, parent, include_path))
+                    new_items += run_items(new_firsts[-1], None)
+            finally:
+                self._parsing_kconfigs = False
+                self.filename, self.linenr = location
+
+        except Exception:
+            rollback()
+            raise
+
+        if self.stats:
+            self.stats._lap("parse", t)
+
+        for filename, first in zip(filenames, new_firsts):
+            if filename in self._structural_files:
+                rollback()
+                return "'{}' now has statements that can affect other files" \
+                       .format(filename)
+
+            if shared(run_items(first, None), filename):
+                rollback()
+                return "'{}' now shares symbols or choices with other files" \
+                       .format(filename)
+
+        # Put the new menu nodes in place of the old ones
+        for filename, first in zip(filenames, new_firsts):
+            parent = self._file_parents[filename][0]
+            prev, _, end = _find_file_run(parent, filename)
+
+            if first:
+                last = first
+                while last.next:
+                    last = last.next
+                last.next = end
+            else:
+                first = end
+
+            if prev:
+                prev.next = first
+            else:
+                parent.list = first
+
+        self._save_raw()
+        try:
+            self._refinalize()
+        except Exception:
+            rollback()
+            raise
+
+        # Revalidate the user values of the symbols from the changed files,
+        # and carry over the modes of their choices, which are new Choice
+        # instances. Like in _reload_all(), choices are matched up via their
+        # name, or via their first symbol for unnamed choices.
+        warn = self.warn
+        self.warn = False
+        try:
+            for sym in _ordered_unique(chain([state[0] for state in saved],
+                                             new_items)):
+                if sym.__class__ is Symbol and sym.user_value is not None:
+                    val = sym.user_value
+                    sym.user_value = None
+                    if sym.nodes:
+                        sym.set_value(val)
+
+            for state in saved:
+                old = state[0]
+                if old.__class__ is not Choice or old.user_value is None:
+                    continue
+
+                if old.name is not None:
+                    new = self.named_choices.get(old.name)
+                elif old in first_syms:
+                    new = first_syms[old].choice
+                else:
+                    new = None
+
+                if new is not None:
+                    new.set_value(old.user_value)
+        finally:
+            self.warn = warn
+
+        return None
+
+    def _parse_file(self, filename, parent, include_path):
+        # Parses the Kconfig file 'filename' on its own for reload(), as if it
+        # had been sourced into the menu node 'parent' with the include path
+        # 'include_path'. Returns the first of the new menu nodes (which
+        # aren't linked into the menu tree), or None if there are none.
+
+        self.filename = filename
+        self.linenr = 0
+        self._include_path = include_path
+        self._filestack = []
+        self._reuse_tokens = False
+
+        head = MenuNode()
+        self._readline = self._open(join(self._srctree_prefix, filename),
+                                    "r").readline
+        try:
+            self._parse_block(None, parent, head).next = None
+        except UnicodeDecodeError as e:
+            _decoding_error(e, self.filename)
+        finally:
+            self._readline.__self__.close()
+
+        if self.stats:
+            self.stats.counts["lines"] += self.linenr
+
+        return head.next
+
+    def _reload_all(self):
+        # Reparses all Kconfig files for reload(), carrying over user values.
+        # The Kconfig files are parsed into a separate Kconfig instance, so
+        # that this one is left alone if parsing fails, and its state is then
+        # moved over.
+
+        new = Kconfig.__new__(self.__class__)
+        filename, encoding, cache_dir, stats, lex_processes, reloadable, \
+            lazy_help, compact = self._init_args
+        new._init(filename, self.warn, self.warn_to_stderr, encoding,
+                  cache_dir, stats, lex_processes, reloadable, lazy_help,
+                  compact)
+
+        # Carry over user values for symbols that still exist. Assignment
+        # warnings are expected here, e.g. for symbols that lost their prompt.
+        new.warn = False
+        new.set_values(
+            (sym.name, sym.user_value) for sym in self.unique_defined_syms
+            if sym.user_value is not None and sym.name in new.syms and
+               new.syms[sym.name].nodes)
+
+        # Carry over choice modes. Choices are matched up via their first
+        # symbol, as they're usually unnamed.
+        for choice in self.unique_choices:
+            if choice.user_value is not None and choice.syms:
+                sym = new.syms.get(choice.syms[0].name)
+                if sym and sym.choice:
+                    sym.choice.set_value(choice.user_value)
+
+        new.warn = self.warn
+        new.warnings = self.warnings + new.warnings
+
+        if self._touched is not None:
+            # Keep tracking changes. All symbols and choices are new
+            # instances, so they're all reported as changed.
+            new._change_log = self._change_log
+            new._tracked_vals = {}
+            new._touched = set(chain(new.unique_defined_syms,
+                                     new.unique_choices))
+
+        for name in Kconfig.__slots__:
+            try:
+                setattr(self, name, getattr(new, name))
+            except AttributeError:
+                # Not set, e.g. parsing-related state for a configuration
+                # loaded from the parse cache
+                pass
+
+        # Point everything at this instance instead of 'new'
+        for obj in chain(self.syms.values(), self.const_syms.values(),
+                         self.choices, self.variables.values(), self.menus,
+                         self.comments, (self.top_node,)):
+            obj.kconfig = self
+
+        for item in chain(self.unique_defined_syms, self.unique_choices):
+            for node in item.nodes:
+                node.kconfig = self
+
+    def _save_raw(self):
+        # Saves the parts of the menu tree that finalization modifies, along
+        # with the types of symbols and choices (which _finalize_choice() can
+        # change), so that reload() can redo finalization after reparsing some
+        # files. 'if' nodes are still in the tree at this point.
+        #
+        # Also rebuilds the lists of symbols, choices, menus, and comments from
+        # the menu tree, in the order parsing adds to them.
+
+        top = self.top_node
+        raw = [(top, top.parent, top.next, top.list, top.dep, top.prompt,
+                top.defaults, top.ranges, top.selects, top.implies)]
+        defined_syms = []
+        choices = []
+        menus = []
+        comments = []
+
+        for node in _raw_preorder(top.list, None):
+            raw.append((node, node.parent, node.next, node.list, node.dep,
+                        node.prompt, node.defaults, node.ranges, node.selects,
+                        node.implies))
+
+            item = node.item
+            if item.__class__ is Symbol:
+                defined_syms.append(item)
+            elif item.__class__ is Choice:
+                choices.append(item)
+            elif item is MENU:
+                menus.append(node)
+            elif item is COMMENT:
+                comments.append(node)
+
+        self._raw_nodes = raw
+        self._raw_types = [(item, item.orig_type)
+                           for item in chain(defined_syms, choices)]
+
+        self.defined_syms = defined_syms
+        self.choices = choices
+        self.menus = menus
+        self.comments = comments
+
+    def _restore_raw(self):
+        # Puts the menu tree and the types of symbols and choices back the way
+        # they were when _save_raw() was called
+
+        for state in self._raw_nodes:
+            node = state[0]
+            (node.parent, node.next, node.list, node.dep, node.prompt,
+             node.defaults, node.ranges, node.selects, node.implies) = state[1:]
+
+        for item, orig_type in self._raw_types:
+            item.orig_type = orig_type
+
+    def _refinalize(self):
+        # Resets everything _finalize() calculates and redoes it, after
+        # _restore_raw()
+
+        n = self.n
+
+        for sym in self.syms.values():
+            sym.rev_dep = sym.weak_rev_dep = sym.direct_dep = n
+            sym.defaults = []
+            sym.selects = []
+            sym.implies = []
+            sym.ranges = []
+            sym.choice = None
+            sym._dependents = set()
+            sym._visited = 0
+            sym._compiled = None
+            sym._invalidate()
+
+        for choice in self.choices:
+            choice.direct_dep = n
+            choice.syms = []
+            choice.defaults = []
+            choice._dependents = set()
+            choice._visited = 0
+            choice._compiled = None
+            choice._invalidate()
+
+        self._compiled_exprs = {}
+        self._eval_order = None
+        self._eval_index = None
+
+        self._finalize(self.stats._clock() if self.stats else None)
+
     #
     # Misc.
     #
@@ -4172,6 +6207,10 @@ class Symbol(object):
       For example, if A has 'select FOO' and B has 'select FOO if C', then
       FOO's rev_dep will be (OR, A, (AND, B, C)).
 
+      If there are many selecting symbols, the ORs are nested as a balanced
+      tree, to keep the expression shallow. Use split_expr(sym.rev_dep, OR) to
+      get the individual selects, in definition order.
+
     weak_rev_dep:
       Like rev_dep, for imply.
 
@@ -4243,10 +6282,17 @@ class Symbol(object):
         "_cached_str_val",
         "_cached_tri_val",
         "_cached_vis",
+        "_compiled",
+        "_default_fns",
         "_dependents",
+        "_direct_dep_fn",
         "_old_val",
+        "_prompt_fns",
+        "_range_fns",
+        "_rev_dep_fn",
         "_visited",
         "_was_set",
+        "_weak_rev_dep_fn",
         "_write_to_conf",
         "choice",
         "defaults",
@@ -4304,8 +6350,8 @@ class Symbol(object):
             return self.name
 
         val = ""
-        # Warning: See Symbol._rec_invalidate(), and note that this is a hidden
-        # function call (property magic)
+        # Warning: See Kconfig._invalidate_items(), and note that this is a
+        # hidden function call (property magic)
         vis = self.visibility
 
         self._write_to_conf = (vis != 0)
@@ -4319,18 +6365,17 @@ class Symbol(object):
             base = _TYPE_TO_BASE[self.orig_type]
 
             # Check if a range is in effect
-            for low_expr, high_expr, cond in self.ranges:
-                if expr_value(cond):
-                    has_active_range = True
-
-                    # The zeros are from the C implementation running strtoll()
-                    # on empty strings
-                    low = int(low_expr.str_value, base) if \
-                      _is_base_n(low_expr.str_value, base) else 0
-                    high = int(high_expr.str_value, base) if \
-                      _is_base_n(high_expr.str_value, base) else 0
-
-                    break
+            active_range = self._active_range()
+            if active_range:
+                has_active_range = True
+                low_expr, high_expr = active_range
+
+                # The zeros are from the C implementation running strtoll() on
+                # empty strings
+                low = int(low_expr.str_value, base) if \
+                  _is_base_n(low_expr.str_value, base) else 0
+                high = int(high_expr.str_value, base) if \
+                  _is_base_n(high_expr.str_value, base) else 0
             else:
                 has_active_range = False
 
@@ -4362,18 +6407,16 @@ class Symbol(object):
                 # Used to implement the warning below
                 has_default = False
 
-                for sym, cond in self.defaults:
-                    if expr_value(cond):
-                        has_default = self._write_to_conf = True
+                sym = self._active_default()[0]
+                if sym is not None:
+                    has_default = self._write_to_conf = True
 
-                        val = sym.str_value
+                    val = sym.str_value
 
-                        if _is_base_n(val, base):
-                            val_num = int(val, base)
-                        else:
-                            val_num = 0  # strtoll() on empty string
-
-                        break
+                    if _is_base_n(val, base):
+                        val_num = int(val, base)
+                    else:
+                        val_num = 0  # strtoll() on empty string
                 else:
                     val_num = 0  # strtoll() on empty string
 
@@ -4407,11 +6450,10 @@ class Symbol(object):
                 val = self.user_value
             else:
                 # Otherwise, look at defaults
-                for sym, cond in self.defaults:
-                    if expr_value(cond):
-                        val = sym.str_value
-                        self._write_to_conf = True
-                        break
+                sym = self._active_default()[0]
+                if sym is not None:
+                    val = sym.str_value
+                    self._write_to_conf = True
 
         # env_var corresponds to SYMBOL_AUTO in the C implementation, and is
         # also set on the defconfig_list symbol there. Test for the
@@ -4443,8 +6485,8 @@ class Symbol(object):
             self._cached_tri_val = 0
             return 0
 
-        # Warning: See Symbol._rec_invalidate(), and note that this is a hidden
-        # function call (property magic)
+        # Warning: See Kconfig._invalidate_items(), and note that this is a
+        # hidden function call (property magic)
         vis = self.visibility
         self._write_to_conf = (vis != 0)
 
@@ -4461,25 +6503,23 @@ class Symbol(object):
                 # Otherwise, look at defaults and weak reverse dependencies
                 # (implies)
 
-                for default, cond in self.defaults:
-                    dep_val = expr_value(cond)
-                    if dep_val:
-                        val = min(expr_value(default), dep_val)
-                        if val:
-                            self._write_to_conf = True
-                        break
+                default, dep_val = self._active_default()
+                if default is not None:
+                    val = min(expr_value(default), dep_val)
+                    if val:
+                        self._write_to_conf = True
 
                 # Weak reverse dependencies are only considered if our
                 # direct dependencies are met
-                dep_val = expr_value(self.weak_rev_dep)
-                if dep_val and expr_value(self.direct_dep):
+                dep_val = self._weak_rev_dep_val()
+                if dep_val and self._direct_dep_val():
                     val = max(dep_val, val)
                     self._write_to_conf = True
 
             # Reverse (select-related) dependencies take precedence
-            dep_val = expr_value(self.rev_dep)
+            dep_val = self._rev_dep_val()
             if dep_val:
-                if expr_value(self.direct_dep) < dep_val:
+                if self._direct_dep_val() < dep_val:
                     self._warn_select_unsatisfied_deps()
 
                 val = max(dep_val, val)
@@ -4488,7 +6528,7 @@ class Symbol(object):
             # m is promoted to y for (1) bool symbols and (2) symbols with a
             # weak_rev_dep (from imply) of y
             if val == 1 and \
-               (self.type is BOOL or expr_value(self.weak_rev_dep) == 2):
+               (self.type is BOOL or self._weak_rev_dep_val() == 2):
                 val = 2
 
         elif vis == 2:
@@ -4638,7 +6678,7 @@ class Symbol(object):
             # dependencies come into play.
             self.choice.user_selection = self
             self.choice._was_set = True
-            self.choice._rec_invalidate()
+            self.kconfig._invalidate_assigned(self.choice)
         else:
             self._rec_invalidate_if_has_prompt()
 
@@ -4810,26 +6850,97 @@ class Symbol(object):
         # See Kconfig._build_dep()
         self._dependents = set()
 
+        # None until the symbol is first evaluated, False after that, and
+        # True once its expressions have been compiled. See _visibility().
+        self._compiled = None
+
+    def _compile(self):
+        # Compiles the conditions that are evaluated when calculating the
+        # symbol's value into functions (see _compile_expr()). The symbol's
+        # value is calculated with expr_value() until then.
+
+        memo = self.kconfig._compiled_exprs
+
+        self._prompt_fns = tuple([_compile_expr(node.prompt[1], memo)
+                                  for node in self.nodes if node.prompt])
+
+        self._default_fns = tuple([(default, _compile_expr(cond, memo))
+                                   for default, cond in self.defaults])
+
+        self._range_fns = tuple([(low, high, _compile_expr(cond, memo))
+                                 for low, high, cond in self.ranges])
+
+        self._direct_dep_fn = _compile_expr(self.direct_dep, memo)
+        self._rev_dep_fn = _compile_expr(self.rev_dep, memo)
+        self._weak_rev_dep_fn = _compile_expr(self.weak_rev_dep, memo)
+
+        self._compiled = True
+
+    def _active_range(self):
+        # Returns a (low, high) tuple with the first range whose condition is
+        # satisfied, or None if there is no such range
+
+        if self._compiled:
+            for low, high, cond_fn in self._range_fns:
+                if cond_fn():
+                    return (low, high)
+        else:
+            for low, high, cond in self.ranges:
+                if expr_value(cond):
+                    return (low, high)
+
+        return None
+
+    def _active_default(self):
+        # Returns a (default, cond_val) tuple with the first default whose
+        # condition is satisfied and the value of the condition, or (None, 0)
+        # if there is no such default
+
+        if self._compiled:
+            for default, cond_fn in self._default_fns:
+                cond_val = cond_fn()
+                if cond_val:
+                    return (default, cond_val)
+        else:
+            for default, cond in self.defaults:
+                cond_val = expr_value(cond)
+                if cond_val:
+                    return (default, cond_val)
+
+        return (None, 0)
+
+    def _direct_dep_val(self):
+        return self._direct_dep_fn() if self._compiled else \
+               expr_value(self.direct_dep)
+
+    def _rev_dep_val(self):
+        return self._rev_dep_fn() if self._compiled else \
+               expr_value(self.rev_dep)
+
+    def _weak_rev_dep_val(self):
+        return self._weak_rev_dep_fn() if self._compiled else \
+               expr_value(self.weak_rev_dep)
+
     def _assignable(self):
         # Worker function for the 'assignable' attribute
 
         if self.orig_type not in _BOOL_TRISTATE:
             return ()
 
-        # Warning: See Symbol._rec_invalidate(), and note that this is a hidden
-        # function call (property magic)
+        # Warning: See Kconfig._invalidate_items(), and note that this is a
+        # hidden function call (property magic)
         vis = self.visibility
         if not vis:
             return ()
 
-        rev_dep_val = expr_value(self.rev_dep)
+        rev_dep_val = self._rev_dep_val()
 
         if vis == 2:
             if self.choice:
                 return (2,)
 
             if not rev_dep_val:
-                if self.type is BOOL or expr_value(self.weak_rev_dep) == 2:
+                if self.type is BOOL or self._weak_rev_dep_val() == 2:
                     return (0, 2)
                 return (0, 1, 2)
 
@@ -4838,7 +6949,7 @@ class Symbol(object):
 
             # rev_dep_val == 1
 
-            if self.type is BOOL or expr_value(self.weak_rev_dep) == 2:
+            if self.type is BOOL or self._weak_rev_dep_val() == 2:
                 return (2,)
             return (1, 2)
 
@@ -4847,7 +6958,7 @@ class Symbol(object):
         # Must be a tristate here, because bool m visibility gets promoted to y
 
         if not rev_dep_val:
-            return (0, 1) if expr_value(self.weak_rev_dep) != 2 else (0, 2)
+            return (0, 1) if self._weak_rev_dep_val() != 2 else (0, 2)
 
         if rev_dep_val == 2:
             return (2,)
@@ -4862,36 +6973,9 @@ class Symbol(object):
         self._cached_str_val = self._cached_tri_val = self._cached_vis = \
         self._cached_assignable = None
 
-    def _rec_invalidate(self):
-        # Invalidates the symbol and all items that (possibly) depend on it
-
-        if self is self.kconfig.modules:
-            # Invalidating MODULES has wide-ranging effects
-            self.kconfig._invalidate_all()
-        else:
-            self._invalidate()
-
-            for item in self._dependents:
-                # _cached_vis doubles as a flag that tells us whether 'item'
-                # has cached values, because it's calculated as a side effect
-                # of calculating all other (non-constant) cached values.
-                #
-                # If item._cached_vis is None, it means there can't be cached
-                # values on other items that depend on 'item', because if there
-                # were, some value on 'item' would have been calculated and
-                # item._cached_vis set as a side effect. It's therefore safe to
-                # stop the invalidation at symbols with _cached_vis None.
-                #
-                # This approach massively speeds up scripts that set a lot of
-                # values, vs simply invalidating all possibly dependent symbols
-                # (even when you already have a list of all the dependent
-                # symbols, because some symbols get huge dependency trees).
-                #
-                # This gracefully handles dependency loops too, which is nice
-                # for choices, where the choice depends on the choice symbols
-                # and vice versa.
-                if item._cached_vis is not None:
-                    item._rec_invalidate()
+        if self.kconfig._touched is not None:
+            # See Kconfig.track_changes()
+            self.kconfig._touched.add(self)
 
     def _rec_invalidate_if_has_prompt(self):
         # Invalidates the symbol and its dependent symbols, but only if the
@@ -4908,7 +6992,7 @@ class Symbol(object):
 
         for node in self.nodes:
             if node.prompt:
-                self._rec_invalidate()
+                self.kconfig._invalidate_assigned(self)
                 return
 
         if self.kconfig._warn_assign_no_prompt:
@@ -5150,7 +7234,10 @@ class Choice(object):
         "_cached_assignable",
         "_cached_selection",
         "_cached_vis",
+        "_compiled",
+        "_default_fns",
         "_dependents",
+        "_prompt_fns",
         "_visited",
         "_was_set",
         "defaults",
@@ -5199,8 +7286,8 @@ class Choice(object):
         if self.user_value is not None:
             val = max(val, self.user_value)
 
-        # Warning: See Symbol._rec_invalidate(), and note that this is a hidden
-        # function call (property magic)
+        # Warning: See Kconfig._invalidate_items(), and note that this is a
+        # hidden function call (property magic)
         val = min(val, self.visibility)
 
         # Promote m to y for boolean choices
@@ -5278,7 +7365,7 @@ class Choice(object):
 
         self.user_value = value
         self._was_set = True
-        self._rec_invalidate()
+        self.kconfig._invalidate_assigned(self)
 
         return True
 
@@ -5289,7 +7376,7 @@ class Choice(object):
         """
         if self.user_value is not None or self.user_selection:
             self.user_value = self.user_selection = None
-            self._rec_invalidate()
+            self.kconfig._invalidate_assigned(self)
 
     @property
     def referenced(self):
@@ -5397,16 +7484,32 @@ class Choice(object):
 
         # is_constant is checked by _depend_on(). Just set it to avoid having
         # to special-case choices.
-        self.is_constant = self.is_optional = False
+        self.is_constant = self.is_optional = self._was_set = False
 
         # See Kconfig._build_dep()
         self._dependents = set()
 
+        # See Symbol.__init__()
+        self._compiled = None
+
+    def _compile(self):
+        # See Symbol._compile()
+
+        memo = self.kconfig._compiled_exprs
+
+        self._prompt_fns = tuple([_compile_expr(node.prompt[1], memo)
+                                  for node in self.nodes if node.prompt])
+
+        self._default_fns = tuple([(sym, _compile_expr(cond, memo))
+                                   for sym, cond in self.defaults])
+
+        self._compiled = True
+
     def _assignable(self):
         # Worker function for the 'assignable' attribute
 
-        # Warning: See Symbol._rec_invalidate(), and note that this is a hidden
-        # function call (property magic)
+        # Warning: See Kconfig._invalidate_items(), and note that this is a
+        # hidden function call (property magic)
         vis = self.visibility
 
         if not vis:
@@ -5424,8 +7527,8 @@ class Choice(object):
     def _selection(self):
         # Worker function for the 'selection' attribute
 
-        # Warning: See Symbol._rec_invalidate(), and note that this is a hidden
-        # function call (property magic)
+        # Warning: See Kconfig._invalidate_items(), and note that this is a
+        # hidden function call (property magic)
         if self.tri_value != 2:
             # Not in y mode, so no selection
             return None
@@ -5438,11 +7541,15 @@ class Choice(object):
         return self._selection_from_defaults()
 
     def _selection_from_defaults(self):
-        # Check if we have a default
-        for sym, cond in self.defaults:
-            # The default symbol must be visible too
-            if expr_value(cond) and sym.visibility:
-                return sym
+        # Check if we have a default. The default symbol must be visible too.
+        if self._compiled:
+            for sym, cond_fn in self._default_fns:
+                if cond_fn() and sym.visibility:
+                    return sym
+        else:
+            for sym, cond in self.defaults:
+                if expr_value(cond) and sym.visibility:
+                    return sym
 
         # Otherwise, pick the first visible symbol, if any
         for sym in self.syms:
@@ -5456,14 +7563,9 @@ class Choice(object):
         self._cached_vis = self._cached_assignable = None
         self._cached_selection = _NO_CACHED_SELECTION
 
-    def _rec_invalidate(self):
-        # See Symbol._rec_invalidate()
-
-        self._invalidate()
-
-        for item in self._dependents:
-            if item._cached_vis is not None:
-                item._rec_invalidate()
+        if self.kconfig._touched is not None:
+            # See Kconfig.track_changes()
+            self.kconfig._touched.add(self)
 
 
 class MenuNode(object):
@@ -5551,6 +7653,9 @@ class MenuNode(object):
       text. This was not the case before Kconfiglib 10.21.0, where the format
       was undocumented.
 
+      If the Kconfig instance was created with lazy_help=True, the help text
+      is read in from the Kconfig file when first accessed.
+
     dep:
       The direct ('depends on') dependencies for the menu node, or
       self.kconfig.y if there are no direct dependencies.
@@ -5609,9 +7714,9 @@ class MenuNode(object):
       The Kconfig instance the menu node is from.
     """
     __slots__ = (
+        "_help",
         "dep",
         "filename",
-        "help",
         "include_path",
         "is_menuconfig",
         "item",
@@ -5640,7 +7745,23 @@ class MenuNode(object):
         self.ranges = []
 
     @property
-    def orig_prompt(self):
+    def help(self):
+        """
+        See the class documentation.
+        """
+        help = self._help
+        if help.__class__ is tuple:
+            # Location of a help text that hasn't been read in yet. See the
+            # 'lazy_help' parameter to Kconfig.__init__().
+            help = self._help = self.kconfig._load_help(self.filename, *help)
+        return help
+
+    @help.setter
+    def help(self, help):
+        self._help = help
+
+    @property
+    def orig_prompt(self):
         """
         See the class documentation.
         """
@@ -5938,15 +8059,1045 @@ class Variable(object):
         Returns the expanded value of the variable/function. Any arguments
         passed will be substituted for $(1), $(2), etc.
 
-        Raises a KconfigError if the expansion seems to be stuck in a loop.
-        """
-        return self.kconfig._fn_val((self.name,) + args)
+        Raises a KconfigError if the expansion seems to be stuck in a loop.
+        """
+        return self.kconfig._fn_val((self.name,) + args)
+
+    def __repr__(self):
+        return "<variable {}, {}, value '{}'>" \
+               .format(self.name,
+                       "recursive" if self.is_recursive else "immediate",
+                       self.value)
+
+
+class Snapshot(object):
+    """
+    A snapshot of the configuration, returned by Kconfig.snapshot() and
+    passed to Kconfig.restore().
+
+    Can be used as a context manager, which restores the snapshot on exit. See
+    Kconfig.snapshot().
+
+    The following attributes are available:
+
+    kconfig:
+      The Kconfig instance the snapshot was taken from.
+
+    cached:
+      True if calculated values are included in the snapshot.
+    """
+    __slots__ = (
+        "_cached_vals",
+        "_choice_user_vals",
+        "_generation",
+        "_missing_syms",
+        "_user_vals",
+        "_was_set",
+        "kconfig",
+    )
+
+    def __init__(self, kconfig, cached=False):
+        """
+        Takes a snapshot of 'kconfig'. Kconfig.snapshot() is the intended
+        interface.
+        """
+        self.kconfig = kconfig
+
+        # Values are stored in the same order as in
+        # Kconfig.unique_defined_syms/unique_choices, which reload() rebuilds
+        self._generation = kconfig._generation
+        self._user_vals = tuple([sym.user_value
+                                 for sym in kconfig.unique_defined_syms])
+
+        self._choice_user_vals = tuple([
+            (choice.user_value, choice.user_selection)
+            for choice in kconfig.unique_choices])
+
+        self._missing_syms = tuple(kconfig.missing_syms)
+
+        # Whether each symbol and choice was assigned in the configuration
+        # file or via set_value(), which goes along with missing_syms
+        self._was_set = (
+            tuple([sym._was_set for sym in kconfig.unique_defined_syms]),
+            tuple([choice._was_set for choice in kconfig.unique_choices]))
+
+        if cached:
+            self._cached_vals = (
+                tuple([(sym._cached_str_val, sym._cached_tri_val,
+                        sym._cached_vis, sym._cached_assignable,
+                        sym._write_to_conf)
+                       for sym in kconfig.unique_defined_syms]),
+                tuple([(choice._cached_vis, choice._cached_assignable,
+                        choice._cached_selection)
+                       for choice in kconfig.unique_choices]))
+        else:
+            self._cached_vals = None
+
+    @property
+    def cached(self):
+        """
+        See the class documentation.
+        """
+        return self._cached_vals is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.kconfig.restore(self)
+
+    def __repr__(self):
+        return "<snapshot of {} symbols and {} choices{}>".format(
+            len(self._user_vals), len(self._choice_user_vals),
+            ", with calculated values" if self.cached else "")
+
+
+class BatchEvaluator(object):
+    """
+    Evaluates the bool and tristate symbols of many configurations at once,
+    returned by Kconfig.batch_evaluator(). This is meant for things like
+    coverage analysis, where thousands of candidate configurations (e.g.
+    random ones) are evaluated against the same Kconfig tree.
+
+    Each bool/tristate value is represented by two bit masks, with one bit per
+    configuration: one with the configurations where the value is at least m,
+    and one with the configurations where it is y. Visibility, defaults,
+    select, imply, choices, and the MODULES handling then turn into bitwise
+    operations on Python integers, which handle a whole batch at once. The
+    items are evaluated in dependency order, and shared subexpressions are
+    evaluated once per batch.
+
+    Comparisons that involve int, hex, or string symbols (e.g.
+    'depends on FOO > 3') are evaluated separately for each configuration,
+    with expr_value(), which is much slower. Int, hex, and string symbols are
+    not included in the results.
+
+    The evaluator uses the Kconfig tree as it was when the evaluator was
+    created. Create a new one after Kconfig.reload().
+
+    The following attributes are available:
+
+    kconfig:
+      The Kconfig instance the evaluator was created from.
+
+    syms:
+      List with the bool and tristate symbols in the results, in the same
+      order as in Kconfig.unique_defined_syms.
+    """
+    __slots__ = (
+        "_leaves",
+        "_order",
+        "kconfig",
+        "syms",
+    )
+
+    def __init__(self, kconfig):
+        """
+        Creates an evaluator for 'kconfig'. Kconfig.batch_evaluator() is the
+        intended interface.
+
+        Raises KconfigError if the bool/tristate symbols and choices can't be
+        put in dependency order, which means evaluating them would recurse
+        forever.
+        """
+        self.kconfig = kconfig
+        self.syms = [sym for sym in kconfig.unique_defined_syms
+                     if sym.orig_type in _BOOL_TRISTATE]
+
+        # Comparisons that get evaluated with expr_value()
+        self._leaves = []
+
+        self._order = self._calc_order()
+
+    def evaluate(self, configs):
+        """
+        Evaluates the configurations in 'configs' and returns a list with one
+        row per configuration. Each row is a bytearray that holds the
+        tri_value (0, 1, or 2) of each symbol in BatchEvaluator.syms, in
+        order.
+
+        configs:
+          List of configurations. Each configuration is a dict or a list of
+          pairs, as accepted by Kconfig.set_values(), and is applied on top of
+          the current user values of the Kconfig instance. Values that are
+          invalid for the type of the symbol or choice are ignored, like in
+          Symbol/Choice.set_value().
+
+        The Kconfig instance is left as it was.
+        """
+        columns = self.evaluate_columns(configs)
+        if not columns:
+            # No bool/tristate symbols
+            return [bytearray() for _ in configs]
+
+        return [bytearray(row) for row in zip(*columns)]
+
+    def evaluate_columns(self, configs):
+        """
+        Like evaluate(), but returns a list with one column per symbol in
+        BatchEvaluator.syms instead, with the tri_value of the symbol in each
+        configuration. This is cheaper than evaluate(), and handy for finding
+        e.g. symbols that never get enabled.
+        """
+        configs = list(configs)
+        n = len(configs)
+        full = (1 << n) - 1
+
+        # Maps bool/tristate symbols and choices to their value, as a
+        # (<m-or-y mask>, <y mask>) tuple
+        vals = {}
+        # Maps bool/tristate symbols and choices to their visibility
+        vis = {}
+        # Maps choices to a dict that maps choice symbols to a mask with the
+        # configurations where they're selected
+        sels = {}
+
+        consts = ((0, 0), (full, 0), (full, full))
+
+        user_vals, user_sels = self._user_masks(configs)
+        leaf_vals = self._leaf_masks(configs)
+
+        # Maps id(expr) to the value of 'expr', for shared subexpressions
+        memo = {}
+
+        def value(expr):
+            # Returns the value of 'expr', like expr_value() does for a single
+            # configuration
+
+            if expr.__class__ is not tuple:
+                val = vals.get(expr)
+                if val is None:
+                    # Constant, undefined, or int/hex/string symbol, which
+                    # always has the same value
+                    return consts[expr.tri_value
+                                  if expr.orig_type in _BOOL_TRISTATE_UNKNOWN
+                                  else 0]
+                return val
+
+            val = memo.get(id(expr))
+            if val is not None:
+                return val
+
+            op = expr[0]
+
+            if op is AND:
+                m = y = full
+                for operand in split_expr(expr, AND):
+                    op_m, op_y = value(operand)
+                    m &= op_m
+                    y &= op_y
+                val = (m, y)
+
+            elif op is OR:
+                m = y = 0
+                for operand in split_expr(expr, OR):
+                    op_m, op_y = value(operand)
+                    m |= op_m
+                    y |= op_y
+                val = (m, y)
+
+            elif op is NOT:
+                m, y = value(expr[1])
+                val = (full & ~y, full & ~m)
+
+            elif id(expr) in leaf_vals:
+                mask = leaf_vals[id(expr)]
+                val = (mask, mask)
+
+            elif _is_const_sym(expr[1]) and _is_const_sym(expr[2]):
+                val = consts[expr_value(expr)]
+
+            else:
+                # Relation between bool/tristate operands, which compares
+                # their values as numbers
+                a_m, a_y = value(expr[1])
+                b_m, b_y = value(expr[2])
+
+                if op is EQUAL or op is UNEQUAL:
+                    mask = full & ~((a_m ^ b_m) | (a_y ^ b_y))
+                    if op is UNEQUAL:
+                        mask = full & ~mask
+                elif op is LESS or op is GREATER_EQUAL:
+                    # a < b
+                    mask = (b_m & ~a_m) | (b_y & ~a_y)
+                    if op is GREATER_EQUAL:
+                        mask = full & ~mask
+                else:
+                    # b < a
+                    mask = (a_m & ~b_m) | (a_y & ~b_y)
+                    if op is LESS_EQUAL:
+                        mask = full & ~mask
+
+                val = (mask, mask)
+
+            memo[id(expr)] = val
+            return val
+
+        modules = self.kconfig.modules
+
+        for kind, item in self._order:
+            # Mask with the configurations where the type of 'item' is
+            # TRISTATE (see Symbol/Choice.type)
+            if item.orig_type is TRISTATE:
+                is_tri = value(modules)[0]
+                if item.__class__ is Symbol and item.choice:
+                    is_tri &= ~vals[item.choice][1]
+            else:
+                is_tri = 0
+
+            if kind is _BATCH_VIS:
+                # See _visibility()
+
+                m = y = 0
+                for node in item.nodes:
+                    if node.prompt:
+                        cond_m, cond_y = value(node.prompt[1])
+                        m |= cond_m
+                        y |= cond_y
+
+                if item.__class__ is Symbol and item.choice:
+                    choice_y = vals[item.choice][1]
+                    if item.choice.orig_type is TRISTATE and \
+                       item.orig_type is not TRISTATE:
+                        # Non-tristate choice symbols are only visible in y
+                        # mode
+                        m &= choice_y
+                        y &= choice_y
+
+                    if item.orig_type is TRISTATE:
+                        # Choice symbols with m visibility are not visible
+                        # in y mode
+                        m &= ~(choice_y & ~y)
+
+                # Promote m to y for non-tristates
+                vis[item] = (m, y | (m & ~is_tri))
+
+            elif kind is _BATCH_SEL:
+                # See Choice._selection()
+
+                sel = sels[item] = {}
+
+                # Configurations where the choice is in y mode and no
+                # selection has been found yet
+                left = vals[item][1]
+
+                # The user selection, if it's visible
+                for sym, mask in user_sels.get(item, ()):
+                    mask &= left & vis[sym][0]
+                    sel[sym] = mask
+                    left &= ~mask
+
+                # Defaults, if the default symbol is visible
+                for sym, cond in item.defaults:
+                    mask = left & value(cond)[0] & vis[sym][0]
+                    sel[sym] = sel.get(sym, 0) | mask
+                    left &= ~mask
+
+                # The first visible symbol
+                for sym in item.syms:
+                    mask = left & vis[sym][0]
+                    sel[sym] = sel.get(sym, 0) | mask
+                    left &= ~mask
+
+            elif item.__class__ is Choice:
+                # See Choice.tri_value
+
+                vis_m, vis_y = vis[item]
+
+                m = 0 if item.is_optional else full
+                y = 0
+                if item in user_vals:
+                    has, user_m, user_y = user_vals[item]
+                    m |= has & user_m
+                    y |= has & user_y
+
+                m &= vis_m
+                y &= vis_y
+
+                # Promote m to y for boolean choices
+                vals[item] = (m, y | (m & ~is_tri))
+
+            elif item.choice:
+                # Choice symbol. See Symbol.tri_value.
+
+                vis_m, vis_y = vis[item]
+
+                # Visible choice symbol in y-mode choice
+                y = vis_y & sels[item.choice].get(item, 0)
+
+                # Visible choice symbol in m-mode choice, with a non-n user
+                # value
+                if item in user_vals:
+                    has, user_m, _ = user_vals[item]
+                    m = y | (vis_m & ~vis_y & has & user_m)
+                else:
+                    m = y
+
+                vals[item] = (m, y)
+
+            else:
+                # Non-choice symbol. See Symbol.tri_value.
+
+                vis_m, vis_y = vis[item]
+
+                # Defaults and weak reverse dependencies (implies)
+                m = y = 0
+                left = full
+                for default, cond in item.defaults:
+                    cond_m, cond_y = value(cond)
+                    default_m, default_y = value(default)
+                    hit = left & cond_m
+                    m |= hit & default_m & cond_m
+                    y |= hit & default_y & cond_y
+                    left &= ~cond_m
+
+                weak_m, weak_y = value(item.weak_rev_dep)
+                weak = weak_m & value(item.direct_dep)[0]
+                m |= weak & weak_m
+                y |= weak & weak_y
+
+                # A user value on a visible symbol takes precedence
+                if item in user_vals:
+                    has, user_m, user_y = user_vals[item]
+                    user = has & vis_m
+                    m = (m & ~user) | (user & user_m & vis_m)
+                    y = (y & ~user) | (user & user_y & vis_y)
+
+                # Reverse (select-related) dependencies take precedence
+                rev_m, rev_y = value(item.rev_dep)
+                m |= rev_m
+                y |= rev_y
+
+                # m is promoted to y for (1) bool symbols and (2) symbols with
+                # a weak_rev_dep (from imply) of y
+                vals[item] = (m, y | (m & ~y & (~is_tri | weak_y)))
+
+        return [_masks_to_tris(vals[sym], n) for sym in self.syms]
+
+    def _calc_order(self):
+        # Returns a list of (<kind>, <item>) tuples that says in which order to
+        # calculate the visibility (_BATCH_VIS), value (_BATCH_VAL), and choice
+        # selection (_BATCH_SEL) of the bool/tristate symbols and choices, so
+        # that everything is calculated before it's needed. Also collects the
+        # comparisons that need to be evaluated with expr_value() in _leaves.
+
+        leaf_ids = set()
+
+        def add_expr_deps(expr, deps):
+            # Adds the values that 'expr' depends on to 'deps'
+
+            if expr.__class__ is not tuple:
+                if expr.__class__ is Choice or \
+                   expr.orig_type in _BOOL_TRISTATE and not expr.is_constant:
+                    deps.append((_BATCH_VAL, expr))
+                return
+
+            if expr[0] is AND or expr[0] is OR:
+                for operand in split_expr(expr, expr[0]):
+                    add_expr_deps(operand, deps)
+
+            elif expr[0] is NOT:
+                add_expr_deps(expr[1], deps)
+
+            elif expr[1].orig_type in _BOOL_TRISTATE and \
+                 expr[2].orig_type in _BOOL_TRISTATE:
+                add_expr_deps(expr[1], deps)
+                add_expr_deps(expr[2], deps)
+
+            elif not (_is_const_sym(expr[1]) and _is_const_sym(expr[2])) and \
+                 id(expr) not in leaf_ids:
+                # Comparison involving int/hex/string symbols
+                leaf_ids.add(id(expr))
+                self._leaves.append(expr)
+
+        modules = self.kconfig.modules
+
+        # Maps each (<kind>, <item>) tuple to a list of the tuples it depends
+        # on
+        deps = {}
+
+        for item in chain(self.syms, self.kconfig.unique_choices):
+            vis_deps = deps[(_BATCH_VIS, item)] = []
+            val_deps = deps[(_BATCH_VAL, item)] = [(_BATCH_VIS, item)]
+
+            for node in item.nodes:
+                if node.prompt:
+                    add_expr_deps(node.prompt[1], vis_deps)
+
+            if item.orig_type is TRISTATE and item is not modules:
+                add_expr_deps(modules, vis_deps)
+                add_expr_deps(modules, val_deps)
+
+            if item.__class__ is Choice:
+                sel_deps = deps[(_BATCH_SEL, item)] = [(_BATCH_VAL, item)]
+                for sym, cond in item.defaults:
+                    sel_deps.append((_BATCH_VIS, sym))
+                    add_expr_deps(cond, sel_deps)
+                for sym in item.syms:
+                    sel_deps.append((_BATCH_VIS, sym))
+
+            elif item.choice:
+                vis_deps.append((_BATCH_VAL, item.choice))
+                val_deps.append((_BATCH_SEL, item.choice))
+
+            else:
+                for default, cond in item.defaults:
+                    add_expr_deps(default, val_deps)
+                    add_expr_deps(cond, val_deps)
+                add_expr_deps(item.weak_rev_dep, val_deps)
+                add_expr_deps(item.direct_dep, val_deps)
+                add_expr_deps(item.rev_dep, val_deps)
+
+        # Postorder from an iterative depth-first search, which puts
+        # everything after the things it depends on. 'state' is 1 for tasks
+        # being visited, and 2 for tasks that are done.
+        order = []
+        state = {}
+
+        for root in deps:
+            if root in state:
+                continue
+            state[root] = 1
+
+            stack = [(root, iter(deps[root]))]
+            while stack:
+                task, task_deps = stack[-1]
+                for dep in task_deps:
+                    dep_state = state.get(dep)
+                    if dep_state is None:
+                        state[dep] = 1
+                        stack.append((dep, iter(deps[dep])))
+                        break
+                    if dep_state == 1:
+                        raise KconfigError(
+                            "can't evaluate configurations in batches: {} "
+                            "depends on itself".format(dep[1].name_and_loc))
+                else:
+                    # All dependencies done
+                    state[task] = 2
+                    order.append(task)
+                    stack.pop()
+
+        return order
+
+    def _user_masks(self, configs):
+        # Returns a (<user values>, <user selections>) tuple for
+        # evaluate_columns().
+        #
+        # <user values> maps bool/tristate symbols and choices with user values
+        # to (<has user value mask>, <m-or-y mask>, <y mask>) tuples.
+        #
+        # <user selections> maps choices to lists of (<symbol>, <mask>) tuples,
+        # where <mask> has the configurations where the symbol is the user
+        # selection of the choice.
+
+        syms = self.kconfig.syms
+        n = len(configs)
+
+        # Maps items to bytearrays with the user value in each configuration
+        # ("0", "1", "2", or "-" for no user value), the last configuration
+        # first. Choices map to lists with the user selection in each
+        # configuration.
+        user_vals = {}
+        user_sels = {}
+
+        for i, config in enumerate(configs):
+            # Position of the configuration in the bytearrays
+            pos = n - 1 - i
+
+            if hasattr(config, "items"):
+                config = config.items()
+
+            for item, value in config:
+                if item.__class__ is str:
+                    item = syms[item]
+
+                # See Symbol/Choice.set_value(). Other symbols only matter for
+                # the comparisons in _leaves.
+                valid = _BATCH_USER_VALS.get(item.orig_type)
+                if valid is None:
+                    continue
+                value = valid.get(value)
+                if value is None:
+                    continue
+
+                vals = user_vals.get(item)
+                if vals is None:
+                    vals = user_vals[item] = _user_val_bytes(item, n)
+                vals[pos] = ord("0") + value
+
+                if value == 2 and item.__class__ is Symbol and item.choice:
+                    sels = user_sels.get(item.choice)
+                    if sels is None:
+                        sels = user_sels[item.choice] = \
+                            [item.choice.user_selection]*n
+                    sels[i] = item
+
+        for choice in self.kconfig.unique_choices:
+            if choice.user_selection and choice not in user_sels:
+                user_sels[choice] = [choice.user_selection]*n
+
+        for choice, sels in user_sels.items():
+            user_sels[choice] = sel_masks = []
+            for sym in _ordered_unique(sels):
+                if sym:
+                    bits = bytearray(b"0")*n
+                    for i, sel in enumerate(sels):
+                        if sel is sym:
+                            bits[n - 1 - i] = ord("1")
+                    sel_masks.append((sym, _bits_to_mask(bits)))
+
+        for item in chain(self.kconfig.unique_defined_syms,
+                          self.kconfig.unique_choices):
+            if item.orig_type in _BOOL_TRISTATE and \
+               item.user_value is not None and item not in user_vals:
+                user_vals[item] = _user_val_bytes(item, n)
+
+        for item, vals in user_vals.items():
+            user_vals[item] = tuple([_bits_to_mask(vals.translate(table))
+                                     for table in _USER_VAL_TABLES])
+
+        return user_vals, user_sels
+
+    def _leaf_masks(self, configs):
+        # Evaluates the comparisons in _leaves for each configuration in
+        # 'configs', using the regular evaluation code. Returns a dict that
+        # maps the id() of each comparison to a mask with the configurations
+        # where it's true.
+
+        if not self._leaves:
+            return {}
+
+        kconf = self.kconfig
+        masks = dict.fromkeys(map(id, self._leaves), 0)
+
+        snapshot = kconf.snapshot()
+        warn = kconf.warn
+        # Warnings were either printed when the values were assigned or
+        # will be when they're assigned for real
+        kconf.warn = False
+        try:
+            for i, config in enumerate(configs):
+                kconf.set_values(config)
+                for leaf in self._leaves:
+                    if expr_value(leaf):
+                        masks[id(leaf)] |= 1 << i
+                kconf.restore(snapshot)
+        finally:
+            kconf.warn = warn
+            kconf.restore(snapshot)
+
+        return masks
+
+    def __repr__(self):
+        return "<batch evaluator for {} symbols and {} choices>".format(
+            len(self.syms), len(self.kconfig.unique_choices))
+
+
+class Stats(object):
+    """
+    Timings and counters for a Kconfig instance, available in Kconfig.stats
+    if the instance was created with stats=True. str() gives a report.
+
+    The following attributes are available:
+
+    times:
+      A dictionary that maps phase names to the total wall time spent in the
+      phase, in seconds. The phases are:
+
+        init:
+          Setup before parsing.
+
+        parse_cache_load/parse_cache_save:
+          Loading and saving the parse cache. See the 'cache_dir' parameter
+          to Kconfig.__init__().
+
+        parse:
+          Reading and tokenizing Kconfig files, preprocessing, and parsing.
+
+        shell:
+          Running $(shell,...) commands. Also included in 'parse'.
+
+        finalize:
+          Menu tree post-processing (dependency propagation, etc.).
+
+        check_sanity:
+          Sanity checks on symbols and choices.
+
+        build_dep:
+          Building the reverse dependencies used for invalidation.
+
+        check_dep_loop:
+          Dependency loop detection.
+
+        compact:
+          Storing the configuration more compactly. See the 'compact'
+          parameter to Kconfig.__init__().
+
+        load_config:
+          Kconfig.load_config().
+
+        evaluate_all:
+          Kconfig.evaluate_all(), which the write_*() functions and
+          sync_deps() also use.
+
+        write:
+          Generating output with Kconfig.write_config(), write_autoconf(),
+          and write_outputs(), with values already calculated.
+
+      Phases that haven't run are missing.
+
+    counts:
+      A dictionary with the following counters:
+
+        files:
+          Number of Kconfig files parsed. Zero if the parse cache was used.
+
+        lines:
+          Number of lines read from Kconfig files.
+
+        shell_commands:
+          Number of $(shell,...) calls.
+
+        shell_cache_hits:
+          Number of $(shell,...) results taken from the $(shell,...) cache.
+          See the module docstring.
+
+        expansion_memo_hits:
+          Number of memoized preprocessor expansions that were reused. See
+          the module docstring.
+
+        prelexed_lines:
+          Number of lines whose tokens came from the worker processes started
+          with the 'lex_processes' option to Kconfig.__init__().
+
+        parse_cache_hits/parse_cache_misses:
+          Number of times the parse cache was used, or couldn't be used.
+
+        evaluations:
+          Number of times the value of a symbol or choice was calculated
+          (including recalculations after invalidation).
+
+        assignments:
+          Number of changes to the user value of a symbol or choice.
+
+        invalidations:
+          Number of symbols and choices whose calculated values were
+          invalidated due to assignments.
+
+        largest_invalidation:
+          The largest number of symbols and choices invalidated by a single
+          assignment (or Kconfig.set_values() call, etc.). Useful for finding
+          symbols with large dependency trees.
+    """
+    __slots__ = (
+        "_clock",
+        "counts",
+        "times",
+    )
+
+    def __init__(self):
+        # Only import as needed, to save some startup time
+        import time
+
+        # time.perf_counter() was added in Python 3.3
+        self._clock = getattr(time, "perf_counter", time.time)
+
+        self.times = {}
+        self.counts = dict.fromkeys(_STATS_COUNTERS, 0)
+
+    def _lap(self, phase, start):
+        # Adds the time since 'start' (a _clock() value) to 'phase'. Returns
+        # the current time, for timing the next phase.
+
+        now = self._clock()
+        self.times[phase] = self.times.get(phase, 0) + now - start
+        return now
+
+    def __str__(self):
+        lines = ["Kconfiglib statistics:"]
+
+        # Report the phases in the order they run
+        for phase in _STATS_PHASES:
+            if phase in self.times:
+                lines.append("  {:<20} {:10.3f} ms"
+                             .format(phase, 1000*self.times[phase]))
+
+        for counter in _STATS_COUNTERS:
+            lines.append("  {:<20} {:10}".format(counter, self.counts[counter]))
+
+        if self.counts["assignments"]:
+            lines.append("  {:<20} {:10.1f}".format(
+                "invalidations/assign",
+                self.counts["invalidations"]/float(self.counts["assignments"])))
+
+        return "\n".join(lines) + "\n"
+
+    def __repr__(self):
+        return "<{}>".format(", ".join(
+            ["{} {:.3f} s".format(phase, self.times[phase])
+             for phase in _STATS_PHASES if phase in self.times] +
+            ["{} {}".format(counter, self.counts[counter])
+             for counter in _STATS_COUNTERS]))
+
+
+class OutputWriter(object):
+    """
+    Base class for output formats, used with Kconfig.write_outputs(). The
+    built-in formats are in OUTPUT_FORMATS, and new formats can be added to it
+    as well.
+
+    Each method returns a string that gets added to the output. The methods
+    are called in this order during a tree walk of the configuration:
+
+      1. start(), once
+
+      2. symbol(), menu(), and menu_end(), in Kconfig order
+
+      3. end(), once
+
+    All values have already been calculated when start() is called.
+
+    A new instance is used for each output file, so writers can keep state
+    between calls.
+    """
+    __slots__ = ()
+
+    def start(self, kconf):
+        """
+        Returns the start of the output. 'kconf' is the Kconfig instance.
+        """
+        return ""
+
+    def symbol(self, sym):
+        """
+        Returns the output for the symbol 'sym'. This is called once per
+        symbol, for the symbols that are written to configuration files (the
+        ones with a non-empty Symbol.config_string). Choice symbols are
+        included.
+        """
+        return ""
+
+    def menu(self, node):
+        """
+        Returns the output for the visible menu or comment 'node' (a MenuNode),
+        before the output for the items it contains.
+        """
+        return ""
+
+    def menu_end(self, node):
+        """
+        Returns the output for the end of the visible menu 'node' (a MenuNode),
+        after the output for the items it contains.
+        """
+        return ""
+
+    def end(self):
+        """
+        Returns the end of the output.
+        """
+        return ""
+
+
+class ConfigWriter(OutputWriter):
+    """
+    Writes the configuration in the .config format. See
+    Kconfig.write_config().
+    """
+    __slots__ = (
+        "_after_end_comment",
+        "_header",
+    )
+
+    def __init__(self, header=None):
+        """
+        'header' is like for Kconfig.write_config().
+        """
+        self._header = header
+
+        # Did we just print an '# end of ...' comment?
+        self._after_end_comment = False
+
+    def start(self, kconf):
+        return kconf.config_header if self._header is None else self._header
+
+    def symbol(self, sym):
+        if self._after_end_comment:
+            # Add a blank line before the first symbol printed after an
+            # '# end of ...' comment
+            self._after_end_comment = False
+            return "\n" + sym.config_string
+
+        return sym.config_string
+
+    def menu(self, node):
+        self._after_end_comment = False
+        return "\n#\n# {}\n#\n".format(node.prompt[0])
+
+    def menu_end(self, node):
+        self._after_end_comment = True
+        return "# end of {}\n".format(node.prompt[0])
+
+
+class HeaderWriter(OutputWriter):
+    """
+    Writes the configuration as a C header. See Kconfig.write_autoconf().
+    """
+    __slots__ = (
+        "_header",
+    )
+
+    def __init__(self, header=None):
+        """
+        'header' is like for Kconfig.write_autoconf().
+        """
+        self._header = header
+
+    def start(self, kconf):
+        return kconf.header_header if self._header is None else self._header
+
+    def symbol(self, sym):
+        val = sym.str_value
+        prefix = sym.kconfig.config_prefix
+
+        if sym.orig_type in _BOOL_TRISTATE:
+            if val == "y":
+                return "#define {}{} 1\n".format(prefix, sym.name)
+            if val == "m":
+                return "#define {}{}_MODULE 1\n".format(prefix, sym.name)
+            return ""
+
+        if sym.orig_type is STRING:
+            return '#define {}{} "{}"\n'.format(prefix, sym.name, escape(val))
+
+        # sym.orig_type in _INT_HEX
+        if sym.orig_type is HEX and not val.startswith(("0x", "0X")):
+            val = "0x" + val
+
+        return "#define {}{} {}\n".format(prefix, sym.name, val)
+
+
+class AutoConfWriter(OutputWriter):
+    """
+    Writes the configuration in the include/config/auto.conf format from the
+    kernel, which is the .config format without comments. See
+    Kconfig.sync_deps().
+    """
+    __slots__ = ()
+
+    def symbol(self, sym):
+        if sym.orig_type in _BOOL_TRISTATE and not sym.tri_value:
+            return ""
+        return sym.config_string
+
+
+class JSONWriter(OutputWriter):
+    """
+    Writes the configuration as a JSON object that maps symbol names
+    (including the CONFIG_ prefix) to values. int symbols get numbers as
+    values, or null if they have no value (no default and no user value).
+    Other symbols get strings, with "n", "m", or "y" for bool and tristate
+    symbols.
+    """
+    __slots__ = (
+        "_first",
+        "_json",
+    )
+
+    def __init__(self):
+        self._first = True
+        self._json = None
+
+    def start(self, kconf):
+        # Only import as needed, to save some startup time
+        import json
+        self._json = json
+
+        return "{"
+
+    def symbol(self, sym):
+        val = sym.str_value
+        if sym.orig_type is INT:
+            try:
+                val = int(val)
+            except ValueError:
+                # Empty value, or a malformed default that gets written as-is
+                # to .config files as well
+                val = val or None
+
+        res = '{}\n  "{}{}": {}'.format(
+            "" if self._first else ",", sym.kconfig.config_prefix, sym.name,
+            self._json.dumps(val))
+
+        self._first = False
+        return res
+
+    def end(self):
+        return "}\n" if self._first else "\n}\n"
+
+
+class CMakeWriter(OutputWriter):
+    """
+    Writes the configuration as CMake set() commands, e.g.
+    set(CONFIG_FOO "y"). Like for C headers, n-valued bool and tristate
+    symbols are left out.
+    """
+    __slots__ = ()
+
+    def symbol(self, sym):
+        val = sym.str_value
+        if sym.orig_type in _BOOL_TRISTATE and val == "n":
+            return ""
+
+        return 'set({}{} "{}")\n'.format(
+            sym.kconfig.config_prefix, sym.name,
+            escape(val).replace("$", "\\$"))
+
+
+class MakeWriter(OutputWriter):
+    """
+    Writes the configuration as make variable assignments, e.g.
+    CONFIG_FOO := y. Unlike for auto.conf, string values are unquoted, with
+    characters that are special to make escaped. n-valued bool and tristate
+    symbols are left out.
+    """
+    __slots__ = ()
+
+    def symbol(self, sym):
+        val = sym.str_value
+        if sym.orig_type in _BOOL_TRISTATE and val == "n":
+            return ""
+
+        return "{}{} := {}\n".format(
+            sym.kconfig.config_prefix, sym.name,
+            val.replace("$", "$$").replace("#", "\\#"))
+
+
+class RustWriter(OutputWriter):
+    """
+    Writes the configuration as flags for rustc, in the format of
+    include/generated/rustc_cfg from the kernel: --cfg=CONFIG_FOO for y-valued
+    bool and tristate symbols, and --cfg=CONFIG_FOO="<value>" for all symbols
+    with a non-n value.
+    """
+    __slots__ = ()
+
+    def symbol(self, sym):
+        val = sym.str_value
+        prefix = sym.kconfig.config_prefix
+
+        if sym.orig_type in _BOOL_TRISTATE:
+            if val == "n":
+                return ""
+
+            if val == "y":
+                return '--cfg={0}{1}\n--cfg={0}{1}="y"\n'.format(prefix,
+                                                                 sym.name)
 
-    def __repr__(self):
-        return "<variable {}, {}, value '{}'>" \
-               .format(self.name,
-                       "recursive" if self.is_recursive else "immediate",
-                       self.value)
+        elif sym.orig_type is HEX and not val.startswith(("0x", "0X")):
+            val = "0x" + val
+
+        return '--cfg={}{}="{}"\n'.format(prefix, sym.name, escape(val))
 
 
 class KconfigError(Exception):
@@ -5980,6 +9131,241 @@ class _KconfigIOError(IOError):
         return self.msg
 
 
+class _ShellCache(object):
+    # Persistent cache for $(shell,...) results, with LRU eviction and
+    # optional prefetching of commands. See the "Caching $(shell,...) results"
+    # section in the module docstring.
+    #
+    # The cache file is a JSON object with the following keys:
+    #
+    #   version:
+    #     _SHELL_CACHE_VERSION. Files with other versions are ignored.
+    #
+    #   entries:
+    #     List of [<key>, <stdout>, <stderr>] lists, with the least recently
+    #     used result first. <key> is from _key().
+    #
+    #   commands:
+    #     The commands run during the most recent parse, in order. Used for
+    #     prefetching.
+    #
+    # The file is only read when the first $(shell,...) call is made, so that
+    # e.g. loading a configuration from the parse cache doesn't pay for it.
+
+    __slots__ = (
+        "_commands",
+        "_entries",
+        "_filename",
+        "_max_size",
+        "_pool",
+        "_prefetched",
+        "_prefetch_threads",
+        "_salt",
+    )
+
+    def __init__(self, filename, salt, max_size, prefetch_threads):
+        self._filename = filename
+        self._salt = salt
+        self._max_size = max_size
+        self._prefetch_threads = prefetch_threads
+
+        # Maps keys to (stdout, stderr) tuples, in LRU order. None until
+        # loaded.
+        self._entries = None
+
+        # Commands run during this parse, in order
+        self._commands = []
+
+        # Maps commands to multiprocessing.pool.AsyncResult objects for
+        # prefetched commands, and the thread pool running them (or None)
+        self._prefetched = {}
+        self._pool = None
+
+    def run(self, command, encoding):
+        # Returns a (stdout, stderr, cached) tuple for 'command'. 'cached' is
+        # True if the result came from the cache. Runs the command (or waits
+        # for it to be prefetched) if its result isn't cached.
+
+        if self._entries is None:
+            self._load(encoding)
+
+        self._commands.append(command)
+
+        key = self._key(command)
+        res = self._entries.pop(key, None)
+        cached = res is not None
+
+        if not cached:
+            if command in self._prefetched:
+                res = self._prefetched.pop(command).get()
+            else:
+                res = _run_shell(command, encoding)
+
+        # (Re)inserting the result makes it the most recently used one
+        self._entries[key] = res
+
+        return res + (cached,)
+
+    def close(self):
+        # Stops prefetching. Commands already started keep running in the
+        # background until they finish.
+
+        if self._pool:
+            self._pool.close()
+            self._pool = None
+        self._prefetched = {}
+
+    def save(self):
+        # Writes the cache file, if any $(shell,...) calls were made. Errors
+        # are ignored, like for the parse cache.
+
+        if self._entries is None:
+            return
+
+        # Only import as needed, to save some startup time
+        import json
+        import tempfile
+
+        entries = list(self._entries.items())[-self._max_size:] \
+            if self._max_size > 0 else []
+
+        tmp_filename = None
+        try:
+            fd, tmp_filename = tempfile.mkstemp(
+                dir=dirname(self._filename) or ".")
+            with os.fdopen(fd, "w") as f:
+                json.dump({
+                    "version": _SHELL_CACHE_VERSION,
+                    "entries": [[key, stdout, stderr]
+                                for key, (stdout, stderr) in entries],
+                    "commands": self._commands,
+                }, f)
+
+            # Write to a temporary file and rename it, so that a concurrent
+            # run never sees a partially written file
+            os.replace(tmp_filename, self._filename)
+
+        except Exception:
+            if tmp_filename is not None:
+                try:
+                    os.remove(tmp_filename)
+                except EnvironmentError:
+                    pass
+
+    def _load(self, encoding):
+        # Loads the cache file, and starts prefetching if enabled
+
+        # Only import as needed, to save some startup time
+        import json
+        from collections import OrderedDict
+
+        self._entries = OrderedDict()
+        prev_commands = ()
+
+        try:
+            with open(self._filename) as f:
+                data = json.load(f)
+
+            if data["version"] == _SHELL_CACHE_VERSION:
+                for key, stdout, stderr in data["entries"]:
+                    self._entries[key] = (stdout, stderr)
+                prev_commands = data["commands"]
+
+        except Exception:
+            # Missing or corrupt cache file. Start over.
+            self._entries.clear()
+            prev_commands = ()
+
+        if self._prefetch_threads > 0:
+            to_run = [command for command in _ordered_unique(prev_commands)
+                      if self._key(command) not in self._entries]
+
+            if to_run:
+                from multiprocessing.pool import ThreadPool
+
+                self._pool = ThreadPool(min(self._prefetch_threads,
+                                            len(to_run)))
+                for command in to_run:
+                    self._prefetched[command] = self._pool.apply_async(
+                        _run_shell, (command, encoding))
+
+    def _key(self, command):
+        # Returns the key for the result of 'command'. See the class comment.
+
+        import hashlib  # Only import as needed, to save some startup time
+
+        # Environment variables referenced by the command
+        env = ["{}={}".format(name, os.environ[name])
+               if name in os.environ else name
+               for name in sorted(set(_shell_env_refs(command)))]
+
+        return hashlib.sha1("\0".join(
+            [command, self._salt, os.getcwd(), os.getenv("PATH", "")] + env
+        ).encode("utf-8", "surrogateescape")).hexdigest()
+
+
+class _Prelexer(Kconfig):
+    # Stand-in for Kconfig when tokenizing lines in the worker processes
+    # started by Kconfig._start_prelexing(). Symbols are represented by
+    # (<name>, <is constant>) tuples, and anything that would generate a
+    # warning or an error or touch preprocessor variables raises KconfigError
+    # instead, leaving the line for the parser.
+
+    __slots__ = ()
+
+    def __init__(self, encoding):
+        self._encoding = encoding
+        self._prelexed = None
+        self.stats = None
+        # Passed to _warn()
+        self.filename = None
+        self.linenr = 0
+        self.const_syms = {name: (name, True) for name in STR_TO_TRI}
+
+    def _lookup_sym(self, name):
+        return (name, False)
+
+    def _lookup_const_sym(self, name):
+        return (name, True)
+
+    def _parse_assignment(self, s):
+        raise KconfigError()
+
+    def _parse_error(self, msg):
+        raise KconfigError()
+
+    def _warn(self, msg, filename=None, linenr=None):
+        raise KconfigError()
+
+
+class _CachedState(object):
+    # Pairs a Symbol/Choice/MenuNode/Variable with its attributes in the parse
+    # cache. Unpickles to the object itself, with the attributes restored. See
+    # Kconfig._save_cache().
+
+    __slots__ = (
+        "obj",
+    )
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def reduce(self):
+        # __reduce__()-style tuple, used via Pickler.dispatch_table. The
+        # attributes are restored by pickle itself, from the (None, <slot
+        # dict>) state.
+
+        obj = self.obj
+        state = {}
+        for name in obj.__class__.__slots__:
+            # Kconfig references and compiled expressions are restored
+            # separately. Attributes that were never set are skipped.
+            if name not in _UNCACHED_ATTRS and hasattr(obj, name):
+                state[name] = getattr(obj, name)
+
+        return (_identity, (obj,), (None, state))
+
+
 #
 # Public functions
 #
@@ -5999,16 +9385,59 @@ def expr_value(expr):
     if expr.__class__ is not tuple:
         return expr.tri_value
 
+    # The operands of nested ANDs and ORs are evaluated in a loop rather than
+    # recursively, as chains can get long (e.g. in the reverse dependencies of
+    # symbols that are selected from many locations). Most ANDs and ORs have
+    # just two operands though, and are evaluated directly, which is faster.
+
     if expr[0] is AND:
-        v1 = expr_value(expr[1])
-        # Short-circuit the n case as an optimization (~5% faster
-        # allnoconfig.py and allyesconfig.py, as of writing)
-        return 0 if not v1 else min(v1, expr_value(expr[2]))
+        op1 = expr[1]
+        op2 = expr[2]
+        if (op1.__class__ is not tuple or op1[0] is not AND) and \
+           (op2.__class__ is not tuple or op2[0] is not AND):
+            v1 = expr_value(op1)
+            # Short-circuit the n case as an optimization (~5% faster
+            # allnoconfig.py and allyesconfig.py, as of writing)
+            return 0 if not v1 else min(v1, expr_value(op2))
+
+        # Operands are evaluated left to right, without splitting the whole
+        # chain up front, so that short-circuiting skips the rest of it
+        res = 2
+        stack = [op2, op1]
+        while stack:
+            expr = stack.pop()
+            if expr.__class__ is tuple and expr[0] is AND:
+                stack.append(expr[2])
+                stack.append(expr[1])
+            else:
+                val = expr_value(expr)
+                if not val:
+                    return 0
+                res = min(res, val)
+        return res
 
     if expr[0] is OR:
-        v1 = expr_value(expr[1])
-        # Short-circuit the y case as an optimization
-        return 2 if v1 == 2 else max(v1, expr_value(expr[2]))
+        op1 = expr[1]
+        op2 = expr[2]
+        if (op1.__class__ is not tuple or op1[0] is not OR) and \
+           (op2.__class__ is not tuple or op2[0] is not OR):
+            v1 = expr_value(op1)
+            # Short-circuit the y case as an optimization
+            return 2 if v1 == 2 else max(v1, expr_value(op2))
+
+        res = 0
+        stack = [op2, op1]
+        while stack:
+            expr = stack.pop()
+            if expr.__class__ is tuple and expr[0] is OR:
+                stack.append(expr[2])
+                stack.append(expr[1])
+            else:
+                val = expr_value(expr)
+                if val == 2:
+                    return 2
+                res = max(res, val)
+        return res
 
     if expr[0] is NOT:
         return 2 - expr_value(expr[1])
@@ -6078,15 +9507,18 @@ def expr_str(expr, sc_expr_str_fn=standard_sc_expr_str):
     if expr.__class__ is not tuple:
         return sc_expr_str_fn(expr)
 
+    # The operands of nested ANDs and ORs are handled in a loop, like in
+    # expr_value()
+
     if expr[0] is AND:
-        return "{} && {}".format(_parenthesize(expr[1], OR, sc_expr_str_fn),
-                                 _parenthesize(expr[2], OR, sc_expr_str_fn))
+        return " && ".join([_parenthesize(operand, OR, sc_expr_str_fn)
+                            for operand in split_expr(expr, AND)])
 
     if expr[0] is OR:
         # This turns A && B || C && D into "(A && B) || (C && D)", which is
         # redundant, but more readable
-        return "{} || {}".format(_parenthesize(expr[1], AND, sc_expr_str_fn),
-                                 _parenthesize(expr[2], AND, sc_expr_str_fn))
+        return " || ".join([_parenthesize(operand, AND, sc_expr_str_fn)
+                            for operand in split_expr(expr, OR)])
 
     if expr[0] is NOT:
         if expr[1].__class__ is tuple:
@@ -6110,21 +9542,23 @@ def expr_items(expr):
     """
     res = set()
 
-    def rec(subexpr):
+    # Iterative, to avoid deep recursion for long AND/OR chains
+    stack = [expr]
+    while stack:
+        subexpr = stack.pop()
         if subexpr.__class__ is tuple:
             # AND, OR, NOT, or relation
 
-            rec(subexpr[1])
+            stack.append(subexpr[1])
 
             # NOTs only have a single operand
             if subexpr[0] is not NOT:
-                rec(subexpr[2])
+                stack.append(subexpr[2])
 
         else:
             # Symbol or choice
             res.add(subexpr)
 
-    rec(expr)
     return res
 
 
@@ -6162,14 +9596,18 @@ def split_expr(expr, op):
     """
     res = []
 
-    def rec(subexpr):
+    # Iterative, to avoid deep recursion for long AND/OR chains
+    stack = [expr]
+    while stack:
+        subexpr = stack.pop()
         if subexpr.__class__ is tuple and subexpr[0] is op:
-            rec(subexpr[1])
-            rec(subexpr[2])
+            # Push the right operand first, so that the left one gets handled
+            # first
+            stack.append(subexpr[2])
+            stack.append(subexpr[1])
         else:
             res.append(subexpr)
 
-    rec(expr)
     return res
 
 
@@ -6200,6 +9638,9 @@ def standard_kconfig(description=None):
     argument (default: Kconfig). Returns the Kconfig instance for the parsed
     configuration. Uses argparse internally.
 
+    A --stats option is also added, which prints Kconfig.stats to stderr when
+    the tool exits.
+
     Exits with sys.exit() (which raises SystemExit) on errors.
 
     description (default: None):
@@ -6219,7 +9660,23 @@ def standard_kconfig(description=None):
         nargs="?",
         help="Top-level Kconfig file (default: Kconfig)")
 
-    return Kconfig(parser.parse_args().kconfig, suppress_traceback=True)
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print timings and counters from Kconfiglib to stderr at the "
+             "end (see kconfiglib.Stats)")
+
+    args = parser.parse_args()
+
+    kconf = Kconfig(args.kconfig, suppress_traceback=True, stats=args.stats)
+
+    if args.stats:
+        import atexit
+
+        # The tool uses 'kconf' after we return, so wait until it's done
+        atexit.register(lambda: sys.stderr.write(str(kconf.stats)))
+
+    return kconf
 
 
 def standard_config_filename():
@@ -6283,17 +9740,87 @@ def load_allconfig(kconf, filename):
 #
 
 
+def _tracked_value(sc):
+    # Returns a tuple with the values of the symbol or choice 'sc' that
+    # Kconfig.changes_since() reports changes to
+
+    if sc.__class__ is Symbol:
+        # For bool and tristate symbols, str_value covers tri_value. Other
+        # symbols always have tri_value n.
+        return (sc.str_value, sc.visibility, sc.assignable)
+
+    return (sc.tri_value, sc.visibility, sc.assignable, sc.selection)
+
+
+def _bits_to_mask(bits):
+    # BatchEvaluator helper. Turns a bytearray with one "0" or "1" per
+    # configuration (the last configuration first) into a mask.
+
+    return int(bits.decode("ascii"), 2) if bits else 0
+
+
+def _user_val_bytes(sc, n):
+    # BatchEvaluator helper. Returns a bytearray with the current user value of
+    # the symbol or choice 'sc' for 'n' configurations. See
+    # BatchEvaluator._user_masks().
+
+    if sc.user_value is None:
+        return bytearray(b"-")*n
+    return bytearray([ord("0") + sc.user_value])*n
+
+
+def _masks_to_tris(val, n):
+    # BatchEvaluator helper. Turns a (<m-or-y mask>, <y mask>) tuple for 'n'
+    # configurations into a bytearray with the tri_value in each
+    # configuration.
+
+    if not n:
+        return bytearray()
+
+    m, y = val
+
+    # Parsing the binary digits as hex digits gives each configuration its
+    # own hex digit. The digits can then be added without carries, as the y
+    # mask is a subset of the m-or-y mask.
+    fmt = "0{}b".format(n)
+    digits = format(int(format(m, fmt), 16) + int(format(y, fmt), 16),
+                    "0{}x".format(n))
+
+    return bytearray(digits[::-1].encode("ascii")).translate(_DIGIT_TO_TRI)
+
+
 def _visibility(sc):
     # Symbols and Choices have a "visibility" that acts as an upper bound on
     # the values a user can set for them, corresponding to the visibility in
     # e.g. 'make menuconfig'. This function calculates the visibility for the
     # Symbol or Choice 'sc' -- the logic is nearly identical.
 
+    # Calculating any value of 'sc' calculates the visibility first, so this
+    # is where compilation happens (see _compile_expr()). Compiling the
+    # expressions costs more than evaluating them once with expr_value(), and
+    # many tools (e.g. genconfig and allyesconfig) calculate each value just
+    # once. Items whose values get recalculated after being invalidated (e.g.
+    # in menuconfig interfaces) tend to get recalculated many times though, so
+    # those are compiled on the first recalculation.
+    if not sc._compiled:
+        if sc._compiled is None:
+            sc._compiled = False
+        else:
+            sc._compile()
+
+    # This also counts (re)calculations
+    if sc.kconfig.stats:
+        sc.kconfig.stats.counts["evaluations"] += 1
+
     vis = 0
 
-    for node in sc.nodes:
-        if node.prompt:
-            vis = max(vis, expr_value(node.prompt[1]))
+    if sc._compiled:
+        for prompt_fn in sc._prompt_fns:
+            vis = max(vis, prompt_fn())
+    else:
+        for node in sc.nodes:
+            if node.prompt:
+                vis = max(vis, expr_value(node.prompt[1]))
 
     if sc.__class__ is Symbol and sc.choice:
         if sc.choice.orig_type is TRISTATE and \
@@ -6318,18 +9845,198 @@ def _depend_on(sc, expr):
     # Constant symbols in 'expr' are skipped as they can never change value
     # anyway.
 
-    if expr.__class__ is tuple:
-        # AND, OR, NOT, or relation
+    if expr.__class__ is not tuple:
+        # Fast path for plain symbols, which are the most common case
+        if not expr.is_constant:
+            expr._dependents.add(sc)
+        return
+
+    # Iterative, to avoid deep recursion for long AND/OR chains
+    stack = [expr]
+    while stack:
+        expr = stack.pop()
+        if expr.__class__ is tuple:
+            # AND, OR, NOT, or relation
+
+            stack.append(expr[1])
+
+            # NOTs only have a single operand
+            if expr[0] is not NOT:
+                stack.append(expr[2])
+
+        elif not expr.is_constant:
+            # Non-constant symbol, or choice
+            expr._dependents.add(sc)
+
+
+def _compile_expr(expr, memo):
+    # Compiles the expression 'expr' into a function that takes no arguments
+    # and returns the same value as expr_value(expr), but faster. Constant
+    # subexpressions are folded, chains of AND/OR operands are evaluated in a
+    # loop, and symbols are accessed directly instead of going through
+    # expr_value()'s type dispatch.
+    #
+    # Operands are evaluated in the same order as in expr_value(), with the
+    # same short-circuiting.
+    #
+    # 'memo' maps id(expr) to (expr, <compiled expr>) tuples. Dependencies
+    # are often shared between many expressions (e.g. those from 'if' and
+    # 'menu'), and get compiled just once this way. Keeping a reference to the
+    # expression prevents its id from being reused.
+
+    # Check the memo here first too, as most expressions have already been
+    # compiled (e.g. the n/y from missing dependencies)
+    entry = memo.get(id(expr))
+    fn = entry[1] if entry else _compile_rec(expr, memo)
+    if fn.__class__ is int:
+        return _CONST_FNS[fn]
+    return fn
+
+
+def _compile_rec(expr, memo):
+    # _compile_expr() helper. Returns either a function or, for constant
+    # expressions, an int with the tristate value.
+
+    entry = memo.get(id(expr))
+    if entry:
+        return entry[1]
+
+    if expr.__class__ is not tuple:
+        if expr.__class__ is Symbol and \
+           (expr.is_constant or not expr.orig_type):
+            # Constant and untyped (including undefined) symbols always have
+            # the same value
+            res = expr.tri_value
+        else:
+            res = partial(expr.__class__.tri_value.fget, expr)
+
+    elif expr[0] is AND or expr[0] is OR:
+        res = _compile_chain(expr, memo)
+
+    elif expr[0] is NOT:
+        res = _compile_not(_compile_rec(expr[1], memo))
+
+    # Relation
+    elif _is_const_sym(expr[1]) and _is_const_sym(expr[2]):
+        res = expr_value(expr)
+
+    else:
+        res = partial(expr_value, expr)
+
+    memo[id(expr)] = (expr, res)
+    return res
+
+
+def _compile_not(fn):
+    # _compile_rec() helper for NOT expressions. 'fn' is the compiled operand.
+
+    if fn.__class__ is int:
+        return 2 - fn
+
+    def not_fn():
+        return 2 - fn()
+
+    return not_fn
+
+
+def _compile_chain(expr, memo):
+    # _compile_rec() helper for AND/OR expressions. Collects the operands of
+    # nested AND or OR expressions into a flat list (in evaluation order) and
+    # evaluates them in a loop. This also avoids deep recursion for long
+    # chains, e.g. in the reverse dependencies of symbols that are selected
+    # from many locations.
+
+    op = expr[0]
+
+    # For AND, 'bound' is the lowest possible value, where evaluation stops.
+    # For OR, it's the highest possible value.
+    bound = 0 if op is AND else 2
+
+    # Value of the constant operands
+    const = 2 - bound
+
+    fns = []
+    stack = [expr]
+    while stack:
+        subexpr = stack.pop()
+        if subexpr.__class__ is tuple and subexpr[0] is op:
+            # Push the right operand first, so that the left one gets handled
+            # first
+            stack.append(subexpr[2])
+            stack.append(subexpr[1])
+            continue
+
+        fn = _compile_rec(subexpr, memo)
+        if fn.__class__ is int:
+            const = min(const, fn) if op is AND else max(const, fn)
+        else:
+            fns.append(fn)
+
+    if const == bound or not fns:
+        return const
+
+    if const != 2 - bound:
+        # Make the constant the initial value, e.g. m for A && m
+        fns.append(_CONST_FNS[const])
+
+    if len(fns) == 1:
+        return fns[0]
+
+    if op is AND:
+        if len(fns) == 2:
+            fn1, fn2 = fns
+
+            def and_fn():
+                val = fn1()
+                if not val:
+                    return 0
+                val2 = fn2()
+                return val if val < val2 else val2
+
+            return and_fn
+
+        def and_chain_fn():
+            res = 2
+            for fn in fns:
+                val = fn()
+                if not val:
+                    return 0
+                if val < res:
+                    res = val
+            return res
+
+        return and_chain_fn
 
-        _depend_on(sc, expr[1])
+    if len(fns) == 2:
+        fn1, fn2 = fns
 
-        # NOTs only have a single operand
-        if expr[0] is not NOT:
-            _depend_on(sc, expr[2])
+        def or_fn():
+            val = fn1()
+            if val == 2:
+                return 2
+            val2 = fn2()
+            return val if val > val2 else val2
 
-    elif not expr.is_constant:
-        # Non-constant symbol, or choice
-        expr._dependents.add(sc)
+        return or_fn
+
+    def or_chain_fn():
+        res = 0
+        for fn in fns:
+            val = fn()
+            if val == 2:
+                return 2
+            if val > res:
+                res = val
+        return res
+
+    return or_chain_fn
+
+
+def _is_const_sym(sc):
+    # Returns True if the string value of the Symbol/Choice 'sc' never
+    # changes. Helper for _compile_rec().
+
+    return sc.__class__ is Symbol and (sc.is_constant or not sc.orig_type)
 
 
 def _parenthesize(expr, type_, sc_expr_str_fn):
@@ -6389,6 +10096,115 @@ def _touch_dep_file(path, sym_name):
         sym_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644))
 
 
+def _write_outputs_job(kconf, job):
+    # Runs a single Kconfig.write_outputs_batch() job and returns its
+    # (messages, warnings, error) tuple
+
+    config_filename, outputs = job
+
+    warnings = kconf.warnings
+    warn_to_stderr = kconf.warn_to_stderr
+
+    kconf.warnings = []
+    kconf.warn_to_stderr = False
+    try:
+        msgs = [kconf.load_config(config_filename)]
+        msgs += kconf.write_outputs(outputs)
+        return (msgs, kconf.warnings, None)
+
+    except (EnvironmentError, KconfigError) as e:
+        return ([], kconf.warnings, str(e))
+
+    finally:
+        kconf.warnings = warnings
+        kconf.warn_to_stderr = warn_to_stderr
+
+
+def _init_batch_worker(kconf):
+    # Pool initializer for Kconfig.write_outputs_batch(). With fork(), 'kconf'
+    # is inherited rather than pickled. The global is only set in worker
+    # processes.
+
+    global _batch_kconf
+    _batch_kconf = kconf
+
+
+def _run_batch_job(job):
+    # Runs a Kconfig.write_outputs_batch() job in a worker process
+
+    return _write_outputs_job(_batch_kconf, job)
+
+
+def _prelex_file(filename, srctree_prefix, encoding):
+    # Tokenizes the lines without '$' and '\\' in the Kconfig file 'filename'
+    # (an absolute path) in a worker process. Returns a (<lexed>, <filenames>)
+    # tuple, where <lexed> is a map from lines to (<tokens>, <refs>) tuples
+    # (see Kconfig._start_prelexing()), and <filenames> lists the files
+    # matched by 'source' statements with constant patterns.
+    #
+    # Lines that generate warnings or errors are left out. The parser
+    # tokenizes them again, producing the warning or error in the right
+    # context.
+
+    lexed = {}
+    filenames = []
+
+    lexer = _Prelexer(encoding)
+    try:
+        with lexer._open(filename, "r") as f:
+            lines = f.readlines()
+    except (EnvironmentError, UnicodeDecodeError):
+        # The parser reports the error
+        return (lexed, filenames)
+
+    # Path used for 'rsource'. See Kconfig._enter_file().
+    if filename.startswith(srctree_prefix):
+        filename = filename[len(srctree_prefix):]
+
+    n_lines = len(lines)
+    i = 0
+    while i < n_lines:
+        line = lines[i]
+        i += 1
+
+        # Handle line joining, like Kconfig._next_line()
+        while line.endswith("\\\n"):
+            line = line[:-2] + (lines[i] if i < n_lines else "")
+            i += 1
+
+        if "$" in line or "\\" in line or line in lexed:
+            continue
+
+        try:
+            tokens = lexer._tokenize(line)
+        except KconfigError:
+            continue
+
+        if tokens[0] is None:
+            # Blank line or comment, which is quick to tokenize anyway
+            continue
+
+        # Symbol references are (<name>, <is constant>) tuples. See
+        # _Prelexer.
+        lexed[line] = (
+            tuple(token[0] if token.__class__ is tuple else token
+                  for token in tokens),
+            tuple((j, token[1]) for j, token in enumerate(tokens)
+                  if token.__class__ is tuple))
+
+        if tokens[0] in _SOURCE_TOKENS and len(tokens) == 3 and \
+           tokens[1].__class__ is str:
+
+            pattern = tokens[1]
+            if tokens[0] in _REL_SOURCE_TOKENS:
+                pattern = join(dirname(filename), pattern)
+
+            # Same as in Kconfig._parse_block()
+            filenames += sorted(iglob(join(srctree_prefix, pattern)))
+
+    return (lexed, filenames)
+
+
 def _save_old(path):
     # See write_config()
 
@@ -6441,27 +10257,30 @@ def _expr_depends_on(expr, sym):
     # if a submenu should be implicitly created. This also influences which
     # items inside choice statements are considered choice items.
 
-    if expr.__class__ is not tuple:
-        return expr is sym
+    # The operands of nested ANDs are checked in a loop. Dependencies get
+    # ANDed together into long chains in deep menu trees.
+    for operand in split_expr(expr, AND):
+        if operand.__class__ is not tuple:
+            if operand is sym:
+                return True
 
-    if expr[0] in _EQUAL_UNEQUAL:
-        # Check for one of the following:
-        # sym = m/y, m/y = sym, sym != n, n != sym
+        elif operand[0] in _EQUAL_UNEQUAL:
+            # Check for one of the following:
+            # sym = m/y, m/y = sym, sym != n, n != sym
 
-        left, right = expr[1:]
+            left, right = operand[1:]
 
-        if right is sym:
-            left, right = right, left
-        elif left is not sym:
-            return False
+            if right is sym:
+                left, right = right, left
+            elif left is not sym:
+                continue
 
-        return (expr[0] is EQUAL and right is sym.kconfig.m or
-                                     right is sym.kconfig.y) or \
-               (expr[0] is UNEQUAL and right is sym.kconfig.n)
+            if (operand[0] is EQUAL and right is sym.kconfig.m or
+                                        right is sym.kconfig.y) or \
+               (operand[0] is UNEQUAL and right is sym.kconfig.n):
+                return True
 
-    return expr[0] is AND and \
-           (_expr_depends_on(expr[1], sym) or
-            _expr_depends_on(expr[2], sym))
+    return False
 
 
 def _auto_menu_dep(node1, node2):
@@ -6502,6 +10321,50 @@ def _flatten(node):
         node = node.next
 
 
+def _raw_preorder(node, end):
+    # Generates the menu nodes from 'node' up to but not including 'end' among
+    # its siblings, along with all their descendants, in the order they appear
+    # in the Kconfig files. Pass None for 'end' to go to the last sibling. Also
+    # works before finalization, when 'if' nodes are still in the tree.
+
+    # Stack of (<next sibling>, <end>) tuples for the levels above
+    stack = []
+    while 1:
+        while node is end:
+            if not stack:
+                return
+            node, end = stack.pop()
+
+        yield node
+
+        if node.list:
+            stack.append((node.next, end))
+            node = node.list
+            end = None
+        else:
+            node = node.next
+
+
+def _find_file_run(parent, filename):
+    # Finds the menu nodes parsed from the Kconfig file 'filename' among the
+    # children of 'parent' in the menu tree before finalization. Returns a
+    # (<previous node>, <first node>, <node after>) tuple. <previous node> is
+    # None if the run starts at 'parent.list', and <first node> is None if
+    # there are no nodes from 'filename'. <node after> is None at the end.
+
+    prev = None
+    first = parent.list
+    while first and first.filename != filename:
+        prev = first
+        first = first.next
+
+    end = first
+    while end and end.filename == filename:
+        end = end.next
+
+    return (prev, first, end)
+
+
 def _remove_ifs(node):
     # Removes 'if' nodes (which can be recognized by MenuNode.item being None),
     # which are assumed to already have been flattened. The C implementation
@@ -6556,124 +10419,110 @@ def _finalize_choice(node):
             sym.orig_type = choice.orig_type
 
 
-def _check_dep_loop_sym(sym, ignore_choice):
+def _check_dep_loop(sym):
     # Detects dependency loops using depth-first search on the dependency graph
-    # (which is calculated earlier in Kconfig._build_dep()).
+    # (which is calculated earlier in Kconfig._build_dep()), starting from
+    # 'sym'.
     #
     # Algorithm:
     #
     #  1. Symbols/choices start out with _visited = 0, meaning unvisited.
     #
     #  2. When a symbol/choice is first visited, _visited is set to 1, meaning
-    #     "visited, potentially part of a dependency loop". The recursive
-    #     search then continues from the symbol/choice.
+    #     "visited, potentially part of a dependency loop". The search then
+    #     continues from the symbol/choice.
     #
     #  3. If we run into a symbol/choice X with _visited already set to 1,
-    #     there's a dependency loop. The loop is found on the call stack by
-    #     recording symbols while returning ("on the way back") until X is seen
-    #     again.
+    #     there's a dependency loop. The loop is made up of the symbols/choices
+    #     on the search stack from X onwards.
     #
     #  4. Once a symbol/choice and all its dependencies (or dependents in this
-    #     case) have been checked recursively without detecting any loops, its
-    #     _visited is set to 2, meaning "visited, not part of a dependency
-    #     loop".
+    #     case) have been checked without detecting any loops, its _visited is
+    #     set to 2, meaning "visited, not part of a dependency loop".
     #
     #     This saves work if we run into the symbol/choice again in later calls
-    #     to _check_dep_loop_sym(). We just return immediately.
+    #     to _check_dep_loop(). We just skip it.
+    #
+    # The search uses an explicit stack rather than recursion, as long chains
+    # of dependencies are common in generated Kconfig trees.
     #
     # Choices complicate things, as every choice symbol depends on every other
     # choice symbol in a sense. When a choice is "entered" via a choice symbol
     # X, we visit all choice symbols from the choice except X, and prevent
-    # immediately revisiting the choice with a flag (ignore_choice).
+    # immediately revisiting the choice with a flag. See _dep_loop_next().
     #
     # Maybe there's a better way to handle this (different flags or the
     # like...)
 
-    if not sym._visited:
-        # sym._visited == 0, unvisited
-
-        sym._visited = 1
+    if sym._visited:
+        return
 
-        for dep in sym._dependents:
-            # Choices show up in Symbol._dependents when the choice has the
-            # symbol in a 'prompt' or 'default' condition (e.g.
-            # 'default ... if SYM').
-            #
-            # Since we aren't entering the choice via a choice symbol, all
-            # choice symbols need to be checked, hence the None.
-            loop = _check_dep_loop_choice(dep, None) \
-                   if dep.__class__ is Choice \
-                   else _check_dep_loop_sym(dep, False)
-
-            if loop:
-                # Dependency loop found
-                return _found_dep_loop(loop, sym)
-
-        if sym.choice and not ignore_choice:
-            loop = _check_dep_loop_choice(sym.choice, sym)
-            if loop:
-                # Dependency loop found
-                return _found_dep_loop(loop, sym)
-
-        # The symbol is not part of a dependency loop
-        sym._visited = 2
-
-        # No dependency loop found
-        return None
+    sym._visited = 1
+
+    # Stack of (<symbol/choice>, <iterator over the items to visit next>)
+    # tuples
+    stack = [(sym, _dep_loop_next(sym, False))]
+    while stack:
+        for item, arg in stack[-1][1]:
+            if not item._visited:
+                # Unvisited. Continue the search from it.
+                item._visited = 1
+                stack.append((item, _dep_loop_next(item, arg)))
+                break
 
-    if sym._visited == 2:
-        # The symbol was checked earlier and is already known to not be part of
-        # a dependency loop
-        return None
+            if item._visited == 1:
+                # Found a dependency loop
+                _found_dep_loop([sc for sc, _ in stack], item)
 
-    # sym._visited == 1, found a dependency loop. Return the symbol as the
-    # first element in it.
-    return (sym,)
+            # item._visited == 2, checked earlier and already known to not be
+            # part of a dependency loop
 
+        else:
+            # All items reachable from the symbol/choice have been checked. It
+            # is not part of a dependency loop.
+            stack.pop()[0]._visited = 2
 
-def _check_dep_loop_choice(choice, skip):
-    if not choice._visited:
-        # choice._visited == 0, unvisited
 
-        choice._visited = 1
+def _dep_loop_next(item, arg):
+    # _check_dep_loop() helper. Generates (<symbol/choice>, <arg>) tuples for
+    # the items to visit after the symbol/choice 'item'. For symbols, 'arg' is
+    # True if the symbol's choice should not be visited. For choices, it's the
+    # choice symbol to skip, or None.
 
+    if item.__class__ is Choice:
         # Check for loops involving choice symbols. If we came here via a
         # choice symbol, skip that one, as we'd get a false positive
         # '<sym FOO> -> <choice> -> <sym FOO>' loop otherwise.
-        for sym in choice.syms:
-            if sym is not skip:
+        for sym in item.syms:
+            if sym is not arg:
                 # Prevent the choice from being immediately re-entered via the
                 # "is a choice symbol" path by passing True
-                loop = _check_dep_loop_sym(sym, True)
-                if loop:
-                    # Dependency loop found
-                    return _found_dep_loop(loop, choice)
-
-        # The choice is not part of a dependency loop
-        choice._visited = 2
-
-        # No dependency loop found
-        return None
-
-    if choice._visited == 2:
-        # The choice was checked earlier and is already known to not be part of
-        # a dependency loop
-        return None
+                yield (sym, True)
+        return
 
-    # choice._visited == 1, found a dependency loop. Return the choice as the
-    # first element in it.
-    return (choice,)
+    for dep in item._dependents:
+        # Choices show up in Symbol._dependents when the choice has the
+        # symbol in a 'prompt' or 'default' condition (e.g.
+        # 'default ... if SYM').
+        #
+        # Since we aren't entering the choice via a choice symbol, all
+        # choice symbols need to be checked, hence the None.
+        yield (dep, None if dep.__class__ is Choice else False)
 
+    if item.choice and not arg:
+        yield (item.choice, item)
 
-def _found_dep_loop(loop, cur):
-    # Called "on the way back" when we know we have a loop
 
-    # Is the symbol/choice 'cur' where the loop started?
-    if cur is not loop[0]:
-        # Nope, it's just a part of the loop
-        return loop + (cur,)
+def _found_dep_loop(stack, start):
+    # Called when we know we have a loop. 'stack' is the list of
+    # symbols/choices on the search stack, and 'start' the one where the loop
+    # starts, which appears in 'stack'. Throws an exception that shows the
+    # loop.
 
-    # Yep, we have the entire loop. Throw an exception that shows it.
+    # The items are listed in the order they depend on each other, starting
+    # from the item that depends on 'start'. This is the reverse of the search
+    # order, as the search follows Symbol/Choice._dependents.
+    loop = [start] + stack[:stack.index(start):-1]
 
     msg = "\nDependency loop\n" \
             "===============\n\n"
@@ -6714,6 +10563,12 @@ def _found_dep_loop(loop, cur):
     raise KconfigError(msg)
 
 
+def _identity(obj):
+    # Used when unpickling _CachedState entries. See Kconfig._save_cache().
+
+    return obj
+
+
 def _decoding_error(e, filename, macro_linenr=None):
     # Gives the filename and context for UnicodeDecodeError's, which are a pain
     # to debug otherwise. 'e' is the UnicodeDecodeError object.
@@ -6779,18 +10634,24 @@ def _error_if_fn(kconf, _, cond, msg):
 
 
 def _shell_fn(kconf, _, command):
-    import subprocess  # Only import as needed, to save some startup time
+    if kconf.stats:
+        t = kconf.stats._clock()
 
-    stdout, stderr = subprocess.Popen(
-        command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-    ).communicate()
+    try:
+        if kconf._shell_cache:
+            stdout, stderr, cached = kconf._shell_cache.run(command,
+                                                            kconf._encoding)
+        else:
+            stdout, stderr = _run_shell(command, kconf._encoding)
+            cached = False
+    except UnicodeDecodeError as e:
+        _decoding_error(e, kconf.filename, kconf.linenr)
 
-    if not _IS_PY2:
-        try:
-            stdout = stdout.decode(kconf._encoding)
-            stderr = stderr.decode(kconf._encoding)
-        except UnicodeDecodeError as e:
-            _decoding_error(e, kconf.filename, kconf.linenr)
+    if kconf.stats:
+        kconf.stats._lap("shell", t)
+        kconf.stats.counts["shell_commands"] += 1
+        if cached:
+            kconf.stats.counts["shell_cache_hits"] += 1
 
     if stderr:
         kconf._warn("'{}' wrote to stderr: {}".format(
@@ -6806,6 +10667,24 @@ def _shell_fn(kconf, _, command):
     # parameter was added in 3.6), so we do this manual version instead.
     return "\n".join(stdout.splitlines()).rstrip("\n").replace("\n", " ")
 
+
+def _run_shell(command, encoding):
+    # Runs 'command' in a shell for _shell_fn(). Returns a (stdout, stderr)
+    # tuple, decoded with 'encoding' on Python 3. Raises UnicodeDecodeError on
+    # decoding errors.
+
+    import subprocess  # Only import as needed, to save some startup time
+
+    stdout, stderr = subprocess.Popen(
+        command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    ).communicate()
+
+    if not _IS_PY2:
+        stdout = stdout.decode(encoding)
+        stderr = stderr.decode(encoding)
+
+    return stdout, stderr
+
 #
 # Global constants
 #
@@ -6827,6 +10706,82 @@ STR_TO_TRI = {
 # Symbol will do. We test this with 'is'.
 _NO_CACHED_SELECTION = 0
 
+# What a BatchEvaluator calculates for a symbol or choice: the visibility,
+# the value, or the choice selection
+_BATCH_VIS = 0
+_BATCH_VAL = 1
+_BATCH_SEL = 2
+
+# Translation tables that turn bytearrays from _user_val_bytes() into bit
+# strings for the 'has user value', 'm-or-y', and 'y' masks
+_USER_VAL_TABLES = tuple([
+    bytes(bytearray([ord("1") if chr(i) in chars else ord("0")
+                     for i in range(256)]))
+    for chars in ("012", "12", "2")])
+
+# Translation table from the digits "0", "1", and "2" to 0, 1, and 2. See
+# _masks_to_tris().
+_DIGIT_TO_TRI = bytes(bytearray([i - ord("0") if "0" <= chr(i) <= "2" else 0
+                                 for i in range(256)]))
+
+# Number of queued items at which Kconfig._update_changed() gives up on
+# recalculating values in dependency order and invalidates the remaining
+# items instead
+_MAX_UPDATE_QUEUE = 256
+
+# Functions that return the constant values n/m/y. Used for compiled
+# expressions (see _compile_expr()).
+_CONST_FNS = (
+    lambda: 0,
+    lambda: 1,
+    lambda: 2,
+)
+
+# Classes whose instances are stored in the parse cache. See
+# Kconfig._save_cache().
+_CACHED_CLASSES = (Symbol, Choice, MenuNode, Variable)
+
+# Symbol/Choice/MenuNode/Variable attributes that are not stored in the parse
+# cache
+_UNCACHED_ATTRS = frozenset((
+    "_compiled",
+    "_default_fns",
+    "_direct_dep_fn",
+    "_prompt_fns",
+    "_range_fns",
+    "_rev_dep_fn",
+    "_weak_rev_dep_fn",
+    "kconfig",
+))
+
+# Kconfig attributes that are stored in the parse cache. Everything else is
+# either set up before the cache is looked up or only used during parsing.
+_CACHED_KCONFIG_ATTRS = (
+    "choices",
+    "comments",
+    "const_syms",
+    "defconfig_list",
+    "defined_syms",
+    "env_vars",
+    "filename",
+    "kconfig_filenames",
+    "linenr",
+    "m",
+    "menus",
+    "modules",
+    "n",
+    "named_choices",
+    "syms",
+    "top_node",
+    "unique_choices",
+    "unique_defined_syms",
+    "variables",
+    "y",
+)
+
+# Version of the $(shell,...) cache file format. See _ShellCache.
+_SHELL_CACHE_VERSION = 1
+
 # Are we running on Python 2?
 _IS_PY2 = sys.version_info[0] < 3
 
@@ -6995,6 +10950,50 @@ TYPE_TO_STR = {
     HEX:      "hex",
 }
 
+# Phases and counters in Stats, in report order
+_STATS_PHASES = (
+    "init",
+    "parse_cache_load",
+    "parse",
+    "shell",
+    "finalize",
+    "check_sanity",
+    "build_dep",
+    "check_dep_loop",
+    "compact",
+    "parse_cache_save",
+    "load_config",
+    "evaluate_all",
+    "write",
+)
+_STATS_COUNTERS = (
+    "files",
+    "lines",
+    "shell_commands",
+    "shell_cache_hits",
+    "expansion_memo_hits",
+    "prelexed_lines",
+    "parse_cache_hits",
+    "parse_cache_misses",
+    "evaluations",
+    "assignments",
+    "invalidations",
+    "largest_invalidation",
+)
+
+# Maps output format names to OutputWriter subclasses, for
+# Kconfig.write_outputs() and genconfig's --format option. New formats can be
+# added.
+OUTPUT_FORMATS = {
+    "autoconf": AutoConfWriter,
+    "cmake":    CMakeWriter,
+    "config":   ConfigWriter,
+    "header":   HeaderWriter,
+    "json":     JSONWriter,
+    "make":     MakeWriter,
+    "rust":     RustWriter,
+}
+
 # Used in comparisons. 0 means the base is inferred from the format of the
 # string.
 _TYPE_TO_BASE = {
@@ -7077,6 +11076,13 @@ _BOOL_TRISTATE_UNKNOWN = frozenset({
     UNKNOWN,
 })
 
+# Valid user values for bool and tristate symbols and choices, mapped to
+# their tristate values. See Symbol/Choice.set_value().
+_BATCH_USER_VALS = {
+    BOOL:     {0: 0, 2: 2, "n": 0, "y": 2},
+    TRISTATE: {0: 0, 1: 1, 2: 2, "n": 0, "m": 1, "y": 2},
+}
+
 _INT_HEX = frozenset({
     INT,
     HEX,
@@ -7158,3 +11164,8 @@ _name_special_search = _re_search(r'[^A-Za-z0-9_$/.-]|\$\(|$')
 # A valid right-hand side for an assignment to a string symbol in a .config
 # file, including escaped characters. Extracts the contents.
 _conf_string_match = _re_match(r'"((?:[^\\"]|\\.)*)"')
+
+# Environment variable references ($VAR and ${VAR}) in a $(shell,...) command.
+# Used for the $(shell,...) cache.
+_shell_env_refs = re.compile(r"\$\{?([A-Za-z_][A-Za-z0-9_]*)",
+                             0 if _IS_PY2 else re.ASCII).findall
@@ -0,0 +1,702 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2019, Ulf Magnusson
+# SPDX-License-Identifier: ISC
+
+"""
+Keeps a parsed Kconfig tree in memory and answers queries about it over a Unix
+domain socket. This avoids reparsing the Kconfig files for each query, which
+can take a while for large trees.
+
+Start the server with
+
+  $ kconfigserver serve [KCONFIG]
+
+and query it with e.g.
+
+  $ kconfigserver eval 'FOO && BAR'
+  y
+  $ kconfigserver value FOO
+  m
+
+The socket path is taken from the KCONFIG_SERVER environment variable, and
+defaults to 'kconfig.sock' if KCONFIG_SERVER is unset. It can also be given
+with --socket.
+
+If KCONFIG_SERVER is set and a server is listening on it, genconfig and
+setconfig send their requests to the server instead of parsing the Kconfig
+files themselves. This only happens if the server was started for the same
+top-level Kconfig file, from the same working directory, and with the same
+values for the environment variables that affect Kconfiglib (including the
+ones referenced in the Kconfig files). Otherwise, they fall back on parsing.
+
+The server checks the modification times of the Kconfig files before each
+request, and reparses them if any file has changed. Usually, only the changed
+files need to be reparsed (see Kconfig.reload()). User values are carried over
+to the new configuration.
+
+Protocol
+========
+
+Requests and responses are JSON objects, one per line. A client can send any
+number of requests over a connection. Connections are served one at a time,
+so requests from other clients can't come in between. A request looks like
+
+  {"op": "set_value", "name": "FOO", "value": "y"}
+
+where "op" is the operation and the remaining keys are arguments. The response
+is either
+
+  {"ok": true, "result": <result>, "warnings": [...]}
+
+or, if the request failed,
+
+  {"ok": false, "error": "<message>", "warnings": [...]}
+
+"warnings" holds the warnings generated while handling the request.
+
+These operations are available. Arguments in brackets are optional, and
+correspond to the arguments of the Kconfiglib functions with the same name.
+Relative paths are interpreted relative to the working directory of the
+server, and default filenames come from the environment of the server (e.g.
+KCONFIG_CONFIG).
+
+  info
+    Returns {"kconfig": <top-level Kconfig file, as passed to the server>,
+    "cwd": <working directory>, "env": {<name>: <value or null>, ...},
+    "kconfig_filenames": [...], "env_vars": [...]}. "env" has the
+    environment variables that affect Kconfiglib.
+
+  eval_string: expr
+    Returns the value of the expression as "n", "m", or "y".
+
+  sym: name
+    Returns {"name": ..., "type": ..., "orig_type": ..., "value": ...,
+    "user_value": ..., "visibility": ..., "assignable": [...],
+    "defined": <bool>}, with tristate values as "n", "m", or "y".
+
+  load_config: [filename], [replace]
+    Returns the message from Kconfig.load_config().
+
+  set_value: name, value
+    Returns true if the value was valid for the symbol, and false otherwise.
+
+  set_values: values
+    'values' maps symbol names to values. Returns the names of the symbols
+    whose values were invalid. No values are assigned in that case, so that
+    a failed request doesn't leave the configuration half-changed for other
+    clients.
+
+  write_config: [filename], [header], [save_old]
+    Returns the message from Kconfig.write_config().
+
+  write_autoconf: [filename], [header]
+    Returns the message from Kconfig.write_autoconf().
+
+  sync_deps: path
+    Returns null.
+
+  snapshot
+    Saves the current configuration on the server (see Kconfig.snapshot()),
+    replacing any configuration saved earlier. Returns null.
+
+  restore
+    Restores the configuration saved with the last "snapshot" request. Returns
+    null.
+
+  shutdown
+    Stops the server. Returns null.
+"""
+import argparse
+import errno
+import json
+import os
+import socket
+import sys
+
+try:
+    import socketserver
+except ImportError:
+    # Python 2
+    import SocketServer as socketserver
+
+import kconfiglib
+
+
+DEFAULT_SOCKET_PATH = "kconfig.sock"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=__doc__)
+
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        help="Socket path (default: $KCONFIG_SERVER, or {})"
+             .format(DEFAULT_SOCKET_PATH))
+
+    subparsers = parser.add_subparsers(dest="command")
+
+    serve_parser = subparsers.add_parser(
+        "serve",
+        help="Start the server")
+
+    serve_parser.add_argument(
+        "kconfig",
+        metavar="KCONFIG",
+        nargs="?",
+        default="Kconfig",
+        help="Top-level Kconfig file (default: Kconfig)")
+
+    eval_parser = subparsers.add_parser(
+        "eval",
+        help="Print the value (n/m/y) of an expression")
+
+    eval_parser.add_argument("expr", metavar="EXPR")
+
+    value_parser = subparsers.add_parser(
+        "value",
+        help="Print the value of a symbol")
+
+    value_parser.add_argument("name", metavar="NAME")
+
+    request_parser = subparsers.add_parser(
+        "request",
+        help="Send a JSON request and print the result as JSON")
+
+    request_parser.add_argument("request", metavar="JSON")
+
+    subparsers.add_parser(
+        "stop",
+        help="Stop the server")
+
+    args = parser.parse_args()
+
+    socket_path = args.socket or os.getenv("KCONFIG_SERVER",
+                                           DEFAULT_SOCKET_PATH)
+
+    if args.command == "serve":
+        serve(args.kconfig, socket_path)
+        return
+
+    if args.command is None:
+        parser.error("no command given")
+
+    client = Client(socket_path)
+    try:
+        if args.command == "eval":
+            print(client.eval_string(args.expr))
+
+        elif args.command == "value":
+            print(client.sym(args.name)["value"])
+
+        elif args.command == "request":
+            try:
+                request = json.loads(args.request)
+            except ValueError as e:
+                parser.error("invalid JSON in request: " + str(e))
+
+            if not isinstance(request, dict) or "op" not in request:
+                parser.error('the request must be a JSON object with an "op" '
+                             'key')
+
+            print(json.dumps(client.request(request.pop("op"), **request)))
+
+        else:  # stop
+            client.request("shutdown")
+
+    except kconfiglib.KconfigError as e:
+        sys.exit("error: " + str(e))
+
+    finally:
+        client.close()
+
+
+def serve(kconfig_filename, socket_path):
+    """
+    Parses 'kconfig_filename' and serves requests for it on the Unix domain
+    socket 'socket_path' until a "shutdown" request is received. See the
+    module docstring for the protocol. Requires Python 3.
+
+    A stale socket file left behind by a server that is no longer running is
+    removed. Raises KconfigError if another server is already listening on
+    'socket_path'.
+    """
+    if os.path.exists(socket_path):
+        if _listening(socket_path):
+            raise kconfiglib.KconfigError(
+                "a server is already listening on " + socket_path)
+        os.remove(socket_path)
+
+    state = _ServerState(kconfig_filename)
+
+    server = _Server(socket_path, _Handler)
+    server.state = state
+    try:
+        while not state.shutdown:
+            server.handle_request()
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+def connect(kconfig_filename="Kconfig"):
+    """
+    Returns a Client connected to the server on the socket in the
+    KCONFIG_SERVER environment variable, or None if KCONFIG_SERVER is unset or
+    nothing is listening on the socket.
+
+    None is also returned if the server would give different results than
+    parsing 'kconfig_filename' in this process: If it was started for a
+    different top-level Kconfig file, from a different working directory, or
+    with different values for environment variables that affect Kconfiglib.
+
+    Used by genconfig and setconfig to use a running server when available.
+    """
+    socket_path = os.getenv("KCONFIG_SERVER")
+    if not socket_path:
+        return None
+
+    try:
+        client = Client(socket_path)
+    except socket.error:
+        return None
+
+    info = client.info()
+    if info["kconfig"] != kconfig_filename or \
+       info["cwd"] != os.getcwd() or \
+       any(os.getenv(name) != val for name, val in info["env"].items()):
+        client.close()
+        return None
+
+    return client
+
+
+class Client(object):
+    """
+    A connection to a server started with serve().
+
+    The methods mirror the Kconfig methods with the same names. Paths and
+    default filenames are interpreted by the server, like for the protocol.
+
+    Errors reported by the server are raised as KconfigError exceptions.
+    Warnings are written to stderr.
+    """
+    __slots__ = (
+        "_file",
+        "_info",
+        "_sock",
+    )
+
+    def __init__(self, socket_path):
+        """
+        Connects to the server listening on the Unix domain socket
+        'socket_path'. Raises socket.error if the connection fails.
+        """
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._sock.connect(socket_path)
+        except socket.error:
+            self._sock.close()
+            raise
+
+        self._file = self._sock.makefile("rb")
+        self._info = None
+
+    def close(self):
+        """
+        Closes the connection.
+        """
+        self._file.close()
+        self._sock.close()
+
+    def request(self, op, **args):
+        """
+        Sends the request 'op' with the arguments 'args' to the server and
+        returns the result. See the module docstring.
+        """
+        args["op"] = op
+        self._sock.sendall(json.dumps(args).encode("utf-8") + b"\n")
+
+        line = self._file.readline()
+        if not line:
+            raise kconfiglib.KconfigError("the server closed the connection")
+        response = json.loads(line.decode("utf-8"))
+
+        for warning in response["warnings"]:
+            sys.stderr.write(warning + "\n")
+
+        if not response["ok"]:
+            raise kconfiglib.KconfigError(response["error"])
+
+        return response["result"]
+
+    def info(self):
+        """
+        Returns information about the Kconfig tree served. See the module
+        docstring.
+        """
+        return self.request("info")
+
+    @property
+    def kconfig_filenames(self):
+        """
+        Like Kconfig.kconfig_filenames.
+        """
+        return self._cached_info()["kconfig_filenames"]
+
+    @property
+    def env_vars(self):
+        """
+        Like Kconfig.env_vars.
+        """
+        return set(self._cached_info()["env_vars"])
+
+    def eval_string(self, s):
+        """
+        Like Kconfig.eval_string(), but returns the value as "n", "m", or "y".
+        """
+        return self.request("eval_string", expr=s)
+
+    def sym(self, name):
+        """
+        Returns information about the symbol 'name'. See the module docstring.
+        """
+        return self.request("sym", name=name)
+
+    def load_config(self, filename=None, replace=True):
+        """
+        See Kconfig.load_config().
+        """
+        return self.request("load_config", filename=filename,
+                            replace=replace)
+
+    def set_value(self, name, value):
+        """
+        Like Symbol.set_value(), with the symbol given by name.
+        """
+        return self.request("set_value", name=name, value=value)
+
+    def set_values(self, values):
+        """
+        Like Kconfig.set_values(), with 'values' mapping symbol names to
+        values. Returns the names of the symbols whose values were invalid.
+        Unlike for Kconfig.set_values(), no values are assigned in that case.
+        """
+        return self.request("set_values", values=values)
+
+    def write_config(self, filename=None, header=None, save_old=True):
+        """
+        See Kconfig.write_config().
+        """
+        return self.request("write_config", filename=filename,
+                            header=header, save_old=save_old)
+
+    def write_autoconf(self, filename=None, header=None):
+        """
+        See Kconfig.write_autoconf().
+        """
+        return self.request("write_autoconf", filename=filename,
+                            header=header)
+
+    def write_outputs(self, outputs):
+        """
+        Like Kconfig.write_outputs(), with the output formats given by name
+        (see kconfiglib.OUTPUT_FORMATS).
+        """
+        return self.request("write_outputs", outputs=list(outputs))
+
+    def sync_deps(self, path):
+        """
+        See Kconfig.sync_deps().
+        """
+        return self.request("sync_deps", path=path)
+
+    def snapshot(self):
+        """
+        Saves the current configuration on the server. See the module
+        docstring.
+        """
+        return self.request("snapshot")
+
+    def restore(self):
+        """
+        Restores the configuration saved with snapshot(). See the module
+        docstring.
+        """
+        return self.request("restore")
+
+    def _cached_info(self):
+        if self._info is None:
+            self._info = self.info()
+        return self._info
+
+
+#
+# Private classes and functions
+#
+
+
+class _Server(socketserver.UnixStreamServer):
+    # The _ServerState is stored on the server, so that the request handler
+    # can reach it via its 'server' attribute
+    state = None
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # Handles the requests on a connection. Connections are handled one at a
+    # time, so no locking is needed.
+
+    def handle(self):
+        state = self.server.state
+
+        for line in self.rfile:
+            response = state.handle(line)
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+            if state.shutdown:
+                return
+
+
+class _ServerState(object):
+    # The Kconfig instance being served, along with the information needed to
+    # notice when it needs to be reparsed
+
+    __slots__ = (
+        "kconf",
+        "kconfig_filename",
+        "mtimes",
+        "shutdown",
+        "snapshot",
+    )
+
+    def __init__(self, kconfig_filename):
+        self.kconfig_filename = kconfig_filename
+        self.shutdown = False
+        self.snapshot = None
+        self.kconf = self._parse()
+
+    def handle(self, line):
+        # Handles the request in 'line' (bytes) and returns the response, as a
+        # dict
+
+        try:
+            self._reparse_if_changed()
+
+            # UnicodeDecodeError is a ValueError
+            request = json.loads(line.decode("utf-8"))
+            if not isinstance(request, dict):
+                raise kconfiglib.KconfigError(
+                    "the request is not a JSON object")
+
+            op = request.pop("op", None)
+            if op not in _OPS:
+                raise kconfiglib.KconfigError(
+                    "unknown operation '{}'".format(op))
+
+            response = {"ok": True, "result": _OPS[op](self, **request)}
+
+        except (kconfiglib.KconfigError, EnvironmentError, TypeError,
+                ValueError) as e:
+
+            response = {"ok": False, "error": str(e)}
+
+        response["warnings"] = self.kconf.warnings
+        self.kconf.warnings = []
+
+        return response
+
+    def _parse(self):
+        kconf = kconfiglib.Kconfig(self.kconfig_filename,
+                                   warn_to_stderr=False, reloadable=True,
+                                   lazy_help=True)
+        self._parsed(kconf)
+        return kconf
+
+    def _parsed(self, kconf):
+        # Common code for after parsing and reparsing
+
+        # Parsing warnings go to the server's stderr
+        for warning in kconf.warnings:
+            sys.stderr.write(warning + "\n")
+        kconf.warnings = []
+
+        self.mtimes = self._current_mtimes(kconf)
+
+    def _current_mtimes(self, kconf):
+        # Returns a list with the modification times of the Kconfig files, in
+        # the order they appear in kconfig_filenames. None is used for files
+        # that can't be stat()'d.
+
+        mtimes = []
+        for filename in kconf.kconfig_filenames:
+            try:
+                mtimes.append(
+                    os.stat(os.path.join(kconf.srctree, filename)).st_mtime)
+            except OSError:
+                mtimes.append(None)
+
+        return mtimes
+
+    def _reparse_if_changed(self):
+        # Reparses the Kconfig files that have changed since they were last
+        # parsed, if any. Kconfig.reload() carries over user values.
+
+        mtimes = self._current_mtimes(self.kconf)
+        if mtimes == self.mtimes:
+            return
+
+        self.kconf.reload(
+            [filename for filename, old, new
+             in zip(self.kconf.kconfig_filenames, self.mtimes, mtimes)
+             if old != new])
+
+        self._parsed(self.kconf)
+
+    def _info(self):
+        env = {}
+        for name in _ENV_VARS + tuple(self.kconf.env_vars):
+            env[name] = os.getenv(name)
+
+        return {
+            "kconfig": self.kconfig_filename,
+            "cwd": os.getcwd(),
+            "env": env,
+            "kconfig_filenames": self.kconf.kconfig_filenames,
+            "env_vars": sorted(self.kconf.env_vars),
+        }
+
+    def _eval_string(self, expr):
+        return kconfiglib.TRI_TO_STR[self.kconf.eval_string(expr)]
+
+    def _lookup(self, name):
+        # Returns the symbol 'name', raising KconfigError if it doesn't exist
+
+        if name not in self.kconf.syms:
+            raise kconfiglib.KconfigError(
+                "no symbol '{}' in configuration".format(name))
+        return self.kconf.syms[name]
+
+    def _sym(self, name):
+        sym = self._lookup(name)
+
+        user_value = sym.user_value
+        if user_value is not None and \
+           sym.orig_type in (kconfiglib.BOOL, kconfiglib.TRISTATE):
+            user_value = kconfiglib.TRI_TO_STR[user_value]
+
+        return {
+            "name": sym.name,
+            "type": kconfiglib.TYPE_TO_STR[sym.type],
+            "orig_type": kconfiglib.TYPE_TO_STR[sym.orig_type],
+            "value": sym.str_value,
+            "user_value": user_value,
+            "visibility": kconfiglib.TRI_TO_STR[sym.visibility],
+            "assignable": [kconfiglib.TRI_TO_STR[val]
+                           for val in sym.assignable],
+            "defined": bool(sym.nodes),
+        }
+
+    def _load_config(self, filename=None, replace=True):
+        return self.kconf.load_config(filename, replace)
+
+    def _set_value(self, name, value):
+        return self._lookup(name).set_value(value)
+
+    def _set_values(self, values):
+        if not isinstance(values, dict):
+            raise kconfiglib.KconfigError("'values' must be a JSON object")
+
+        # Look up all symbols before assigning anything
+        values = [(self._lookup(name), value)
+                  for name, value in values.items()]
+
+        snapshot = self.kconf.snapshot()
+        invalid = self.kconf.set_values(values)
+        if invalid:
+            # All or nothing
+            self.kconf.restore(snapshot)
+
+        return [sym.name for sym in invalid]
+
+    def _write_config(self, filename=None, header=None, save_old=True):
+        return self.kconf.write_config(filename, header, save_old)
+
+    def _write_autoconf(self, filename=None, header=None):
+        return self.kconf.write_autoconf(filename, header)
+
+    def _write_outputs(self, outputs):
+        return self.kconf.write_outputs(outputs)
+
+    def _sync_deps(self, path):
+        self.kconf.sync_deps(path)
+
+    def _snapshot(self):
+        self.snapshot = self.kconf.snapshot()
+
+    def _restore(self):
+        if self.snapshot is None:
+            raise kconfiglib.KconfigError("no configuration has been saved")
+        self.kconf.restore(self.snapshot)
+
+    def _shutdown(self):
+        self.shutdown = True
+
+
+def _listening(socket_path):
+    # Returns True if a server is listening on 'socket_path'
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return True
+    except socket.error as e:
+        if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+            return False
+        raise
+    finally:
+        sock.close()
+
+
+# Environment variables that affect Kconfiglib, apart from the ones referenced
+# in the Kconfig files
+_ENV_VARS = (
+    "CONFIG_",
+    "KCONFIG_AUTOHEADER",
+    "KCONFIG_AUTOHEADER_HEADER",
+    "KCONFIG_CONFIG",
+    "KCONFIG_CONFIG_HEADER",
+    "KCONFIG_FUNCTIONS",
+    "KCONFIG_SHELL_CACHE",
+    "KCONFIG_SHELL_CACHE_SALT",
+    "KCONFIG_SHELL_CACHE_SIZE",
+    "KCONFIG_SHELL_PREFETCH",
+    "KCONFIG_STRICT",
+    "KCONFIG_WARN_UNDEF",
+    "KCONFIG_WARN_UNDEF_ASSIGN",
+    "srctree",
+)
+
+# Maps operation names to _ServerState methods
+_OPS = {
+    "info":           _ServerState._info,
+    "eval_string":    _ServerState._eval_string,
+    "sym":            _ServerState._sym,
+    "load_config":    _ServerState._load_config,
+    "set_value":      _ServerState._set_value,
+    "set_values":     _ServerState._set_values,
+    "write_config":   _ServerState._write_config,
+    "write_autoconf": _ServerState._write_autoconf,
+    "write_outputs":  _ServerState._write_outputs,
+    "sync_deps":      _ServerState._sync_deps,
+    "snapshot":       _ServerState._snapshot,
+    "restore":        _ServerState._restore,
+    "shutdown":       _ServerState._shutdown,
+}
+
+
+if __name__ == "__main__":
+    main()
@@ -29,6 +29,12 @@ def main():
         action="store_true",
         help="Show any help texts as well")
 
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print timings and counters from Kconfiglib to stderr at the "
+             "end (see kconfiglib.Stats)")
+
     parser.add_argument(
         "kconfig",
         metavar="KCONFIG",
@@ -38,7 +44,7 @@ def main():
 
     args = parser.parse_args()
 
-    kconf = Kconfig(args.kconfig, suppress_traceback=True)
+    kconf = Kconfig(args.kconfig, suppress_traceback=True, stats=args.stats)
     # Make it possible to filter this message out
     print(kconf.load_config(), file=sys.stderr)
 
@@ -71,6 +77,9 @@ def main():
                                         for line in node.help.split("\n")))
                         break
 
+    if args.stats:
+        sys.stderr.write(str(kconf.stats))
+
 
 if __name__ == "__main__":
     main()
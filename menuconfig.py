@@ -754,6 +754,9 @@ def _needs_save():
         # Assignments to undefined symbols in the .config
         return True
 
+    # Faster than calculating the values one by one below
+    _kconf.evaluate_all()
+
     for sym in _kconf.unique_defined_syms:
         if sym.user_value is None:
             if sym.config_string:
@@ -2025,6 +2028,13 @@ def _jump_to_dialog():
     sel_node_i = 0  # Index of selected row
     scroll = 0  # Index in 'matches' of the top row of the list
 
+    # Maps search texts to lists of matching _search_index() entries, for the
+    # search texts that are prefixes of the current search text. Used to
+    # refine earlier results instead of searching everything on each
+    # keystroke, and to make deleting characters fast. The empty search text
+    # matches everything.
+    match_cache = {"": _search_index()}
+
     # Edit box at the top
     edit_box = _styled_win("jump-edit")
     edit_box.keypad(True)
@@ -2075,55 +2085,12 @@ def _jump_to_dialog():
             prev_s = s
 
             try:
-                # We could use re.IGNORECASE here instead of lower(), but this
-                # is noticeably less jerky while inputting regexes like
-                # '.*debug$' (though the '.*' is redundant there). Those
-                # probably have bad interactions with re.search(), which
-                # matches anywhere in the string.
-                #
-                # It's not horrible either way. Just a bit smoother.
-                regex_searches = [re.compile(regex).search
-                                  for regex in s.lower().split()]
+                matches = [entry[0] for entry in
+                           _jump_to_matches(s, match_cache)]
 
                 # No exception thrown, so the regexes are okay
                 bad_re = None
 
-                # List of matching nodes
-                matches = []
-                add_match = matches.append
-
-                # Search symbols and choices
-
-                for node in _sorted_sc_nodes():
-                    # Symbol/choice
-                    sc = node.item
-
-                    for search in regex_searches:
-                        # Both the name and the prompt might be missing, since
-                        # we're searching both symbols and choices
-
-                        # Does the regex match either the symbol name or the
-                        # prompt (if any)?
-                        if not (sc.name and search(sc.name.lower()) or
-                                node.prompt and search(node.prompt[0].lower())):
-
-                            # Give up on the first regex that doesn't match, to
-                            # speed things up a bit when multiple regexes are
-                            # entered
-                            break
-
-                    else:
-                        add_match(node)
-
-                # Search menus and comments
-
-                for node in _sorted_menu_comment_nodes():
-                    for search in regex_searches:
-                        if not search(node.prompt[0].lower()):
-                            break
-                    else:
-                        add_match(node)
-
             except re.error as e:
                 # Bad regex. Remember the error message so we can show it.
                 bad_re = "Bad regular expression"
@@ -2201,6 +2168,126 @@ def _jump_to_dialog():
                                          _width(edit_box) - 2)
 
 
+# Matches characters that have a special meaning in regexes. Search words
+# without them are plain substrings.
+_REGEX_SPECIAL_RE = re.compile(r"[][\\.^$*+?{}|()]")
+
+
+def _jump_to_matches(s, match_cache):
+    # Returns a list of _search_index() entries that match the search text 's'
+    # in the jump-to dialog. Throws re.error for bad regexes.
+    #
+    # Each whitespace-separated word in 's' is a regex that must match either
+    # the name or the prompt of the item. Words without special regex
+    # characters are searched for as plain substrings, which is a lot faster.
+    #
+    # 'match_cache' is the cache from _jump_to_dialog(), and gets updated.
+
+    # Forget results for search texts that aren't prefixes of 's', so that the
+    # cache doesn't grow without bounds
+    for cached_s in list(match_cache):
+        if not s.startswith(cached_s):
+            del match_cache[cached_s]
+
+    if s in match_cache:
+        # E.g. after deleting a character
+        return match_cache[s]
+
+    # We could use re.IGNORECASE here instead of lower(), but this is
+    # noticeably less jerky while inputting regexes like '.*debug$' (though
+    # the '.*' is redundant there). Those probably have bad interactions with
+    # re.search(), which matches anywhere in the string.
+    #
+    # It's not horrible either way. Just a bit smoother.
+    words = s.lower().split()
+
+    if _REGEX_SPECIAL_RE.search(s):
+        regex_searches = [re.compile(word).search for word in words]
+
+        # Search everything. Unlike for plain substrings, results for a prefix
+        # of a regex can't be refined: 'a' doesn't match everything 'a|b'
+        # matches, for example.
+
+        matches = []
+        add_match = matches.append
+
+        for entry in match_cache[""]:
+            _, name, prompt = entry
+
+            for search in regex_searches:
+                # Both the name and the prompt might be missing, since we're
+                # searching both symbols and choices
+
+                # Does the regex match either the symbol name or the prompt
+                # (if any)?
+                if not (name and search(name) or
+                        prompt is not None and search(prompt)):
+
+                    # Give up on the first regex that doesn't match, to speed
+                    # things up a bit when multiple regexes are entered
+                    break
+
+            else:
+                add_match(entry)
+
+        # Regex results aren't reused
+        return matches
+
+    # Plain substrings. If each word in 's' contains the corresponding word
+    # in some earlier search text that's a prefix of 's' (and the earlier
+    # search text had no more words), then everything 's' matches is among
+    # the matches for the earlier search text. Refine the results for the
+    # longest such search text, which is a lot faster than searching
+    # everything when typing.
+    prefix = max(match_cache, key=len)
+
+    # No need to check the words that were already checked for the prefix,
+    # except for the last one, which might have gotten extended
+    prefix_words = prefix.lower().split()
+    if prefix_words and not prefix[-1].isspace():
+        del prefix_words[-1]
+    words = words[len(prefix_words):]
+
+    matches = []
+    add_match = matches.append
+
+    for entry in match_cache[prefix]:
+        _, name, prompt = entry
+
+        for word in words:
+            if not (name and word in name or
+                    prompt is not None and word in prompt):
+                break
+        else:
+            add_match(entry)
+
+    match_cache[s] = matches
+    return matches
+
+
+def _search_index(cached_entries=[]):
+    # Returns a list of (node, name, prompt) tuples, with the nodes from
+    # _sorted_sc_nodes() and _sorted_menu_comment_nodes(), in that order.
+    # 'name' and 'prompt' are the lowercased name and prompt text, or None if
+    # missing.
+    #
+    # Lowercasing everything once up front speeds up the jump-to dialog.
+
+    if not cached_entries:
+        for node in _sorted_sc_nodes():
+            # Symbol/choice
+            sc = node.item
+            cached_entries.append((
+                node,
+                sc.name.lower() if sc.name else None,
+                node.prompt[0].lower() if node.prompt else None))
+
+        for node in _sorted_menu_comment_nodes():
+            cached_entries.append((node, None, node.prompt[0].lower()))
+
+    return cached_entries
+
+
 # Obscure Python: We never pass a value for cached_nodes, and it keeps pointing
 # to the same list. This avoids a global.
 def _sorted_sc_nodes(cached_nodes=[]):
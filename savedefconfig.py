@@ -18,6 +18,7 @@ Note: Minimal configurations can also be generated from within the menuconfig
 interface.
 """
 import argparse
+import sys
 
 import kconfiglib
 
@@ -38,12 +39,22 @@ def main():
         default="defconfig",
         help="Output filename for minimal configuration (default: defconfig)")
 
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print timings and counters from Kconfiglib to stderr at the "
+             "end (see kconfiglib.Stats)")
+
     args = parser.parse_args()
 
-    kconf = kconfiglib.Kconfig(args.kconfig, suppress_traceback=True)
+    kconf = kconfiglib.Kconfig(args.kconfig, suppress_traceback=True,
+                               stats=args.stats, lazy_help=True)
     print(kconf.load_config())
     print(kconf.write_min_config(args.out))
 
+    if args.stats:
+        sys.stderr.write(str(kconf.stats))
+
 
 if __name__ == "__main__":
     main()
@@ -17,6 +17,10 @@ The exit status on errors is 1.
 The default input/output configuration file is '.config'. A different filename
 can be passed in the KCONFIG_CONFIG environment variable.
 
+If the KCONFIG_SERVER environment variable points to a running Kconfig server
+(see kconfigserver.py), the server is used instead of parsing the Kconfig
+files.
+
 When overwriting a configuration file, the old version is saved to
 <filename>.old (e.g. .config.old).
 """
@@ -24,6 +28,7 @@ import argparse
 import sys
 
 import kconfiglib
+import kconfigserver
 
 
 def main():
@@ -51,6 +56,12 @@ def main():
              "different value, e.g. due to unsatisfied dependencies) instead "
              "of erroring out")
 
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print timings and counters from Kconfiglib to stderr at the "
+             "end (see kconfiglib.Stats)")
+
     parser.add_argument(
         "assignments",
         metavar="ASSIGNMENT",
@@ -59,34 +70,117 @@ def main():
 
     args = parser.parse_args()
 
-    kconf = kconfiglib.Kconfig(args.kconfig, suppress_traceback=True)
+    # Use a running Kconfig server if there is one. See kconfigserver.py.
+    # Statistics are only available when parsing locally.
+    client = None if args.stats else kconfigserver.connect(args.kconfig)
+    if client:
+        _setconfig_server(client, args)
+        client.close()
+        return
+
+    kconf = kconfiglib.Kconfig(args.kconfig, suppress_traceback=True,
+                               stats=args.stats, lazy_help=True)
     print(kconf.load_config())
 
-    for arg in args.assignments:
-        if "=" not in arg:
-            sys.exit("error: no '=' in assignment: '{}'".format(arg))
-        name, value = arg.split("=", 1)
+    # Symbol -> value
+    values = {}
 
+    for name, value in _assignments(args):
         if name not in kconf.syms:
             if not args.check_exists:
                 continue
-            sys.exit("error: no symbol '{}' in configuration".format(name))
+            _no_sym_error(name)
 
-        sym = kconf.syms[name]
+        values[kconf.syms[name]] = value
 
-        if not sym.set_value(value):
-            sys.exit("error: '{}' is an invalid value for the {} symbol {}"
-                     .format(value, kconfiglib.TYPE_TO_STR[sym.orig_type],
-                             name))
+    # Assign all values before checking them, so that symbols are only
+    # recalculated once
+    invalid = kconf.set_values(values)
+    if invalid:
+        sym = invalid[0]
+        _invalid_value_error(sym.name, values[sym],
+                             kconfiglib.TYPE_TO_STR[sym.orig_type])
 
-        if args.check_value and sym.str_value != value:
-            sys.exit("error: {} was assigned the value '{}', but got the "
-                     "value '{}'. Check the symbol's dependencies, and make "
-                     "sure that it has a prompt."
-                     .format(name, value, sym.str_value))
+    if args.check_value:
+        for sym, value in values.items():
+            if sym.str_value != value:
+                _value_mismatch_error(sym.name, value, sym.str_value)
 
     print(kconf.write_config())
 
+    if args.stats:
+        sys.stderr.write(str(kconf.stats))
+
+
+def _setconfig_server(client, args):
+    # Like main(), but sends the requests to a Kconfig server
+
+    # The configuration on the server is shared with other clients. Put it
+    # back the way it was if we fail, including for sys.exit() and errors from
+    # the server.
+    client.snapshot()
+    try:
+        print(client.load_config())
+
+        # Symbol name -> value
+        values = {}
+
+        for name, value in _assignments(args):
+            try:
+                client.sym(name)
+            except kconfiglib.KconfigError:
+                if not args.check_exists:
+                    continue
+                _no_sym_error(name)
+
+            values[name] = value
+
+        invalid = client.set_values(values)
+        if invalid:
+            name = invalid[0]
+            _invalid_value_error(name, values[name],
+                                 client.sym(name)["orig_type"])
+
+        if args.check_value:
+            for name, value in values.items():
+                str_value = client.sym(name)["value"]
+                if str_value != value:
+                    _value_mismatch_error(name, value, str_value)
+
+        print(client.write_config())
+
+    except BaseException:
+        client.restore()
+        raise
+
+
+def _assignments(args):
+    # Returns a list of (name, value) tuples for the assignments on the
+    # command line
+
+    res = []
+    for arg in args.assignments:
+        if "=" not in arg:
+            sys.exit("error: no '=' in assignment: '{}'".format(arg))
+        res.append(arg.split("=", 1))
+
+    return res
+
+
+def _no_sym_error(name):
+    sys.exit("error: no symbol '{}' in configuration".format(name))
+
+
+def _invalid_value_error(name, value, type_str):
+    sys.exit("error: '{}' is an invalid value for the {} symbol {}"
+             .format(value, type_str, name))
+
+
+def _value_mismatch_error(name, value, str_value):
+    sys.exit("error: {} was assigned the value '{}', but got the value '{}'. "
+             "Check the symbol's dependencies, and make sure that it has a "
+             "prompt.".format(name, value, str_value))
+
 
 if __name__ == "__main__":
     main()
@@ -41,6 +41,7 @@ setuptools.setup(
         "allyesconfig",
         "listnewconfig",
         "setconfig",
+        "kconfigserver",
     ),
 
     entry_points={
@@ -58,6 +59,7 @@ setuptools.setup(
             "allyesconfig = allyesconfig:main",
             "listnewconfig = listnewconfig:main",
             "setconfig = setconfig:main",
+            "kconfigserver = kconfigserver:main",
         )
     },
 
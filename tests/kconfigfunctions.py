@@ -14,9 +14,20 @@ def location(kconf, name):
     return "{}:{}".format(kconf.filename, kconf.linenr)
 
 
+# Number of calls to pure()
+n_pure_calls = 0
+
+
+def pure(kconf, name, s):
+    global n_pure_calls
+    n_pure_calls += 1
+    return s
+
+
 functions = {
     "add":         (add,         0, None),
     "one":         (one,         1,    1),
     "one-or-more": (one_or_more, 1, None),
     "location":    (location,    0,    0),
+    "pure":        (pure,        1,    1, True),
 }
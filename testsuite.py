@@ -37,7 +37,9 @@
 
 import difflib
 import errno
+import json
 import os
+import random
 import re
 import shutil
 import subprocess
@@ -49,10 +51,10 @@ from kconfiglib import Kconfig, Symbol, Choice, COMMENT, MENU, MenuNode, \
                        BOOL, TRISTATE, HEX, \
                        TRI_TO_STR, \
                        escape, unescape, \
-                       expr_str, expr_items, split_expr, \
-                       _ordered_unique, \
+                       expr_str, expr_items, expr_value, split_expr, \
+                       _compile_expr, _ordered_unique, _prelex_file, \
                        OR, AND, \
-                       KconfigError
+                       KconfigError, OutputWriter
 
 
 def shell(cmd):
@@ -996,36 +998,37 @@ config DEP_REM_CORNER_CASES
 
     print("Testing tricky help strings")
 
-    c = Kconfig("Kconfiglib/tests/Khelp")
-
     def verify_help(node, s):
         verify_equal(node.help, s[1:-1])
 
-    verify_help(c.syms["TWO_HELP_STRINGS"].nodes[0], """
+    for lazy_help in False, True:
+        c = Kconfig("Kconfiglib/tests/Khelp", lazy_help=lazy_help)
+
+        verify_help(c.syms["TWO_HELP_STRINGS"].nodes[0], """
 first help string
 """)
 
-    verify_help(c.syms["TWO_HELP_STRINGS"].nodes[1], """
+        verify_help(c.syms["TWO_HELP_STRINGS"].nodes[1], """
 second help string
 """)
 
-    verify_help(c.syms["NO_BLANK_AFTER_HELP"].nodes[0], """
+        verify_help(c.syms["NO_BLANK_AFTER_HELP"].nodes[0], """
 help for
 NO_BLANK_AFTER_HELP
 """)
 
-    verify_help(c.named_choices["CHOICE_HELP"].nodes[0], """
+        verify_help(c.named_choices["CHOICE_HELP"].nodes[0], """
 help for
 CHOICE_HELP
 """)
 
-    verify_help(c.syms["HELP_TERMINATED_BY_COMMENT"].nodes[0], """
+        verify_help(c.syms["HELP_TERMINATED_BY_COMMENT"].nodes[0], """
 a
 b
 c
 """)
 
-    verify_help(c.syms["TRICKY_HELP"].nodes[0], """
+        verify_help(c.syms["TRICKY_HELP"].nodes[0], """
 a
  b
   c
@@ -1040,6 +1043,20 @@ g
   i
 """)
 
+        # Verify that lines are counted correctly past the help texts
+        verify_equal(c.syms["NO_BLANK_AFTER_HELP"].nodes[0].linenr, 13)
+        verify_equal(c.named_choices["CHOICE_HELP"].nodes[0].linenr, 18)
+        verify_equal(c.syms["TRICKY_HELP"].nodes[0].linenr, 33)
+
+    # Identical help texts should share a single string
+
+    c = Kconfig("Kconfiglib/tests/Khelp_dup")
+    help_1 = c.syms["HELP_1"].nodes[0].help
+    help_2 = c.syms["HELP_2"].nodes[0].help
+    verify_equal(help_1, "identical\nhelp text")
+    verify(help_1 is help_2,
+           "expected identical help texts to share a single string")
+
 
     print("Testing locations, source/rsource/gsource/grsource, and "
           "Kconfig.kconfig_filenames")
@@ -1840,6 +1857,357 @@ tests/Krecursive2:1
                format(s.name))
 
 
+    print("Testing Kconfig.set_values()")
+
+    c = Kconfig("Kconfiglib/tests/Ksetvalues", warn=False)
+
+    def verify_values(*name_vals):
+        for name, val in name_vals:
+            verify_equal(c.syms[name].str_value, val)
+
+    # Calculate values up front, so that invalidation is needed
+    verify_values(("MODULES", "n"), ("A", "n"), ("B", "n"), ("C", "n"),
+                  ("CHOICE_1", "y"))
+
+    verify_equal(c.set_values([(c.syms["A"], "y"), ("B", "m"),
+                               ("D", "foo"), (c.syms["CHOICE_2"], 2)]),
+                 [c.syms["D"]])
+
+    # m is promoted to y, since MODULES is n
+    verify_values(("A", "y"), ("B", "y"), ("C", "y"), ("CHOICE_1", "n"),
+                  ("CHOICE_2", "y"))
+    verify(c.syms["D"].user_value is None,
+           "invalid value should not have been assigned")
+
+    verify_equal(c.set_values({"MODULES": "y", c.choices[0]: "y"}), [])
+    verify_values(("MODULES", "y"), ("B", "m"), ("C", "m"),
+                  ("CHOICE_2", "y"))
+
+    # Later assignments win
+    verify_equal(c.set_values((("B", "y"), ("D", "1"), ("D", "2"))), [])
+    verify_values(("B", "y"), ("C", "y"), ("D", "2"))
+
+    verify_equal(c.set_values({"A": "n"}), [])
+    verify_values(("B", "n"), ("C", "n"))
+
+    verify(c._pending_invalidation is None,
+           "invalidation still deferred after set_values()")
+
+
+    print("Testing Kconfig.snapshot()/restore()")
+
+    c = Kconfig("Kconfiglib/tests/Ksetvalues", warn=False)
+
+    def config_state():
+        return [(sym.user_value, sym.str_value)
+                for sym in c.unique_defined_syms] + \
+               [(c.choices[0].user_selection, c.choices[0].selection)]
+
+    c.set_values({"A": "y", "B": "y", "D": "3"})
+
+    for cached in False, True:
+        c.evaluate_all()
+        old_state = config_state()
+
+        snapshot = c.snapshot(cached)
+        verify_equal(snapshot.cached, cached)
+
+        c.set_values({"A": "n", "D": "4", "CHOICE_2": "y"})
+        verify_values(("B", "n"), ("C", "n"), ("D", "4"), ("CHOICE_2", "y"))
+
+        c.restore(snapshot)
+        verify(config_state() == old_state,
+               "wrong state after restore() (cached={})".format(cached))
+
+        # The same snapshot as a context manager, exited via an exception
+        try:
+            with c.snapshot(cached):
+                c.set_values({"A": "n", "MODULES": "y"})
+                verify_values(("B", "n"))
+                raise ValueError
+        except ValueError:
+            pass
+        verify(config_state() == old_state,
+               "wrong state after 'with' block (cached={})".format(cached))
+        verify(not c.syms["MODULES"]._was_set,
+               "_was_set not restored (cached={})".format(cached))
+
+    try:
+        Kconfig("Kconfiglib/tests/Ksetvalues").restore(snapshot)
+    except KconfigError:
+        pass
+    else:
+        fail("restoring a snapshot from another Kconfig instance worked")
+
+
+    print("Testing Kconfig.evaluate_all()")
+
+    c = Kconfig("Kconfiglib/tests/Kassignable", warn=False)
+    c.syms["MODULES"].set_value(2)
+    c.evaluate_all()
+
+    index = {item: i for i, item in enumerate(c._eval_order)}
+
+    verify_equal(len(index), len(c.unique_defined_syms) +
+                             len(c.unique_choices))
+
+    for item in c._eval_order:
+        verify(item._cached_vis is not None,
+               "{} not evaluated by evaluate_all()".format(item.name))
+
+        for dep in item._dependents:
+            # Choices and choice symbols depend on each other
+            if not (item.__class__ is Choice or dep.__class__ is Choice):
+                verify(index[dep] > index[item],
+                       "{} evaluated before {}, which it depends on"
+                       .format(dep.name, item.name))
+
+    # Compare against values calculated lazily
+    c2 = Kconfig("Kconfiglib/tests/Kassignable", warn=False)
+    c2.syms["MODULES"].set_value(2)
+    for sym in c.unique_defined_syms:
+        verify_equal(sym.str_value, c2.syms[sym.name].str_value)
+
+
+    print("Testing Kconfig.stats")
+
+    verify(Kconfig("Kconfiglib/tests/Ksetvalues").stats is None,
+           "statistics should be disabled by default")
+
+    c = Kconfig("Kconfiglib/tests/Ksetvalues", stats=True)
+    stats = c.stats
+
+    verify_equal(stats.counts["files"], 1)
+    verify(stats.counts["lines"] > 10, "lines not counted")
+    verify_equal(stats.counts["evaluations"], 0)
+    for phase in "parse", "finalize", "build_dep", "check_dep_loop":
+        verify(phase in stats.times, "no time for phase " + phase)
+
+    c.evaluate_all()
+    verify_equal(stats.counts["evaluations"],
+                 len(c.unique_defined_syms) + len(c.unique_choices))
+    verify("evaluate_all" in stats.times, "evaluate_all() not timed")
+
+    c.syms["D"].set_value("3")
+    verify_equal(stats.counts["assignments"], 1)
+    verify_equal(stats.counts["invalidations"], 1)
+
+    # Changing MODULES only invalidates the items that are sensitive to it:
+    # MODULES itself and the tristate symbols B and C
+    c.syms["A"].set_value(2)
+    c.evaluate_all()
+    stats.counts["invalidations"] = 0
+    c.modules.set_value(2)
+    verify_equal(stats.counts["invalidations"], 3)
+    verify_equal(stats.counts["largest_invalidation"], 3)
+    for name in "A", "D", "CHOICE_1", "CHOICE_2":
+        verify(c.syms[name]._cached_vis is not None,
+               name + " invalidated by changing MODULES")
+    verify_equal(c.syms["B"].assignable, (0, 1, 2))
+    c.modules.set_value(0)
+    verify_equal(c.syms["B"].assignable, (0, 2))
+
+    verify("parse" in str(stats) and "evaluations" in str(stats),
+           "missing information in statistics report")
+
+
+    print("Testing change propagation")
+
+    def verify_updated(c):
+        # Verifies that the cached values on 'c' match freshly calculated
+        # values
+
+        items = c.unique_defined_syms + c.unique_choices
+        vals = [(item.str_value, item.visibility) for item in items]
+        c._invalidate_all()
+        verify_equal([(item.str_value, item.visibility) for item in items],
+                     vals)
+
+    c = Kconfig("Kconfiglib/tests/Kupdate", stats=True)
+    stats = c.stats
+    c.evaluate_all()
+
+    # A || B stays y, so only A and the symbols that directly depend on it
+    # should need recalculating
+    stats.counts["invalidations"] = 0
+    c.syms["A"].set_value(2)
+    verify_equal(stats.counts["invalidations"], 3)
+    verify(c.syms["DEP_4"]._cached_str_val is not None,
+           "DEP_4 invalidated, though nothing it depends on changed")
+    verify_updated(c)
+
+    # Turning off DEP_2 changes the value of DEP_3 and DEP_4, and the choice
+    # (along with AFTER_CHOICE) disappears
+    c.evaluate_all()
+    c.syms["DEP_2"].set_value(0)
+    verify_equal(c.syms["DEP_3"]._cached_tri_val, 0)
+    verify_equal(c.syms["DEP_4"]._cached_str_val, "4")
+    verify_updated(c)
+
+    c.evaluate_all()
+    c.syms["DEP_2"].set_value(2)
+    c.syms["CHOICE_2"].set_value(2)
+    verify_updated(c)
+    verify_equal(c.syms["AFTER_CHOICE"].tri_value, 2)
+
+    c.evaluate_all()
+    c.syms["CHOICE_1"].set_value(2)
+    verify_equal(c.syms["AFTER_CHOICE"].tri_value, 0)
+    verify_updated(c)
+
+    # Changes to several symbols at once, in set_values()
+    c.evaluate_all()
+    c.set_values({"A": "n", "B": "n", "DEP_2": "y"})
+    verify_equal(c.syms["DEP_4"].str_value, "4")
+    verify_updated(c)
+
+
+    print("Testing change tracking")
+
+    c = Kconfig("Kconfiglib/tests/Kupdate")
+
+    try:
+        c.changes_since(0)
+    except KconfigError:
+        pass
+    else:
+        fail("changes_since() worked without track_changes()")
+
+    epoch = c.track_changes()
+    verify_equal(epoch, 0)
+    verify_equal(c.track_changes(), 0)
+    verify_equal(c.changes_since(epoch), set())
+
+    def verify_changes(epoch, names):
+        # Choices are unnamed, and show up as None
+        verify_equal({item.name for item in c.changes_since(epoch)},
+                     set(names))
+
+    # A || B stays y
+    c.syms["A"].set_value(2)
+    verify_changes(epoch, ("A",))
+    verify_equal(c.change_epoch, 1)
+
+    # Setting the same value again changes nothing
+    epoch = c.change_epoch
+    c.syms["A"].set_value(2)
+    verify_equal(c.change_epoch, epoch)
+
+    choice = c.syms["CHOICE_1"].choice
+
+    c.syms["DEP_2"].set_value(0)
+    verify_changes(epoch, ("DEP_2", "DEP_3", "DEP_4", "CHOICE_1", "CHOICE_2",
+                           None))
+
+    epoch2 = c.change_epoch
+    c.syms["CHOICE_2"].set_value(2)
+    verify_changes(epoch2, ())
+    c.syms["DEP_2"].set_value(2)
+    verify_changes(epoch2, ("DEP_2", "DEP_3", "DEP_4", "CHOICE_1", "CHOICE_2",
+                            "AFTER_CHOICE", None))
+    verify_changes(epoch, ("DEP_2", "DEP_3", "DEP_4", "CHOICE_1", "CHOICE_2",
+                           "AFTER_CHOICE", None))
+    verify(choice in c.changes_since(epoch), "choice change not reported")
+
+    # Restoring a snapshot with and without cached values
+    for cached in False, True:
+        snapshot = c.snapshot(cached)
+        epoch = c.change_epoch
+        c.syms["B"].set_value(0)
+        c.syms["A"].set_value(0)
+        verify_changes(epoch, ("A", "B", "DEP_1", "DEP_2", "DEP_3", "DEP_4",
+                               "CHOICE_1", "CHOICE_2", "AFTER_CHOICE", None))
+
+        epoch = c.change_epoch
+        c.restore(snapshot)
+        verify_changes(epoch, ("A", "B", "DEP_1", "DEP_2", "DEP_3", "DEP_4",
+                               "CHOICE_1", "CHOICE_2", "AFTER_CHOICE", None))
+
+    # Only MODULES and the tristate symbol TRI are sensitive to MODULES
+    epoch = c.change_epoch
+    c.modules.set_value(2)
+    verify_changes(epoch, ("MODULES", "TRI"))
+    verify_updated(c)
+
+
+    print("Testing BatchEvaluator")
+
+    def verify_batch(filename, n_configs):
+        # Compares BatchEvaluator.evaluate() against setting each
+        # configuration and evaluating the symbols one at a time
+
+        c = Kconfig(filename, warn=False)
+        rnd = random.Random(filename)
+
+        syms = [sym for sym in c.unique_defined_syms
+                if sym.orig_type in (BOOL, TRISTATE)]
+        others = [sym for sym in c.unique_defined_syms
+                  if sym.orig_type not in (BOOL, TRISTATE)]
+
+        def rand_config():
+            config = {}
+            for sym in rnd.sample(syms, rnd.randint(0, len(syms))):
+                config[sym.name] = rnd.choice("nmy")
+            for sym in others:
+                if rnd.random() < 0.5:
+                    config[sym.name] = str(rnd.randint(0, 10))
+            for choice in c.unique_choices:
+                if rnd.random() < 0.5:
+                    config[choice] = rnd.choice("nmy")
+            return config
+
+        # Values set outside of the configurations are kept
+        if "A" in c.syms:
+            c.syms["A"].set_value(2)
+        configs = [rand_config() for _ in range(n_configs)]
+        user_vals = [sym.user_value for sym in c.unique_defined_syms]
+
+        batch = c.batch_evaluator()
+        rows = batch.evaluate(configs)
+        verify_equal(len(rows), len(configs))
+
+        verify_equal([sym.user_value for sym in c.unique_defined_syms],
+                     user_vals)
+
+        for config, row in zip(configs, rows):
+            with c.snapshot():
+                c.set_values(config)
+                verify_equal(list(row), [sym.tri_value for sym in batch.syms])
+
+        columns = batch.evaluate_columns(configs)
+        verify_equal(len(columns), len(batch.syms))
+        for i, column in enumerate(columns):
+            verify_equal(list(column), [row[i] for row in rows])
+
+    for filename in "Kchoice", "Kassignable", "Kimply", "Kupdate", "Kbatch":
+        verify_batch("Kconfiglib/tests/" + filename, 50)
+
+    c = Kconfig("Kconfiglib/tests/Kbatch")
+    verify_equal(c.batch_evaluator().evaluate([]), [])
+
+
+    print("Testing compact=True")
+
+    for filename in "Kconfiglib/tests/Kassignable", \
+                    "Kconfiglib/tests/Kdepcopy":
+
+        c = Kconfig(filename, warn=False)
+        c2 = Kconfig(filename, warn=False, compact=True)
+
+        verify_equal([str(node) for node in c2.node_iter()],
+                     [str(node) for node in c.node_iter()])
+
+        for kconf in c, c2:
+            kconf.modules.set_value(2)
+        for sym in c.unique_defined_syms:
+            sym2 = c2.syms[sym.name]
+            verify_equal(sym2.str_value, sym.str_value)
+            verify_equal(sym2.assignable, sym.assignable)
+
+    verify(c2.top_node.defaults == () and c2.syms["MODULES"].ranges == (),
+           "empty property lists not replaced by the empty tuple")
+
+
     print("Testing is_menuconfig")
 
     c = Kconfig("Kconfiglib/tests/Kmenuconfig")
@@ -2045,6 +2413,205 @@ header header from env.
     del os.environ["KCONFIG_AUTOHEADER_HEADER"]
 
 
+    print("Testing Kconfig.write_outputs()")
+
+    c = Kconfig("Kconfiglib/tests/Koutputs")
+
+    formats = ("autoconf", "cmake", "config", "header", "json", "make",
+               "rust")
+
+    c.write_outputs([(fmt, config_test_file + "_" + fmt)
+                     for fmt in formats])
+
+    verify_file_contents(config_test_file + "_autoconf", r"""
+CONFIG_MODULES=y
+CONFIG_BOOL=y
+CONFIG_TRI=m
+CONFIG_STRING="a\"b $c #d"
+CONFIG_INT=10
+CONFIG_HEX=ab
+"""[1:])
+
+    verify_file_contents(config_test_file + "_cmake", r"""
+set(CONFIG_MODULES "y")
+set(CONFIG_BOOL "y")
+set(CONFIG_TRI "m")
+set(CONFIG_STRING "a\"b \$c #d")
+set(CONFIG_INT "10")
+set(CONFIG_HEX "ab")
+"""[1:])
+
+    verify_file_contents(config_test_file + "_json", r"""
+{
+  "CONFIG_MODULES": "y",
+  "CONFIG_BOOL": "y",
+  "CONFIG_TRI": "m",
+  "CONFIG_N": "n",
+  "CONFIG_STRING": "a\"b $c #d",
+  "CONFIG_INT": 10,
+  "CONFIG_HEX": "ab"
+}
+"""[1:])
+
+    verify_file_contents(config_test_file + "_make", r"""
+CONFIG_MODULES := y
+CONFIG_BOOL := y
+CONFIG_TRI := m
+CONFIG_STRING := a"b $$c \#d
+CONFIG_INT := 10
+CONFIG_HEX := ab
+"""[1:])
+
+    verify_file_contents(config_test_file + "_rust", r"""
+--cfg=CONFIG_MODULES
+--cfg=CONFIG_MODULES="y"
+--cfg=CONFIG_BOOL
+--cfg=CONFIG_BOOL="y"
+--cfg=CONFIG_TRI="m"
+--cfg=CONFIG_STRING="a\"b $c #d"
+--cfg=CONFIG_INT="10"
+--cfg=CONFIG_HEX="0xab"
+"""[1:])
+
+    # The .config and header outputs should match write_config() and
+    # write_autoconf()
+
+    c.write_config(config_test_file, save_old=False)
+    with open(config_test_file) as f:
+        verify_file_contents(config_test_file + "_config", f.read())
+
+    c.write_autoconf(config_test_file)
+    with open(config_test_file) as f:
+        verify_file_contents(config_test_file + "_header", f.read())
+
+    # Unchanged files are not rewritten
+
+    verify_equal(
+        c.write_outputs([("json", config_test_file + "_json")]),
+        ["No change to configuration in '{}'"
+         .format(config_test_file + "_json")])
+
+    # Custom writers
+
+    class NameWriter(OutputWriter):
+        def start(self, kconf):
+            return "start\n"
+
+        def symbol(self, sym):
+            return sym.name + "\n"
+
+        def menu(self, node):
+            return "menu " + node.prompt[0] + "\n"
+
+        def menu_end(self, node):
+            return "end\n"
+
+        def end(self):
+            return "end of file\n"
+
+    c.write_outputs([(NameWriter(), config_test_file)])
+    verify_file_contents(config_test_file, """
+start
+MODULES
+menu Menu
+BOOL
+TRI
+N
+end
+STRING
+INT
+HEX
+end of file
+"""[1:])
+
+    try:
+        c.write_outputs([("nonexistent", config_test_file)])
+    except KconfigError:
+        pass
+    else:
+        fail("write_outputs() should fail for unknown formats")
+
+    for fmt in formats:
+        os.remove(config_test_file + "_" + fmt)
+
+    # int symbols without a value get null in JSON
+
+    tmpdir = tempfile.mkdtemp()
+    kconfig_path = os.path.join(tmpdir, "Kconfig")
+    with open(kconfig_path, "w") as f:
+        f.write('config I\n\tint "I"\nconfig J\n\tint "J"\n\tdefault 1\n')
+
+    c = Kconfig(kconfig_path)
+    c.write_outputs([("json", config_test_file + "_json")])
+    verify_file_contents(config_test_file + "_json", """
+{
+  "CONFIG_I": null,
+  "CONFIG_J": 1
+}
+"""[1:])
+
+    os.remove(config_test_file + "_json")
+    shutil.rmtree(tmpdir)
+
+
+    print("Testing Kconfig.write_outputs_batch()")
+
+    c = Kconfig("Kconfiglib/tests/Koutputs")
+    c.warn_assign_undef = True
+
+    with open(config_test_file + "_1", "w") as f:
+        f.write("CONFIG_INT=1\nCONFIG_UNDEFINED=y\n")
+    with open(config_test_file + "_2", "w") as f:
+        f.write("CONFIG_INT=2\n# CONFIG_BOOL is not set\n")
+
+    jobs = [(config_test_file + "_1", [("make", config_test_file + "_1.mk")]),
+            (config_test_file + "_2", [("make", config_test_file + "_2.mk")]),
+            (config_test_file + "_missing",
+             [("make", config_test_file + "_missing.mk")])]
+
+    for processes in 1, 2:
+        results = c.write_outputs_batch(jobs, processes)
+
+        verify_equal(len(results), 3)
+
+        msgs, warnings, error = results[0]
+        verify(error is None, "batch job 1 failed: " + str(error))
+        verify_equal(len(msgs), 2)
+        verify_equal(len(warnings), 1)
+        verify("UNDEFINED" in warnings[0],
+               "expected a warning for CONFIG_UNDEFINED in batch job 1")
+
+        msgs, warnings, error = results[1]
+        verify(error is None, "batch job 2 failed: " + str(error))
+        verify_equal(warnings, [])
+
+        msgs, _, error = results[2]
+        verify(error is not None, "batch job 3 should fail")
+        verify_equal(msgs, [])
+        verify(not os.path.exists(config_test_file + "_missing.mk"),
+               "output written for failing batch job")
+
+        with open(config_test_file + "_1.mk") as f:
+            verify("CONFIG_INT := 1\n" in f.read(),
+                   "wrong output from batch job 1")
+        with open(config_test_file + "_2.mk") as f:
+            contents = f.read()
+            verify("CONFIG_INT := 2\n" in contents and
+                   "CONFIG_BOOL" not in contents,
+                   "wrong output from batch job 2")
+
+        # Values in the Kconfig instance are unchanged
+        verify_value("INT", "10")
+        verify_value("BOOL", "y")
+        verify_equal(c.warnings, [])
+
+        for suffix in "_1.mk", "_2.mk":
+            os.remove(config_test_file + suffix)
+
+    os.remove(config_test_file + "_1")
+    os.remove(config_test_file + "_2")
+
+
     print("Testing Kconfig fetching and separation")
 
     for c in Kconfig("Kconfiglib/tests/Kmisc", warn=False), \
@@ -2487,6 +3054,77 @@ config J
         fail("Loop detection message check did not raise exception")
 
 
+    print("Testing deep menu trees and long dependency chains")
+
+    # Longer than the default recursion limit
+    n = 2 * sys.getrecursionlimit()
+
+    tmpdir = tempfile.mkdtemp()
+    kconfig_path = os.path.join(tmpdir, "Kconfig")
+
+    def write_deep_kconfig(loop):
+        with open(kconfig_path, "w") as f:
+            # Each CHAIN_<i> symbol ends up in an implicit menu rooted at the
+            # previous one. With 'loop', CHAIN_0 depends on the last one.
+            f.write("config CHAIN_0\n\tbool \"chain 0\"\n")
+            if loop:
+                f.write("\tdepends on CHAIN_{}\n".format(n - 1))
+
+            for i in range(1, n):
+                f.write("config CHAIN_{}\n\tbool \"chain {}\"\n\tdefault y\n"
+                        "\tdepends on CHAIN_{}\n".format(i, i, i - 1))
+
+            # Gives TARGET long reverse dependencies
+            f.write("config TARGET\n\tbool\n")
+            for i in range(n):
+                f.write("config SELECTOR_{}\n\tbool \"selector\"\n"
+                        "\tselect TARGET\n".format(i))
+
+    write_deep_kconfig(False)
+    c = Kconfig(kconfig_path)
+
+    verify_equal(len(list(c.node_iter())), 2*n + 1)
+    verify_equal(c.syms["CHAIN_{}".format(n - 1)].nodes[0].parent,
+                 c.syms["CHAIN_{}".format(n - 2)].nodes[0])
+    verify_equal(len(split_expr(c.syms["TARGET"].rev_dep, OR)), n)
+    verify_equal(expr_str(c.syms["TARGET"].rev_dep),
+                 " || ".join("SELECTOR_{}".format(i) for i in range(n)))
+    verify_equal(len(expr_items(c.syms["TARGET"].rev_dep)), n)
+
+    # The reverse dependencies should be a balanced tree of ORs
+    def expr_depth(expr):
+        if expr.__class__ is not tuple:
+            return 0
+        return 1 + max(expr_depth(expr[1]), expr_depth(expr[2]))
+
+    verify(expr_depth(c.syms["TARGET"].rev_dep) <= n.bit_length(),
+           "reverse dependencies of TARGET not balanced")
+
+    c.syms["CHAIN_0"].set_value(2)
+    c.syms["SELECTOR_{}".format(n - 1)].set_value(2)
+    c.evaluate_all()
+    verify_equal(c.syms["CHAIN_{}".format(n - 1)].tri_value, 2)
+    verify_equal(c.syms["TARGET"].tri_value, 2)
+    verify_equal(expr_value(c.syms["TARGET"].rev_dep), 2)
+
+    # Invalidation and change propagation along the chain
+    verify_equal(c._invalidate_items((c.syms["CHAIN_0"],)), n)
+    c.evaluate_all()
+    c.syms["CHAIN_0"].set_value(0)
+    verify_equal(c.syms["CHAIN_{}".format(n - 1)].tri_value, 0)
+
+    write_deep_kconfig(True)
+    try:
+        Kconfig(kconfig_path)
+    except KconfigError as e:
+        verify("Dependency loop" in str(e),
+               "long dependency loop raised wrong KconfigError")
+    else:
+        fail("long dependency loop not detected")
+
+    shutil.rmtree(tmpdir)
+
+
     print("Testing preprocessor")
 
     os.environ["ENV_1"] = "env_1"
@@ -2634,6 +3272,12 @@ config PRINT_ME_TOO
         "Kconfiglib/tests/Kpreprocess:134: warning: a warning"
     ])
 
+    # $(shell) statistics
+    c = Kconfig("Kconfiglib/tests/Kpreprocess", warn_to_stderr=False,
+                stats=True)
+    verify(c.stats.counts["shell_commands"] > 0, "$(shell) not counted")
+    verify("shell" in c.stats.times, "$(shell) not timed")
+
 
     print("Testing user-defined preprocessor functions")
 
@@ -2670,8 +3314,191 @@ config PRINT_ME_TOO
     verify_bad_argno("one-two")
     verify_bad_argno("one-or-more-zero")
 
+    # Functions declared as pure are memoized
+    import kconfigfunctions
+    verify_variable("pure-twice", "foo foo", "foo foo", False)
+    verify_equal(kconfigfunctions.n_pure_calls, 1)
+
     sys.path.pop(0)
 
+
+    print("Testing preprocessor memoization")
+
+    tmpdir = tempfile.mkdtemp()
+    kconfig_path = os.path.join(tmpdir, "Kconfig")
+    log_path = os.path.join(tmpdir, "log")
+
+    with open(kconfig_path, "w") as f:
+        f.write("""
+log-run = $(shell,echo $(1) >> {})
+f = <$(1)$(log-run,$(1))>
+
+memo := $(f,1) $(f,1) $(f,2) $(f,1)
+
+# Impure functions are not memoized
+loc = $(lineno)
+loc-1 := $(loc)
+loc-2 := $(loc)
+
+# Memoized results are discarded when variables they depend on change
+v = 1
+g = $(v)
+dep-1 := $(g)
+v = 2
+dep-2 := $(g)
+v += 3
+dep-3 := $(g)
+v := 4
+dep-4 := $(g)
+""".format(log_path))
+
+    c = Kconfig(kconfig_path, stats=True)
+
+    verify_variable("memo", "<1> <1> <2> <1>", "<1> <1> <2> <1>", False)
+    with open(log_path) as f:
+        verify_equal(f.read().split(), ["1", "2"])
+    verify_equal(c.stats.counts["expansion_memo_hits"], 2)
+
+    verify_variable("loc-1", "9", "9", False)
+    verify_variable("loc-2", "10", "10", False)
+
+    verify_variable("dep-1", "1", "1", False)
+    verify_variable("dep-2", "2", "2", False)
+    verify_variable("dep-3", "2 3", "2 3", False)
+    verify_variable("dep-4", "4", "4", False)
+
+    # Self-references through simple variables are still detected
+    with open(kconfig_path, "w") as f:
+        f.write("""
+D := $
+X := $(D)(X)
+
+config A
+	bool "$(X)"
+""")
+
+    try:
+        Kconfig(kconfig_path)
+    except KconfigError as e:
+        verify("Preprocessor variable X recursively references itself"
+               in str(e), "wrong error for self-reference: " + str(e))
+    else:
+        fail("no error for self-referencing simple variable")
+
+    shutil.rmtree(tmpdir)
+
+
+    print("Testing pre-lexing")
+
+    tmpdir = tempfile.mkdtemp()
+    sub_dir = os.path.join(tmpdir, "sub")
+    os.mkdir(sub_dir)
+    kconfig_path = os.path.join(tmpdir, "Kconfig")
+
+    with open(kconfig_path, "w") as f:
+        f.write("""
+sub := {0}
+
+config A
+	bool "A"
+	default y if B && !(C || D = "d")
+
+# Found only by the parser
+source "$(sub)/c"
+
+source "{0}/[ab]"
+
+config D
+	string
+	default "d"
+""".format(sub_dir))
+
+    with open(os.path.join(sub_dir, "a"), "w") as f:
+        f.write("""
+config B
+	bool unquoted
+	default y
+
+rsource "d"
+""")
+
+    with open(os.path.join(sub_dir, "b"), "w") as f:
+        f.write("""
+config C
+	bool "C"
+	default y
+""")
+
+    with open(os.path.join(sub_dir, "c"), "w") as f:
+        f.write("""
+config C
+	bool "C"
+	help
+	  Help
+""")
+
+    with open(os.path.join(sub_dir, "d"), "w") as f:
+        f.write("""
+config \\
+E
+	def_bool B
+""")
+
+    lexed, filenames = _prelex_file(kconfig_path, "/", "utf-8")
+    verify_equal(filenames, [os.path.join(sub_dir, "a"),
+                             os.path.join(sub_dir, "b")])
+    # Lines with macros are left for the parser
+    verify(not any("$" in line or ":=" in line for line in lexed),
+           "line with macro tokenized by pre-lexer")
+    verify_equal(lexed["\tdefault y if B && !(C || D = \"d\")\n"][1],
+                 ((1, True), (3, False), (7, False), (9, False),
+                  (11, True)))
+
+    lexed, filenames = _prelex_file(os.path.join(sub_dir, "a"), "/", "utf-8")
+    verify_equal(filenames, [os.path.join(sub_dir, "d")])
+    # Lines that generate warnings are left for the parser
+    verify("\tbool unquoted\n" not in lexed,
+           "line with warning tokenized by pre-lexer")
+
+    lexed, _ = _prelex_file(os.path.join(sub_dir, "d"), "/", "utf-8")
+    verify("config E\n" in lexed, "joined line not tokenized by pre-lexer")
+
+    def node_strs(c):
+        return [str(node) for node in c.node_iter()]
+
+    c = Kconfig(kconfig_path, warn_to_stderr=False)
+
+    for processes in 2, 3:
+        c2 = Kconfig(kconfig_path, warn_to_stderr=False,
+                     lex_processes=processes)
+        verify_equal(node_strs(c2), node_strs(c))
+        verify_equal(c2.warnings, c.warnings)
+        verify_equal(c2.kconfig_filenames, c.kconfig_filenames)
+
+    class PrelexedKconfig(Kconfig):
+        # Uses the pre-lexed tokens for all lines that have them, as if the
+        # worker processes had finished before parsing started
+
+        __slots__ = ()
+
+        def _start_prelexing(self, filename, processes):
+            self._prelex_done = [_prelex_file(filename, "/", "utf-8")[0]
+                                 for filename in c.kconfig_filenames]
+            self._prelexed = {}
+            self._add_prelexed()
+
+        def _stop_prelexing(self):
+            self._prelex_done = self._prelexed = None
+
+    c2 = PrelexedKconfig(kconfig_path, warn_to_stderr=False, stats=True,
+                         lex_processes=2)
+    verify_equal(c2.stats.counts["prelexed_lines"], 18)
+    verify_equal(c2.warnings, c.warnings)
+    verify_equal(node_strs(c2), node_strs(c))
+    verify_equal(list(c2.syms), list(c.syms))
+
+    shutil.rmtree(tmpdir)
+
     # This test can fail on older Python 3.x versions, because they don't
     # preserve dict insertion order during iteration. The output is still
     # correct, just different.
@@ -2723,6 +3550,558 @@ menu "menu"
         os.environ.pop("KCONFIG_WARN_UNDEF")
 
 
+    print("Testing expression compilation")
+
+    c = Kconfig("Kconfiglib/tests/Keval", warn=False)
+
+    def verify_compiled(s):
+        # Compares the compiled version of the expression 's' against
+        # expr_value()
+
+        c._tokens = c._tokenize("if " + s)
+        c._tokens_i = 1
+        expr = c._expect_expr_and_eol()
+
+        fn = _compile_expr(expr, {})
+        verify(fn() == expr_value(expr),
+               "compiled version of '{}' evaluates to {}, expected {}"
+               .format(s, fn(), expr_value(expr)))
+
+    for modules_val in "n", "y":
+        c.syms["MODULES"].set_value(modules_val)
+        for s in (
+            "n", "m", "y", "Y", "M || N", "!M", "!(N || y)", "Y && M",
+            "N && UNDEFINED", "M && Y && m", "N || M || Y", "m || M || N",
+            "y && (M || N) && !N", "Y = y", "Y_STRING = y", "INT_37 < 38",
+            "M != N && Y", "!(!(M && Y) || !Y)", "(N || (M && (Y || N)))",
+            "n || (M && y)", "y && m", "m || n"):
+
+            verify_compiled(s)
+
+    # Values are calculated with expr_value() the first time, and expressions
+    # are compiled when values get recalculated
+
+    c = Kconfig("Kconfiglib/tests/Keval", warn=False)
+    Y = c.syms["Y"]
+
+    verify_equal(Y.tri_value, 2)
+    verify(not Y._compiled, "Y compiled on first evaluation")
+
+    Y.set_value(0)
+    verify_equal(Y.tri_value, 0)
+    verify(Y._compiled, "Y not compiled on recalculation")
+
+    Y.set_value(2)
+    verify_equal(Y.tri_value, 2)
+
+
+    print("Testing expression sharing")
+
+    c = Kconfig("Kconfiglib/tests/Kshare")
+    C = c.syms["C"]
+    D = c.syms["D"]
+
+    # Identical expressions created when propagating dependencies should be a
+    # single object
+    verify(C.direct_dep is D.direct_dep,
+           "identical 'depends on' expressions not shared")
+    verify(C.nodes[0].prompt[1] is D.nodes[0].prompt[1],
+           "identical prompt conditions not shared")
+    verify(C.defaults[0][1] is D.defaults[0][1],
+           "identical 'default' conditions not shared")
+    verify(C.selects[0][1] is D.selects[0][1],
+           "identical 'select' conditions not shared")
+
+    verify_equal(expr_str(C.direct_dep), "B && A")
+    verify_equal(expr_str(C.defaults[0][1]), "B && B && A")
+    verify_equal(expr_str(c.syms["E"].rev_dep),
+                 "(C && B && B && A) || (D && B && B && A)")
+
+    # Expressions from eval_string() are not recorded
+    verify(c._expr_table is None,
+           "expression table kept after finalization")
+    verify_equal(c.eval_string("A && B"), 0)
+
+
+    # The parse cache is not supported on Python 2
+    if sys.version_info[0] >= 3:
+        print("Testing parse cache")
+
+        tmpdir = tempfile.mkdtemp()
+        kconfig_path = os.path.join(tmpdir, "Kconfig")
+        cache_dir = os.path.join(tmpdir, "cache")
+
+        def write_kconfig(default):
+            with open(kconfig_path, "w") as f:
+                f.write("""
+config A
+	bool "A"
+	default {}
+
+config B
+	def_bool A
+	select C
+
+config C
+	tristate
+	range 1 2
+""".format(default))
+
+        def verify_cached(expected_val, expected_n_warnings):
+            c = Kconfig(kconfig_path, warn_to_stderr=False,
+                        cache_dir=cache_dir)
+
+            verify_equal(c.syms["B"].str_value, expected_val)
+            verify_equal(len(c.warnings), expected_n_warnings)
+            verify(c.syms["B"] in c.syms["A"]._dependents,
+                   "_dependents not restored from cache")
+            verify(c.top_node.list.kconfig is c,
+                   "Kconfig references not restored from cache")
+
+            return c
+
+        write_kconfig("y")
+        verify_cached("y", 1)
+        verify_equal(len(os.listdir(cache_dir)), 1)
+
+        # Changing the file while keeping the same size and modification time
+        # should give the cached configuration
+        st = os.stat(kconfig_path)
+        write_kconfig("n")
+        os.utime(kconfig_path, (st.st_atime, st.st_mtime))
+        verify_cached("y", 1)
+
+        # Changing the modification time should force a reparse
+        os.utime(kconfig_path, (st.st_atime, st.st_mtime + 10))
+        verify_cached("n", 1)
+
+        # Changing an environment variable referenced in the Kconfig files
+        # should force a reparse too
+        os.environ["ENV_CACHE"] = "foo"
+        with open(kconfig_path, "a") as f:
+            f.write('config FOO\n\tstring\n\tdefault "$(ENV_CACHE)"\n')
+        verify_equal(verify_cached("n", 1).syms["FOO"].str_value, "foo")
+        os.environ["ENV_CACHE"] = "bar"
+        verify_equal(verify_cached("n", 1).syms["FOO"].str_value, "bar")
+        del os.environ["ENV_CACHE"]
+
+        shutil.rmtree(tmpdir)
+
+
+    # The $(shell,...) cache is not supported on Python 2
+    if sys.version_info[0] >= 3:
+        print("Testing $(shell,...) cache")
+
+        tmpdir = tempfile.mkdtemp()
+        kconfig_path = os.path.join(tmpdir, "Kconfig")
+        cache_path = os.path.join(tmpdir, "shell-cache")
+        log_path = os.path.join(tmpdir, "log")
+
+        # The commands log each run to $SHELL_CACHE_LOG
+        with open(kconfig_path, "w") as f:
+            f.write("""
+a := $(shell,echo a >> $SHELL_CACHE_LOG; echo $SHELL_CACHE_VAL)
+b := $(shell,echo b >> $SHELL_CACHE_LOG; echo b; echo err >&2)
+
+config A
+	string
+	default "$(a)"
+
+config B
+	string
+	default "$(b)"
+""")
+
+        os.environ["SHELL_CACHE_LOG"] = log_path
+        os.environ["SHELL_CACHE_VAL"] = "1"
+
+        def verify_shell_cache(a_val, runs):
+            # Parses the configuration and verifies that the value of A is
+            # 'a_val', and that the commands in 'runs' ran
+
+            with open(log_path, "w"):
+                pass
+
+            c = Kconfig(kconfig_path, warn_to_stderr=False, stats=True)
+
+            verify_equal(c.syms["A"].str_value, a_val)
+            verify_equal(c.syms["B"].str_value, "b")
+            # Warnings for output on stderr are generated for cached results
+            # too
+            verify_equal(len(c.warnings), 1)
+            verify_equal(c.stats.counts["shell_commands"], 2)
+
+            # Prefetched commands run in parallel, in no particular order
+            with open(log_path) as f:
+                verify_equal(sorted(f.read().split()), runs)
+
+        # Without caching
+        verify_shell_cache("1", ["a", "b"])
+        verify_shell_cache("1", ["a", "b"])
+
+        os.environ["KCONFIG_SHELL_CACHE"] = cache_path
+
+        verify_shell_cache("1", ["a", "b"])
+        verify_shell_cache("1", [])
+
+        # Referenced environment variables are part of the key
+        os.environ["SHELL_CACHE_VAL"] = "2"
+        verify_shell_cache("2", ["a"])
+        verify_shell_cache("2", [])
+        os.environ["SHELL_CACHE_VAL"] = "1"
+        verify_shell_cache("1", [])
+
+        # So is the salt
+        os.environ["KCONFIG_SHELL_CACHE_SALT"] = "salt"
+        verify_shell_cache("1", ["a", "b"])
+        verify_shell_cache("1", [])
+
+        # Prefetching. The commands run up front, and only once.
+        os.environ["KCONFIG_SHELL_CACHE_SALT"] = "salt 2"
+        os.environ["KCONFIG_SHELL_PREFETCH"] = "2"
+        verify_shell_cache("1", ["a", "b"])
+        verify_shell_cache("1", [])
+        del os.environ["KCONFIG_SHELL_PREFETCH"]
+
+        # Size limit. Only the result of the last command is kept.
+        os.environ["KCONFIG_SHELL_CACHE_SIZE"] = "1"
+        verify_shell_cache("1", [])
+        verify_shell_cache("1", ["a"])
+        del os.environ["KCONFIG_SHELL_CACHE_SIZE"]
+
+        # A corrupt cache file is ignored
+        with open(cache_path, "w") as f:
+            f.write("garbage")
+        verify_shell_cache("1", ["a", "b"])
+        verify_shell_cache("1", [])
+
+        for var in "KCONFIG_SHELL_CACHE", "KCONFIG_SHELL_CACHE_SALT", \
+                   "SHELL_CACHE_LOG", "SHELL_CACHE_VAL":
+            del os.environ[var]
+
+        shutil.rmtree(tmpdir)
+
+
+    print("Testing Kconfig.reload()")
+
+    tmpdir = tempfile.mkdtemp()
+    sub_dir = os.path.join(tmpdir, "sub")
+    os.mkdir(sub_dir)
+    kconfig_path = os.path.join(tmpdir, "Kconfig")
+    a_path = os.path.join(sub_dir, "a")
+    b_path = os.path.join(sub_dir, "b")
+
+    with open(kconfig_path, "w") as f:
+        f.write("""
+mainmenu "Reload test"
+
+config MODULES
+	def_bool y
+	option modules
+
+menu "Menu"
+source "{0}/a"
+endmenu
+
+source "{0}/b"
+""".format(sub_dir))
+
+    def write_a(contents):
+        with open(a_path, "w") as f:
+            f.write(contents)
+
+    write_a("""
+config A
+	bool "A"
+	select B
+
+config A_SUB
+	bool "A sub"
+	depends on A
+
+if B
+config A_IF
+	tristate "A if"
+	default m
+endif
+
+choice
+	prompt "Choice"
+config CHOICE_1
+	bool "Choice 1"
+config CHOICE_2
+	bool "Choice 2"
+endchoice
+""")
+
+    with open(b_path, "w") as f:
+        f.write("""
+config B
+	bool "B"
+
+config C
+	string "C"
+	default "c" if A
+""")
+
+    def config_state(c):
+        # Returns things that should be the same after reload() as after
+        # parsing the changed files from scratch
+
+        def names(items):
+            return sorted(item.name_and_loc for item in items)
+
+        return ([str(node) for node in c.node_iter()],
+                [(sym.name, sym.str_value, sym.user_value,
+                  expr_str(sym.rev_dep), expr_str(sym.weak_rev_dep),
+                  expr_str(sym.direct_dep), names(sym._dependents))
+                 for sym in c.unique_defined_syms],
+                [(choice.name_and_loc, choice.str_value, choice.user_value,
+                  names(choice.syms), names(choice._dependents))
+                 for choice in c.unique_choices],
+                [node.prompt[0] for node in c.menus],
+                [node.prompt[0] for node in c.comments],
+                c._config_contents(None))
+
+    def verify_reload(c, changed, all_files):
+        # Reloads 'c' after the files in 'changed' changed, and checks the
+        # result against a fresh parse. 'all_files' is True if all files
+        # should be reparsed.
+
+        msg = c.reload(changed)
+        verify_equal(msg.startswith("Reparsed all"), all_files)
+
+        fresh = Kconfig(kconfig_path, warn_to_stderr=False)
+        for sym in c.unique_defined_syms:
+            if sym.user_value is not None and sym.name in fresh.syms:
+                fresh.syms[sym.name].set_value(sym.user_value)
+        for choice in c.unique_choices:
+            if choice.user_value is not None:
+                fresh.syms[choice.syms[0].name].choice.set_value(
+                    choice.user_value)
+
+        verify_equal(config_state(c), config_state(fresh))
+
+    c = Kconfig(kconfig_path, warn_to_stderr=False, reloadable=True)
+    c.syms["A"].set_value(2)
+    c.syms["CHOICE_2"].set_value(2)
+    c.syms["A_IF"].set_value(2)
+
+    verify_equal(c.reload([]), "No Kconfig files changed")
+    snapshot = c.snapshot()
+
+    # Changed properties, new and removed symbols, and an implicit menu that
+    # changes
+    write_a("""
+config A
+	bool "A (changed)"
+	select C_NEW
+	imply B
+
+config A_SUB
+	bool "A sub"
+
+config A_NEW
+	int "A new"
+	range 1 10
+	default 3
+	depends on A
+
+if B
+config A_IF
+	string "A if"
+endif
+
+choice
+	prompt "Choice"
+	default CHOICE_2
+config CHOICE_1
+	bool "Choice 1"
+config CHOICE_2
+	bool "Choice 2"
+endchoice
+
+comment "Comment"
+""")
+    verify_reload(c, [a_path], False)
+
+    # The symbol and choice lists are rebuilt, so old snapshots can't be used
+    try:
+        c.restore(snapshot)
+    except KconfigError:
+        pass
+    else:
+        fail("restoring a snapshot from before reload() worked")
+    c.restore(c.snapshot())
+
+    verify(c.syms["A"].user_value == 2 and
+           c.syms["CHOICE_2"].choice.user_selection is c.syms["CHOICE_2"],
+           "user values lost on reload")
+    # Changed type from tristate to string
+    verify(c.syms["A_IF"].user_value is None,
+           "invalid user value kept on reload")
+
+    # Choice modes follow the choices when a choice is added in front of them
+    # or removed
+    tri_choice = """
+choice
+	tristate "Choice"
+config CHOICE_1
+	tristate "Choice 1"
+config CHOICE_2
+	tristate "Choice 2"
+endchoice
+"""
+    new_choice = """
+choice
+	tristate "New choice"
+config NEW_CHOICE_1
+	tristate "New choice 1"
+endchoice
+"""
+    write_a("config A\n\tbool \"A\"\n" + tri_choice)
+    verify_reload(c, [a_path], False)
+    c.syms["CHOICE_1"].choice.set_value(2)
+
+    write_a("config A\n\tbool \"A\"\n" + new_choice + tri_choice)
+    verify_reload(c, [a_path], False)
+    verify_equal(c.syms["CHOICE_1"].choice.user_value, 2)
+    verify_equal(c.syms["NEW_CHOICE_1"].choice.user_value, None)
+
+    write_a("config A\n\tbool \"A\"\n" + tri_choice)
+    verify_reload(c, [a_path], False)
+    verify_equal(c.syms["CHOICE_1"].choice.user_value, 2)
+    verify_equal(c.syms["CHOICE_1"].choice.tri_value, 2)
+
+    # Removing everything and adding it back. Files without menu nodes can't
+    # be found in the menu tree, so the second reload reparses everything.
+    write_a("")
+    verify_reload(c, [a_path], False)
+    write_a("config A\n\tbool \"A\"\n")
+    verify_reload(c, [a_path, b_path], True)
+    verify_reload(c, [a_path, b_path], False)
+
+    # Syntax errors leave the configuration as it was
+    old_state = config_state(c)
+    write_a("config A\n\tbool \"A\"\nendif\n")
+    try:
+        c.reload([a_path])
+    except KconfigError:
+        pass
+    else:
+        fail("no error for syntax error in reloaded file")
+    verify_equal(config_state(c), old_state)
+
+    # Help texts that haven't been read in yet can't be read from the new
+    # version of the file after a failed reload
+    write_a("config A\n\tbool \"A\"\n\thelp\n\t  Help for A\n"
+            "config A_2\n\tbool \"A 2\"\n\thelp\n\t  Help for A 2\n")
+    c2 = Kconfig(kconfig_path, warn_to_stderr=False, reloadable=True,
+                 lazy_help=True)
+    verify_equal(c2.syms["A"].nodes[0].help, "Help for A")
+    write_a("\n\nconfig A\n\tbool \"A\"\n\thelp\n\t  Help for A\n"
+            "config A_2\n\tbool \"A 2\"\n\thelp\n\t  Help for A 2\nendif\n")
+    try:
+        c2.reload([a_path])
+    except KconfigError:
+        pass
+    else:
+        fail("no error for syntax error in reloaded file")
+    verify_equal(c2.syms["A"].nodes[0].help, "Help for A")
+    verify_equal(c2.syms["A_2"].nodes[0].help, None)
+
+    # Structural changes and symbols defined in multiple files trigger a full
+    # reparse
+    write_a("config A\n\tbool \"A\"\nconfig C\n\tstring\n")
+    verify_reload(c, [a_path], True)
+    write_a("config A\n\tbool \"A\"\n")
+    verify_reload(c, [a_path], True)
+    write_a("config A\n\tbool \"A\"\n$(EMPTY)\n")
+    verify_reload(c, [a_path], True)
+    write_a("config A\n\tbool \"A\"\n")
+    verify_reload(c, [a_path], True)
+    verify_reload(c, [a_path], False)
+
+    # Not reloadable
+    c = Kconfig(kconfig_path, warn_to_stderr=False)
+    verify_reload(c, [a_path], True)
+
+    shutil.rmtree(tmpdir)
+
+
+    # The server uses Python 3 socket APIs
+    if sys.version_info[0] >= 3:
+        print("Testing kconfigserver")
+
+        import kconfigserver
+        import threading
+
+        tmpdir = tempfile.mkdtemp()
+        kconfig_path = os.path.join(tmpdir, "Kconfig")
+        socket_path = os.path.join(tmpdir, "sock")
+
+        with open(kconfig_path, "w") as f:
+            f.write('config A\n\tbool "A"\nconfig B\n\tdef_bool A\n'
+                    'config N\n\tint "N"\n')
+
+        server = threading.Thread(target=kconfigserver.serve,
+                                  args=(kconfig_path, socket_path))
+        server.start()
+
+        # Wait for the server to start listening
+        while not os.path.exists(socket_path):
+            server.join(0.01)
+
+        client = kconfigserver.Client(socket_path)
+
+        verify_equal(client.eval_string("A || B"), "n")
+        verify_equal(client.set_values({"A": "y"}), [])
+        verify_equal(client.sym("B")["value"], "y")
+        verify_equal(client.sym("A")["user_value"], "y")
+        verify_equal(client.sym("N")["orig_type"], "int")
+
+        # No values are assigned if some value is invalid
+        verify_equal(client.set_values({"A": "n", "N": "foo"}), ["N"])
+        verify_equal(client.sym("A")["user_value"], "y")
+
+        client.snapshot()
+        client.set_values({"A": "n", "N": "3"})
+        client.restore()
+        verify_equal(client.sym("A")["user_value"], "y")
+        verify_equal(client.sym("N")["user_value"], None)
+
+        # Malformed requests get error responses
+        for request in b"[]\n", b'{"name": "A"}\n', b"{\n", b"\xff\xfe\n":
+            client._sock.sendall(request)
+            response = json.loads(client._file.readline().decode("utf-8"))
+            verify(not response["ok"],
+                   "no error for malformed request " + repr(request))
+
+        try:
+            client.sym("C")
+        except KconfigError:
+            pass
+        else:
+            fail("expected error for undefined symbol")
+
+        # Modifying a Kconfig file should trigger a reparse. User values are
+        # carried over.
+        with open(kconfig_path, "a") as f:
+            f.write('config C\n\tbool "C"\n\tdefault A\n')
+        st = os.stat(kconfig_path)
+        os.utime(kconfig_path, (st.st_atime, st.st_mtime + 10))
+        verify_equal(client.sym("C")["value"], "y")
+
+        client.request("shutdown")
+        client.close()
+        server.join()
+
+        verify(not os.path.exists(socket_path),
+               "socket not removed after shutdown")
+
+        shutil.rmtree(tmpdir)
+
+
     print("\nAll selftests passed\n" if all_passed else
           "\nSome selftests failed\n")
 